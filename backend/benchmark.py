@@ -0,0 +1,290 @@
+"""
+End-to-end load benchmark: drives /upload-images -> /generate-video -> /video/{id} at a set
+concurrency and reports jobs/hour, p50/p95 job latency and the server's peak RSS.
+
+Against a running server (pass --server-pid to also measure its memory):
+
+    python benchmark.py --url http://localhost:8000 --jobs 20 --concurrency 4
+
+Self-contained, starting mock_provider.py and the backend as subprocesses:
+
+    python benchmark.py --spawn --jobs 20 --concurrency 4 --clips 3
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+# How often job status and server memory are sampled
+POLL_INTERVAL = 0.5
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, or None without values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def _process_tree(pid: int) -> List[int]:
+    """pid and all of its descendants, e.g. the merge worker processes (Linux only)."""
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _status_kib(pid: int, field: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class MemorySampler:
+    """Peak resident memory of a server process: its own high-water mark and the sampled peak of its process tree."""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.peak_tree_kib = 0
+
+    def sample(self) -> None:
+        if self.pid:
+            total = sum(_status_kib(pid, "VmRSS") for pid in _process_tree(self.pid))
+            self.peak_tree_kib = max(self.peak_tree_kib, total)
+
+    async def run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def report(self) -> Dict[str, Optional[float]]:
+        if not self.pid:
+            return {"peak_rss_mib": None, "peak_tree_rss_mib": None}
+        return {
+            "peak_rss_mib": round(_status_kib(self.pid, "VmHWM") / 1024, 1),
+            "peak_tree_rss_mib": round(self.peak_tree_kib / 1024, 1),
+        }
+
+
+def sample_images(count: int) -> List[bytes]:
+    """Small distinct JPEGs to upload."""
+    images = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (640, 360), ((i * 70) % 256, (i * 130) % 256, (i * 200) % 256)).save(buffer, "JPEG")
+        images.append(buffer.getvalue())
+    return images
+
+
+async def run_job(http: httpx.AsyncClient, args: argparse.Namespace, images: List[bytes], index: int) -> Dict[str, Any]:
+    """One job end to end; returns its outcome and latency from upload to the downloaded video."""
+    started = time.perf_counter()
+    files = [("files", (f"bench_{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+    response = await http.post("/upload-images", files=files)
+    response.raise_for_status()
+    upload_id = response.json()["upload_id"]
+
+    # Unique prompts miss the clip cache, so every job really goes to the provider
+    run_id = "" if args.reuse_prompts else f" ({uuid.uuid4().hex[:8]})"
+    prompts = [f"Benchmark clip {i + 1}{run_id}" for i in range(len(images))]
+    payload = {
+        "uploadId": upload_id,
+        "prompts": prompts,
+        "provider": args.provider,
+        "apiKey": args.access_key,
+        "accessKeySecret": args.access_key_secret,
+        "groupId": args.group_id,
+    }
+    response = await http.post("/generate-video", json=payload)
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        response = await http.get(f"/jobs/{job_id}")
+        response.raise_for_status()
+        job = response.json()
+        if job["status"] in ("completed", "failed"):
+            break
+    if job["status"] == "failed":
+        return {"index": index, "job_id": job_id, "ok": False, "error": job["error"], "latency": time.perf_counter() - started}
+
+    size = 0
+    async with http.stream("GET", f"/video/{job_id}") as video:
+        video.raise_for_status()
+        async for chunk in video.aiter_bytes():
+            size += len(chunk)
+    return {"index": index, "job_id": job_id, "ok": True, "bytes": size, "latency": time.perf_counter() - started}
+
+
+async def run_benchmark(args: argparse.Namespace, server_pid: Optional[int]) -> Dict[str, Any]:
+    images = sample_images(args.clips)
+    sampler = MemorySampler(server_pid)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as http:
+        async def guarded(index: int) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(run_job(http, args, images, index), args.timeout)
+                except Exception as e:
+                    return {"index": index, "ok": False, "error": f"{type(e).__name__}: {e}", "latency": None}
+
+        sampling = asyncio.ensure_future(sampler.run())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(guarded(i) for i in range(args.jobs)))
+        elapsed = time.perf_counter() - started
+        sampling.cancel()
+        sampler.sample()
+
+    latencies = [r["latency"] for r in results if r["ok"]]
+    completed = len(latencies)
+    summary = {
+        "jobs": args.jobs,
+        "completed": completed,
+        "failed": args.jobs - completed,
+        "concurrency": args.concurrency,
+        "clips_per_job": args.clips,
+        "elapsed_seconds": round(elapsed, 2),
+        "jobs_per_hour": round(completed / elapsed * 3600, 1) if elapsed else None,
+        "latency_p50": _rounded(percentile(latencies, 50)),
+        "latency_p95": _rounded(percentile(latencies, 95)),
+        "latency_max": _rounded(max(latencies) if latencies else None),
+        **sampler.report(),
+        "errors": sorted({r["error"] for r in results if not r["ok"]}),
+    }
+    return summary
+
+
+def _rounded(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+
+def _wait_until_up(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def spawn_servers(args: argparse.Namespace, workdir: str) -> List[subprocess.Popen]:
+    """Start mock_provider.py and the backend on local ports, wired to each other, with state in workdir."""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    env = {
+        **os.environ,
+        "PYTHONPATH": backend_dir,
+        "MOCK_CLIPS_DIR": os.path.join(workdir, "mock_clips"),
+        "KLINGAI_BASE_URL": f"{mock_url}/kling/v1",
+        "MINIMAX_BASE_URL": f"{mock_url}/minimax/v1",
+        "MINIMAX_API_KEY": os.environ.get("MINIMAX_API_KEY", "mock-key"),
+        "MINIMAX_GROUP_ID": os.environ.get("MINIMAX_GROUP_ID", "mock-group"),
+        "RATE_LIMIT_ENABLED": "false",
+        "RATE_LIMIT_STORAGE_URI": f"sqlite:///{os.path.join(workdir, 'ratelimits.db')}",
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "IMAGE_CACHE_DB_PATH": os.path.join(workdir, "image_cache.db"),
+        "CLIP_CACHE_DIR": os.path.join(workdir, "clip_cache"),
+        "STORAGE_DIR": os.path.join(workdir, "storage"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+    uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+    mock = subprocess.Popen(uvicorn + ["--port", str(args.mock_port), "mock_provider:app"], cwd=workdir, env=env)
+    backend = subprocess.Popen(uvicorn + ["--port", str(args.port), "--workers", str(args.workers), "main:app"], cwd=workdir, env=env)
+    servers = [mock, backend]
+    try:
+        _wait_until_up(f"{mock_url}/stats")
+        _wait_until_up(f"{args.url}/api-providers")
+    except Exception:
+        stop_servers(servers)
+        raise
+    return servers
+
+
+def stop_servers(servers: List[subprocess.Popen]) -> None:
+    for server in servers:
+        server.terminate()
+    for server in servers:
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Backend base URL (default http://127.0.0.1:<port>)")
+    parser.add_argument("--jobs", type=int, default=10, help="Jobs to run in total")
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs in flight at once")
+    parser.add_argument("--clips", type=int, default=3, help="Images and prompts per job (1-6)")
+    parser.add_argument("--provider", default="kling", help="kling, minmax, a VIDEO_PROVIDERS id or auto")
+    parser.add_argument("--access-key", default="bench-access-key", help="Kling access key id (apiKey)")
+    parser.add_argument("--access-key-secret", default="bench-access-secret")
+    parser.add_argument("--group-id", default="bench-group", help="Minimax group id")
+    parser.add_argument("--reuse-prompts", action="store_true", help="Same prompts for every job, to measure clip cache hits")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds before a single job counts as failed")
+    parser.add_argument("--server-pid", type=int, help="Backend process to measure peak RSS of (Linux)")
+    parser.add_argument("--spawn", action="store_true", help="Start mock_provider.py and the backend as subprocesses")
+    parser.add_argument("--port", type=int, default=8765, help="Backend port with --spawn")
+    parser.add_argument("--mock-port", type=int, default=8766, help="Mock provider port with --spawn")
+    parser.add_argument("--workers", type=int, default=1, help="Backend worker processes with --spawn")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+    args.url = args.url or f"http://127.0.0.1:{args.port}"
+
+    servers: List[subprocess.Popen] = []
+    server_pid = args.server_pid
+    with tempfile.TemporaryDirectory(prefix="video-bench-") as workdir:
+        if args.spawn:
+            servers = spawn_servers(args, workdir)
+            server_pid = servers[1].pid
+        try:
+            summary = asyncio.run(run_benchmark(args, server_pid))
+        finally:
+            stop_servers(servers)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"Jobs:         {summary['completed']}/{summary['jobs']} completed at concurrency {summary['concurrency']}, "
+          f"{summary['clips_per_job']} clip(s) each, in {summary['elapsed_seconds']}s")
+    print(f"Throughput:   {summary['jobs_per_hour']} jobs/hour")
+    print(f"Latency:      p50 {summary['latency_p50']}s, p95 {summary['latency_p95']}s, max {summary['latency_max']}s")
+    if summary["peak_rss_mib"] is not None:
+        print(f"Peak RSS:     {summary['peak_rss_mib']} MiB (server), {summary['peak_tree_rss_mib']} MiB (with worker processes)")
+    for error in summary["errors"]:
+        print(f"Error:        {error}")
+
+
+if __name__ == "__main__":
+    main()
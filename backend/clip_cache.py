@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+from storage import TEMP_FILE_TTL, shard_path
+
+logger = logging.getLogger(__name__)
+
+CLIP_CACHE_DIR = os.getenv("CLIP_CACHE_DIR", "clip_cache")
+CLIP_CACHE_MAX_BYTES = int(os.getenv("CLIP_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clip_cache_key(provider: str, image_digest: str, prompt: str, params: Dict[str, Any]) -> str:
+    """Cache key for a generated clip: everything that determines what the provider returns."""
+    material = json.dumps(
+        {"provider": provider, "image": image_digest, "prompt": prompt, "params": params},
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    """Hard-link source to destination when possible (same filesystem), otherwise copy it."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ClipCache:
+    """
+    Content-addressed store of generated clips on local disk, shared by every worker using the
+    same directory. Once the clips on disk exceed max_bytes, the least recently used ones are
+    evicted; a clip's mtime records its last use, so every worker sees the same order.
+    """
+
+    def __init__(self, cache_dir: str = CLIP_CACHE_DIR, max_bytes: int = CLIP_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Serialises this process's evictions; other workers' sweeps race harmlessly
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith(".mp4") and os.path.isfile(path):
+                # Written before the sharded layout: move it into its shard
+                key = name[:-len(".mp4")]
+                os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+                os.replace(path, self._path(key))
+
+    def _path(self, key: str) -> str:
+        # Sharded, so lookups stay fast with many thousands of cached clips
+        return shard_path(self.cache_dir, f"{key}.mp4")
+
+    def get(self, key: str, destination: str) -> bool:
+        """Place the cached clip for key at destination. Returns False on a miss."""
+        path = self._path(key)
+        try:
+            _link_or_copy(path, destination)
+            # The file's mtime records recency for every worker and across restarts
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key: str, clip_path: str) -> None:
+        """Store a copy of clip_path under key and evict old clips if over budget."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = os.path.join(os.path.dirname(path), f".{uuid.uuid4()}.tmp")
+        _link_or_copy(clip_path, temp_path)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._evict(keep=path)
+
+    def _evict(self, keep: str) -> None:
+        """Remove the least recently used clips until the whole directory fits max_bytes."""
+        now = time.time()
+        total = 0
+        entries = []
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp"):
+                    # A put in progress in some worker, or one that never finished
+                    if now - stat.st_mtime > TEMP_FILE_TTL:
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass
+                        continue
+                total += stat.st_size
+                if name.endswith(".mp4") and path != keep:
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug("Evicted cached clip", extra={"cache_key": os.path.basename(path)[:-len(".mp4")], "bytes": size})
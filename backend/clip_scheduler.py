@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from clip_cache import hash_file
+from job_checkpoints import restored_clip
+from job_events import ClipProgressCallback
+from job_store import JobLeaseLost
+from metrics import CLIPS, observe
+from providers import Credentials, VideoProvider
+from retry import CLIP_FAILURE_POLICY, ClipAttemptError, run_clip
+
+logger = logging.getLogger(__name__)
+
+# prepare_image(image_path, provider kind) -> path of the image to submit
+ImagePreparer = Callable[[str, str], Awaitable[str]]
+
+
+def least_loaded(providers: Sequence[VideoProvider], credentials: Credentials) -> VideoProvider:
+    """
+    The provider whose account has the most free clip slots; ties go to the earlier one.
+    Callers enter the provider's limiter without awaiting anything in between, so the next
+    clip already sees this one counted in the load.
+    """
+    return min(providers, key=lambda provider: provider.load(provider.credentials_for(credentials)))
+
+
+async def clip_cache_keys(providers: Sequence[VideoProvider], image_path: str, prompt: str) -> Dict[str, str]:
+    """
+    Clip cache key of the image and prompt per provider with a clip cache, hashing the image once.
+    Empty when no provider caches clips, or the image is gone (a task resumed on another node).
+    """
+    caching = [provider for provider in providers if provider.clip_cache]
+    if not caching or not os.path.exists(image_path):
+        return {}
+    image_digest = await asyncio.to_thread(hash_file, image_path)
+    return {provider.name: provider.clip_cache_key(image_digest, prompt) for provider in caching}
+
+
+async def find_cached_clip(providers: Sequence[VideoProvider], cache_keys: Dict[str, str]) -> Tuple[Optional[VideoProvider], Optional[str]]:
+    """A clip any of the providers generated earlier for the same image and prompt, as (provider, path)."""
+    for provider in providers:
+        if provider.name in cache_keys:
+            cached_path = await provider.cached_clip(cache_keys[provider.name])
+            if cached_path:
+                return provider, cached_path
+    return None, None
+
+
+async def generate_clips(
+    providers: Sequence[VideoProvider],
+    image_paths: List[str],
+    prompts: List[str],
+    credentials: Credentials,
+    on_clip_ready: Optional[Callable[[int, Optional[str]], Awaitable[None]]] = None,
+    on_clip_progress: Optional[Callable[[int], ClipProgressCallback]] = None,
+    job_id: Optional[str] = None,
+    checkpoints: Optional[Dict[int, Dict[str, Any]]] = None,
+    prepare_image: Optional[ImagePreparer] = None,
+    before_submit: Optional[Callable[[], Awaitable[None]]] = None,
+) -> List[str]:
+    """
+    Generate a job's clips concurrently, spread over providers: every submission goes to the
+    provider whose account is least loaded at that moment, so one job's clips run on several
+    providers or accounts at once when one alone would queue them.
+
+    Clips are looked up in the clip cache and preprocessed before a provider is chosen, then
+    admitted through its account's limiter, which caps clips in flight across all jobs and
+    takes jobs (job_id) in turn. Transient failures are retried per clip (and slow
+    clips optionally hedged), possibly on another provider; a submitted task is always
+    resumed on the provider that owns it.
+    on_clip_ready(index, path) is awaited as each clip finishes, with path None for a failed clip.
+    on_clip_progress(index) returns the progress callback for that clip; its details name the provider.
+    checkpoints (clip index -> saved task state) resumes an interrupted batch: downloaded clips
+    are reused and submitted tasks are polled again rather than resubmitted.
+    before_submit() is awaited right before each new provider task is submitted; a
+    JobLeaseLost it raises stops the whole batch without marking any clip failed.
+    Clips that still fail are skipped, or abort the batch when CLIP_FAILURE_POLICY is "abort";
+    returns the successful paths in prompt order.
+    """
+    if len(image_paths) != len(prompts):
+        raise ValueError("Number of images must match number of prompts")
+    if not providers:
+        raise ValueError("No video provider available for this job")
+
+    by_name = {provider.name: provider for provider in providers}
+    batch_id = job_id or uuid.uuid4().hex
+
+    async def generate_one(i: int, image_path: str, prompt: str) -> Optional[str]:
+        checkpoint = (checkpoints or {}).get(i)
+        video_path = restored_clip(checkpoint)
+        on_progress = on_clip_progress(i) if on_clip_progress else (lambda state, details: None)
+        # Provider of each submitted task, so a retry resumes the task where it runs
+        task_providers: Dict[str, VideoProvider] = {}
+        resume_task = checkpoint["task_id"] if checkpoint else None
+        if resume_task:
+            # Checkpoints from before providers were recorded belong to the job's only provider
+            owner = by_name.get(checkpoint["provider"]) if checkpoint.get("provider") else providers[0]
+            if owner:
+                task_providers[resume_task] = owner
+            else:
+                # The provider that ran the task is no longer configured: submit afresh
+                resume_task = None
+        last_provider = task_providers.get(resume_task) or least_loaded(providers, credentials)
+        # The image as prepared for each provider kind, so any provider can take a new task
+        prepared: Dict[str, str] = {}
+        cache_keys: Dict[str, str] = {}
+
+        async def prepare(provider: VideoProvider) -> None:
+            with observe("preprocess", provider.name):
+                prepared[provider.kind] = await prepare_image(image_path, provider.kind)
+
+        async def attempt(task_id: Optional[str], started: asyncio.Event) -> str:
+            nonlocal last_provider
+            if task_id not in task_providers:
+                task_id = None
+            if task_id is None and prepare_image:
+                # Before a provider is chosen: while this awaits, other clips pick providers too
+                first_of_kind = {provider.kind: provider for provider in reversed(providers)}
+                await asyncio.gather(*(prepare(provider) for kind, provider in first_of_kind.items() if kind not in prepared))
+            # Chosen and admitted with no await in between, so concurrent clips spread over providers
+            provider = task_providers[task_id] if task_id is not None else least_loaded(providers, credentials)
+            last_provider = provider
+            provider_credentials = provider.credentials_for(credentials)
+            submitted = task_id
+
+            def report(state: str, details: Dict[str, Any]) -> None:
+                nonlocal submitted
+                if "task_id" in details:
+                    submitted = details["task_id"]
+                    task_providers[submitted] = provider
+                on_progress(state, {**details, "provider": provider.name})
+
+            async with provider.limiter.admit(provider.account_key(provider_credentials), batch_id):
+                started.set()
+                try:
+                    if before_submit and task_id is None:
+                        await before_submit()
+                    video_path = await provider.generate_video(
+                        prepared.get(provider.kind, image_path), prompt, provider_credentials, report,
+                        task_id=task_id, cache_key=cache_keys.get(provider.name),
+                    )
+                    CLIPS.inc(provider=provider.name, outcome="succeeded")
+                    logger.info("Video %d generated successfully: %s", i + 1, video_path, extra={"provider": provider.name})
+                    return video_path
+                except Exception as e:
+                    # Lets a retry poll the same task again instead of submitting a new one
+                    raise ClipAttemptError(submitted, e) from e
+
+        def on_retry(retry: int, error: BaseException) -> None:
+            logger.warning("Retrying video %d (retry %d) after: %s", i + 1, retry, error, extra={"provider": last_provider.name})
+            CLIPS.inc(provider=last_provider.name, outcome="retried")
+            on_progress("retrying", {"retry": retry, "error": str(error), "provider": last_provider.name})
+
+        if checkpoint and checkpoint["status"] == "failed" and video_path is None:
+            error = Exception(checkpoint["error"] or f"Video {i+1} failed before the restart")
+        elif video_path is None:
+            # Retry and hedging settings of the provider the clip starts on
+            policy_provider = last_provider
+            try:
+                cache_keys.update(await clip_cache_keys(providers, image_path, prompt))
+                # A resumed task was submitted already; otherwise a cache hit skips preprocessing and the providers
+                cached_provider, video_path = (None, None) if resume_task else await find_cached_clip(providers, cache_keys)
+                if cached_provider:
+                    last_provider = cached_provider
+                    on_progress("succeed", {"cached": True, "provider": cached_provider.name})
+                else:
+                    video_path = await run_clip(
+                        attempt,
+                        policy_provider.retry_policy,
+                        task_id=resume_task,
+                        hedge_after=policy_provider.retry_policy.hedge_delay(policy_provider.polling_policy.completion_p95()),
+                        on_retry=on_retry,
+                        on_hedge=lambda: CLIPS.inc(provider=policy_provider.name, outcome="hedged"),
+                    )
+            except JobLeaseLost:
+                raise
+            except Exception as e:
+                CLIPS.inc(provider=last_provider.name, outcome="failed")
+                logger.error("Failed to generate video %d for image %s: %s", i + 1, image_path, e, extra={"provider": last_provider.name})
+                on_progress("failed", {"error": str(e), "provider": last_provider.name})
+                error = e
+        else:
+            CLIPS.inc(provider=last_provider.name, outcome="restored")
+        if video_path is None and CLIP_FAILURE_POLICY == "abort":
+            raise error
+        if on_clip_ready:
+            await on_clip_ready(i, video_path)
+        return video_path
+
+    logger.info("Generating videos for %d images using %s", len(image_paths), ", ".join(by_name))
+    tasks = [
+        asyncio.ensure_future(generate_one(i, image_path, prompt))
+        for i, (image_path, prompt) in enumerate(zip(image_paths, prompts))
+    ]
+    try:
+        generated_videos = await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    successful_videos = [v for v in generated_videos if v is not None]
+    if not successful_videos:
+        raise Exception("All video generations failed.")
+
+    logger.info("Finished generating videos: %d/%d succeeded", len(successful_videos), len(image_paths))
+    return successful_videos
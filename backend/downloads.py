@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import re
+from typing import BinaryIO, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Size of each chunk written to disk while streaming a clip
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# How many times an interrupted download is resumed with an HTTP Range request
+DOWNLOAD_MAX_RESUMES = int(os.getenv("DOWNLOAD_MAX_RESUMES", "3"))
+
+
+class IncompleteDownloadError(Exception):
+    """Raised when a download ends with fewer bytes than the server announced."""
+
+
+def _request_headers(offset: int) -> Dict[str, str]:
+    # The body is written as it arrives (aiter_raw), and Range offsets count unencoded bytes,
+    # so the server must not compress it
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    return headers
+
+
+def _expected_size(status_code: int, headers, offset: int) -> Optional[int]:
+    """Total size of the resource, from Content-Range on 206 or Content-Length on 200."""
+    if status_code == 206:
+        match = re.match(r"bytes \d+-\d+/(\d+)", headers.get("Content-Range", ""))
+        if match:
+            return int(match.group(1))
+        content_length = headers.get("Content-Length")
+        return offset + int(content_length) if content_length else None
+    content_length = headers.get("Content-Length")
+    return int(content_length) if content_length else None
+
+
+def _prepare_offset(f: BinaryIO, status_code: int, offset: int) -> int:
+    """Rewind the part file when the server ignored our Range header and sent the whole body."""
+    if offset and status_code != 206:
+        f.seek(0)
+        f.truncate()
+        return 0
+    return offset
+
+
+def _discard(part_path: str) -> None:
+    try:
+        os.remove(part_path)
+    except OSError:
+        pass
+
+
+def _finish(part_path: str, output_path: str, written: int, expected: Optional[int]) -> int:
+    if expected is not None and written != expected:
+        raise IncompleteDownloadError(f"Downloaded {written} of {expected} bytes")
+    os.replace(part_path, output_path)
+    return written
+
+
+async def async_download_to_file(
+    http: httpx.AsyncClient,
+    url: str,
+    output_path: str,
+    on_progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> int:
+    """
+    Stream url to output_path with a pooled httpx client.
+    on_progress(bytes_written, total_bytes) is called after each chunk; total_bytes may be None.
+    """
+    part_path = f"{output_path}.part"
+    written = 0
+    expected = None
+    try:
+        with open(part_path, "wb") as f:
+            for attempt in range(DOWNLOAD_MAX_RESUMES + 1):
+                try:
+                    async with http.stream("GET", url, headers=_request_headers(written)) as response:
+                        response.raise_for_status()
+                        written = _prepare_offset(f, response.status_code, written)
+                        expected = _expected_size(response.status_code, response.headers, written)
+                        async for chunk in response.aiter_raw(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            # Keep disk writes off the event loop
+                            await asyncio.to_thread(f.write, chunk)
+                            written += len(chunk)
+                            if on_progress:
+                                on_progress(written, expected)
+                    if expected is None or written >= expected:
+                        break
+                except httpx.TransportError as e:
+                    if attempt == DOWNLOAD_MAX_RESUMES:
+                        raise
+                    logger.warning("Download interrupted, resuming: %s", e, extra={"bytes": written})
+        return _finish(part_path, output_path, written, expected)
+    except BaseException:
+        # Never leave a half-written clip behind
+        _discard(part_path)
+        raise
@@ -0,0 +1,20 @@
+import os
+import httpx
+
+
+def create_async_http_client(env_prefix: str) -> httpx.AsyncClient:
+    """
+    Create the pooled async HTTP client shared by all requests to one provider.
+    Pool limits and timeouts are read from <env_prefix>_* environment variables,
+    e.g. KLINGAI_POOL_MAX_CONNECTIONS or MINIMAX_HTTP_TIMEOUT.
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv(f"{env_prefix}_POOL_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv(f"{env_prefix}_POOL_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv(f"{env_prefix}_KEEPALIVE_EXPIRY", "30")),
+    )
+    timeout = httpx.Timeout(
+        float(os.getenv(f"{env_prefix}_HTTP_TIMEOUT", "60")),
+        connect=float(os.getenv(f"{env_prefix}_CONNECT_TIMEOUT", "10")),
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import time
+from typing import Optional
+
+from sqlite_db import connect, prepare_database
+from storage import ASSETS, ArtifactStore, artifact_store
+
+IMAGE_CACHE_DB_PATH = os.getenv("IMAGE_CACHE_DB_PATH", "image_cache.db")
+IMAGE_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", "3600"))
+
+
+class ImageAssetCache:
+    """
+    Per-image-digest cache of provider-side artifacts, such as the Kling Base64 payload
+    or the URL Minimax returned for an uploaded image. Entries expire after a TTL.
+    Values are files in the artifact store, which also sweeps them; a SQLite table shared by
+    every worker process on the host records which entries exist and when they expire.
+    """
+
+    def __init__(self, db_path: str = IMAGE_CACHE_DB_PATH, ttl_seconds: float = IMAGE_CACHE_TTL_SECONDS, store: ArtifactStore = artifact_store):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        prepare_database(db_path)
+        with connect(db_path) as conn:
+            # Databases from before the values moved to files held them inline; it is only a cache
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(image_assets)")}
+            if "value" in columns:
+                conn.execute("DROP TABLE image_assets")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS image_assets (
+                    digest TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (digest, kind)
+                )
+                """
+            )
+        self.purge_expired()
+
+    def _path(self, digest: str, kind: str) -> str:
+        # Kinds may hold characters that are not safe in file names, e.g. minimax_url:<group id>
+        name = hashlib.sha256(f"{digest}\0{kind}".encode("utf-8")).hexdigest()
+        return self.store.path(ASSETS, name)
+
+    def get(self, digest: str, kind: str) -> Optional[str]:
+        """Return the cached value of kind for an image digest, or None if missing or expired."""
+        with connect(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM image_assets WHERE digest = ? AND kind = ? AND expires_at > ?",
+                (digest, kind, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._path(digest, kind), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Swept from the artifact store before the entry expired
+            return None
+
+    def put(self, digest: str, kind: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        """Cache value as kind for an image digest, and drop the entries that have expired."""
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self.store.atomic_write(self._path(digest, kind)) as temp_path:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(value)
+        with connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO image_assets (digest, kind, expires_at) VALUES (?, ?, ?)",
+                (digest, kind, expires_at),
+            )
+        self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """Delete expired entries and their files. Returns the number removed."""
+        now = time.time()
+        with connect(self.db_path) as conn:
+            rows = conn.execute("SELECT digest, kind FROM image_assets WHERE expires_at <= ?", (now,)).fetchall()
+            conn.execute("DELETE FROM image_assets WHERE expires_at <= ?", (now,))
+        for digest, kind in rows:
+            try:
+                os.remove(self._path(digest, kind))
+            except FileNotFoundError:
+                pass
+        return len(rows)
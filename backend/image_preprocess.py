@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from PIL import Image, ImageOps
+
+from clip_cache import hash_file
+from storage import PREPROCESSED, ArtifactStore, artifact_store
+
+logger = logging.getLogger(__name__)
+
+# Downscale and re-encode images before they are sent to a provider
+IMAGE_PREPROCESSING = os.getenv("IMAGE_PREPROCESSING", "true").lower() == "true"
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+# JPEG or WEBP
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "90"))
+
+# Longest image side each provider can make use of; larger images only inflate the upload
+PROVIDER_MAX_SIDE = {
+    "kling": int(os.getenv("KLINGAI_IMAGE_MAX_SIDE", "1920")),
+    "minimax": int(os.getenv("MINIMAX_IMAGE_MAX_SIDE", "1920")),
+}
+
+_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+
+def preprocess_image(source_path: str, output_path: str, max_side: int, image_format: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> None:
+    """
+    Decode an image once, keep only its first frame, apply the EXIF orientation, downscale it so
+    the longest side is at most max_side, and re-encode it without metadata.
+    """
+    with Image.open(source_path) as image:
+        # Animated GIFs: providers only use a still frame
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            # Flatten transparency onto white, since JPEG has no alpha channel
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        # Saving without exif/icc_profile drops the source metadata
+        image.save(output_path, format=image_format, quality=quality, optimize=True)
+
+
+class ImagePreprocessor:
+    """
+    Prepares uploaded images for a provider on a worker pool, caching the result per image
+    digest and provider in the artifact store so the same image is only processed once.
+    """
+
+    def __init__(self, store: ArtifactStore = artifact_store, max_workers: int = IMAGE_PREPROCESS_WORKERS):
+        self.store = store
+        # Pillow releases the GIL while decoding, resizing and encoding, so threads run in parallel
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="image")
+        # Output path -> in-flight work, so concurrent requests for one image share it
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def prepare(self, image_path: str, provider: str) -> str:
+        """Return the path of the preprocessed image, falling back to the original if it cannot be decoded."""
+        loop = asyncio.get_running_loop()
+        max_side = PROVIDER_MAX_SIDE.get(provider, max(PROVIDER_MAX_SIDE.values()))
+        digest = await loop.run_in_executor(self._pool, hash_file, image_path)
+        extension = _EXTENSIONS.get(IMAGE_FORMAT, ".jpg")
+        output_path = self.store.path(PREPROCESSED, f"{digest}_{max_side}_{IMAGE_QUALITY}{extension}")
+        if os.path.exists(output_path):
+            self.store.touch(output_path)
+            return output_path
+
+        pending = self._pending.get(output_path)
+        if pending is None:
+            pending = loop.run_in_executor(self._pool, self._preprocess, image_path, output_path, max_side)
+            self._pending[output_path] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(output_path, None))
+        try:
+            await asyncio.shield(pending)
+        except Exception as e:
+            logger.warning("Could not preprocess %s, sending it unchanged: %s", image_path, e)
+            return image_path
+        return output_path
+
+    def _preprocess(self, image_path: str, output_path: str, max_side: int) -> None:
+        # Written under a temp name, so other workers never see a partial image and a failed save leaves nothing behind
+        with self.store.atomic_write(output_path) as temp_path:
+            preprocess_image(image_path, temp_path, max_side)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,164 @@
+import base64
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from sqlite_db import connect, prepare_database
+
+logger = logging.getLogger(__name__)
+
+# Keep job credentials, encrypted, until the job ends, so a restarted server can resume polling for it.
+# Off by default: the provider secrets then only live in the memory of the worker running the job
+JOB_PERSIST_CREDENTIALS = os.getenv("JOB_PERSIST_CREDENTIALS", "false").lower() == "true"
+# Server secret the persisted credentials are encrypted with; without it nothing is persisted
+JOB_CREDENTIALS_KEY = os.getenv("JOB_CREDENTIALS_KEY", "")
+
+# Clip checkpoint states besides the provider task states (submitted, processing, succeed, failed)
+CLIP_READY = "ready"
+
+
+class CredentialCipher:
+    """
+    Fernet (AES-128-CBC with an HMAC-SHA256 tag) under a key derived from the server key with
+    HKDF-SHA256. The server key is a random secret, not a password, so HKDF needs no work factor.
+    """
+
+    def __init__(self, key: str):
+        derived = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"job-credentials").derive(key.encode("utf-8"))
+        self._fernet = Fernet(base64.urlsafe_b64encode(derived))
+
+    def encrypt(self, plaintext: bytes) -> str:
+        return self._fernet.encrypt(plaintext).decode("ascii")
+
+    def decrypt(self, token: str) -> Optional[bytes]:
+        """The plaintext, or None if the token was not sealed with this key or was altered."""
+        try:
+            return self._fernet.decrypt(token.encode("ascii"))
+        except (InvalidToken, UnicodeEncodeError):
+            return None
+
+
+class JobCheckpointStore:
+    """
+    SQLite checkpoints of each clip's provider task: task id, last known status and the
+    downloaded file. After a restart, unfinished clips resume from their task id instead
+    of being submitted (and paid for) again.
+    """
+
+    def __init__(self, db_path: str, persist_credentials: bool = JOB_PERSIST_CREDENTIALS, credentials_key: str = JOB_CREDENTIALS_KEY):
+        self.db_path = db_path
+        self._cipher = CredentialCipher(credentials_key) if persist_credentials and credentials_key else None
+        if persist_credentials and not credentials_key:
+            logger.warning("JOB_PERSIST_CREDENTIALS is on but JOB_CREDENTIALS_KEY is empty; credentials are not persisted")
+        prepare_database(db_path)
+        with connect(db_path) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_clips (
+                    job_id TEXT NOT NULL,
+                    clip_index INTEGER NOT NULL,
+                    task_id TEXT,
+                    provider TEXT,
+                    status TEXT NOT NULL,
+                    video_path TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, clip_index)
+                )
+                """
+            )
+            # Databases from before clips recorded the provider that runs their task
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(job_clips)")}
+            if "provider" not in columns:
+                conn.execute("ALTER TABLE job_clips ADD COLUMN provider TEXT")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_credentials (
+                    job_id TEXT PRIMARY KEY,
+                    credentials TEXT NOT NULL
+                )
+                """
+            )
+            if self._cipher is None:
+                # Drop whatever an earlier configuration stored, including plaintext rows from older versions
+                conn.execute("DELETE FROM job_credentials")
+
+    def record_clip(
+        self,
+        job_id: str,
+        clip_index: int,
+        status: str,
+        task_id: Optional[str] = None,
+        video_path: Optional[str] = None,
+        error: Optional[str] = None,
+        provider: Optional[str] = None,
+    ) -> None:
+        """Save a clip's new status; fields passed as None keep their previous value."""
+        with connect(self.db_path) as conn:
+            conn.execute(
+                """
+                INSERT INTO job_clips (job_id, clip_index, task_id, provider, status, video_path, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (job_id, clip_index) DO UPDATE SET
+                    task_id = COALESCE(excluded.task_id, task_id),
+                    provider = COALESCE(excluded.provider, provider),
+                    status = excluded.status,
+                    video_path = COALESCE(excluded.video_path, video_path),
+                    error = COALESCE(excluded.error, error),
+                    updated_at = excluded.updated_at
+                """,
+                (job_id, clip_index, task_id, provider, status, video_path, error, time.time()),
+            )
+
+    def get_clips(self, job_id: str) -> Dict[int, Dict[str, Any]]:
+        """Checkpoints of a job's clips, by clip index."""
+        with connect(self.db_path) as conn:
+            rows = conn.execute("SELECT * FROM job_clips WHERE job_id = ?", (job_id,)).fetchall()
+        return {row["clip_index"]: dict(row) for row in rows}
+
+    def save_credentials(self, job_id: str, credentials: Dict[str, str]) -> None:
+        """
+        Keep a job's provider credentials, encrypted with JOB_CREDENTIALS_KEY, until
+        clear_credentials. Does nothing unless JOB_PERSIST_CREDENTIALS is on and a key is set.
+        """
+        if self._cipher is None or not credentials:
+            return
+        with connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_credentials (job_id, credentials) VALUES (?, ?)",
+                (job_id, self._cipher.encrypt(json.dumps(credentials).encode("utf-8"))),
+            )
+
+    def get_credentials(self, job_id: str) -> Optional[Dict[str, str]]:
+        """A job's persisted credentials, or None if none were kept or they no longer decrypt."""
+        if self._cipher is None:
+            return None
+        with connect(self.db_path) as conn:
+            row = conn.execute("SELECT credentials FROM job_credentials WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        plaintext = self._cipher.decrypt(row[0])
+        if plaintext is None:
+            # Written in plaintext by an older version or under another key
+            logger.warning("Discarding saved credentials that do not decrypt", extra={"job_id": job_id})
+            return None
+        return json.loads(plaintext)
+
+    def clear_credentials(self, job_id: str) -> None:
+        """Forget a job's credentials once it can no longer be resumed."""
+        with connect(self.db_path) as conn:
+            conn.execute("DELETE FROM job_credentials WHERE job_id = ?", (job_id,))
+
+
+def restored_clip(checkpoint: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Path of a clip that was already downloaded before a restart, if the file is still there."""
+    if checkpoint and checkpoint["status"] == CLIP_READY and checkpoint["video_path"]:
+        if os.path.exists(checkpoint["video_path"]):
+            return checkpoint["video_path"]
+    return None
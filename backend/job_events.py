@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+from job_store import JOB_COMPLETED, JOB_FAILED
+
+# Seconds a finished job's events are kept for late subscribers
+JOB_EVENTS_RETENTION = float(os.getenv("JOB_EVENTS_RETENTION", "300"))
+# Seconds between keep-alive comments on an idle event stream
+JOB_EVENTS_HEARTBEAT = float(os.getenv("JOB_EVENTS_HEARTBEAT", "15"))
+# Seconds between job store reads when streaming a job that runs in another worker
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "1"))
+
+# Events after which a job's stream ends; "handoff" means another worker runs the job now
+TERMINAL_EVENTS = ("ready", "failed", "handoff")
+
+# Per-clip progress reported by the provider clients: (state, details)
+ClipProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class JobEventBus:
+    """
+    In-process publish/subscribe of job progress events. Every event is also kept in a
+    per-job history, so a client that connects late first receives what it missed.
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, retention: float = JOB_EVENTS_RETENTION):
+        self.retention = retention
+        self._history: Dict[str, List[Dict[str, Any]]] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    def publish(self, job_id: str, event_type: str, **data: Any) -> None:
+        """Record an event for job_id and deliver it to every open stream."""
+        event = {"type": event_type, "job_id": job_id, "time": time.time(), **data}
+        self._history.setdefault(job_id, []).append(event)
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(event)
+        if event_type in TERMINAL_EVENTS:
+            asyncio.get_running_loop().call_later(self.retention, self._history.pop, job_id, None)
+
+    def hand_off(self, job_id: str, **data: Any) -> None:
+        """
+        End the job's open streams with a handoff event and forget its events: another worker
+        runs the job now, so later subscribers must follow it through the job store instead.
+        """
+        event = {"type": "handoff", "job_id": job_id, "time": time.time(), **data}
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(event)
+        self._history.pop(job_id, None)
+
+    def clip_progress(self, job_id: str, index: int) -> ClipProgressCallback:
+        """Callback that publishes a provider client's progress for one clip of a job."""
+        def report(state: str, details: Dict[str, Any]) -> None:
+            self.publish(job_id, "clip", index=index, state=state, **details)
+        return report
+
+    def has_events(self, job_id: str) -> bool:
+        return job_id in self._history
+
+    async def subscribe(self, job_id: str, heartbeat: float = JOB_EVENTS_HEARTBEAT) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield the job's past events, then live ones, until a terminal event.
+        Yields None after heartbeat seconds without an event so the caller can keep the connection alive.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        # Snapshot and register in one step, so no event is missed or repeated
+        backlog = list(self._history.get(job_id, ()))
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            for event in backlog:
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+
+async def poll_job_events(
+    job_id: str,
+    load_job: Callable[[str], Optional[Dict[str, Any]]],
+    load_clips: Callable[[str], Dict[int, Dict[str, Any]]],
+    interval: float = JOB_EVENTS_POLL_INTERVAL,
+    heartbeat: float = JOB_EVENTS_HEARTBEAT,
+) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """
+    Events of a job running in another worker, rebuilt from the shared job store: status
+    changes, clip state changes (without download progress) and the final ready or failed
+    event. Yields None like subscribe when nothing changed for heartbeat seconds.
+    """
+    status = None
+    clip_states: Dict[int, str] = {}
+    quiet_since = time.monotonic()
+    while True:
+        job = await asyncio.to_thread(load_job, job_id)
+        if job is None:
+            return
+        events = []
+        if job["status"] != status:
+            status = job["status"]
+            events.append({"type": "status", "job_id": job_id, "time": time.time(), "status": status})
+        clips = await asyncio.to_thread(load_clips, job_id)
+        for index, clip in sorted(clips.items()):
+            if clip_states.get(index) != clip["status"]:
+                clip_states[index] = clip["status"]
+                events.append({
+                    "type": "clip", "job_id": job_id, "time": time.time(), "index": index,
+                    "state": clip["status"], "task_id": clip["task_id"], "provider": clip["provider"],
+                })
+        if status == JOB_COMPLETED:
+            events.append({"type": "ready", "job_id": job_id, "time": time.time(), "video_url": f"/video/{job_id}"})
+        elif status == JOB_FAILED:
+            events.append({"type": "failed", "job_id": job_id, "time": time.time(), "error": job["error"]})
+
+        for event in events:
+            yield event
+            if event["type"] in TERMINAL_EVENTS:
+                return
+        if events:
+            quiet_since = time.monotonic()
+        elif time.monotonic() - quiet_since >= heartbeat:
+            quiet_since = time.monotonic()
+            yield None
+        await asyncio.sleep(interval)
+
+
+def format_sse(event: Optional[Dict[str, Any]]) -> str:
+    """Encode an event as a server-sent event frame, or a keep-alive comment for None."""
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,173 @@
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlite_db import connect, prepare_database
+
+# Job lifecycle states
+JOB_QUEUED = "queued"
+JOB_GENERATING = "generating"
+JOB_MERGING = "merging"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+ACTIVE_JOB_STATES = (JOB_QUEUED, JOB_GENERATING, JOB_MERGING)
+
+
+class JobLeaseLost(Exception):
+    """Another worker has taken over a job, so this worker must stop working on it."""
+
+
+class JobStore:
+    """
+    SQLite-backed store for video generation jobs, so job state survives restarts and is
+    shared by every worker process using the same database file.
+
+    The worker running a job holds a lease on it, renewed while it runs; a job whose lease
+    has expired (its worker died) is taken over by the first worker to claim it.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        prepare_database(db_path)
+        with connect(db_path) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    prompts TEXT NOT NULL,
+                    image_paths TEXT NOT NULL,
+                    output_path TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    lease_expires REAL,
+                    node_url TEXT
+                )
+                """
+            )
+            # Databases from before jobs had owners
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("lease_expires", "REAL"), ("node_url", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    def create_job(
+        self,
+        job_id: str,
+        provider: str,
+        prompts: List[str],
+        image_paths: List[str],
+        owner: Optional[str] = None,
+        lease_seconds: float = 0,
+        node_url: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Insert a new job in the queued state, leased to owner, and return it."""
+        now = time.time()
+        with connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, provider, status, prompts, image_paths, created_at, updated_at, owner, lease_expires, node_url) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, provider, JOB_QUEUED, json.dumps(prompts), json.dumps(image_paths), now, now, owner, now + lease_seconds, node_url),
+            )
+        return self.get_job(job_id)
+
+    def update_job(self, job_id: str, owned_by: Optional[str] = None, **fields: Any) -> None:
+        """
+        Update the given columns of a job, e.g. update_job(job_id, status=JOB_MERGING).
+        With owned_by, only while that worker owns the job: raises JobLeaseLost once another
+        worker has claimed it, so a stale worker cannot overwrite the new owner's progress.
+        """
+        if not fields:
+            return
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        owner_filter = " AND owner = ?" if owned_by is not None else ""
+        parameters = (owned_by,) if owned_by is not None else ()
+        with connect(self.db_path) as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE job_id = ?{owner_filter}",
+                (*fields.values(), job_id, *parameters),
+            )
+        if owned_by is not None and cursor.rowcount == 0:
+            raise JobLeaseLost(f"Job {job_id} was taken over by another worker")
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job as a dict, or None if it does not exist."""
+        with connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["prompts"] = json.loads(job["prompts"])
+        job["image_paths"] = json.loads(job["image_paths"])
+        return job
+
+    def claim_job(self, job_id: str, owner: str, lease_seconds: float, node_url: Optional[str] = None) -> bool:
+        """
+        Take over an active job whose lease has expired or that never had an owner.
+        Returns False when another worker holds it, so only one worker resumes a job.
+        """
+        now = time.time()
+        placeholders = ", ".join("?" for _ in ACTIVE_JOB_STATES)
+        with connect(self.db_path) as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET owner = ?, lease_expires = ?, node_url = ? "
+                f"WHERE job_id = ? AND status IN ({placeholders}) AND (lease_expires IS NULL OR lease_expires <= ?)",
+                (owner, now + lease_seconds, node_url, job_id, *ACTIVE_JOB_STATES, now),
+            )
+        return cursor.rowcount == 1
+
+    def renew_lease(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Extend one job's lease if owner still holds it; False once another worker has claimed it."""
+        placeholders = ", ".join("?" for _ in ACTIVE_JOB_STATES)
+        with connect(self.db_path) as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND owner = ? AND status IN ({placeholders})",
+                (time.time() + lease_seconds, job_id, owner, *ACTIVE_JOB_STATES),
+            )
+        return cursor.rowcount == 1
+
+    def renew_leases(self, owner: str, lease_seconds: float, job_ids: Iterable[str] = ()) -> List[str]:
+        """
+        Extend the leases of owner's active jobs. Returns those of job_ids (the jobs owner
+        is running) that another worker has claimed meanwhile, which owner must stop.
+        """
+        placeholders = ", ".join("?" for _ in ACTIVE_JOB_STATES)
+        job_ids = list(job_ids)
+        with connect(self.db_path) as conn:
+            conn.execute(
+                f"UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status IN ({placeholders})",
+                (time.time() + lease_seconds, owner, *ACTIVE_JOB_STATES),
+            )
+            if not job_ids:
+                return []
+            rows = conn.execute(
+                f"SELECT job_id FROM jobs WHERE job_id IN ({', '.join('?' for _ in job_ids)}) AND owner IS NOT ?",
+                (*job_ids, owner),
+            ).fetchall()
+        return [row["job_id"] for row in rows]
+
+    def release_leases(self, owner: str) -> None:
+        """Give up owner's active jobs, so another worker can resume them right away."""
+        placeholders = ", ".join("?" for _ in ACTIVE_JOB_STATES)
+        with connect(self.db_path) as conn:
+            conn.execute(
+                f"UPDATE jobs SET lease_expires = 0 WHERE owner = ? AND status IN ({placeholders})",
+                (owner, *ACTIVE_JOB_STATES),
+            )
+
+    def get_active_jobs(self, lease_expired: bool = False) -> List[Dict[str, Any]]:
+        """Jobs that were still in flight, oldest first; with lease_expired, only those no worker holds."""
+        placeholders = ", ".join("?" for _ in ACTIVE_JOB_STATES)
+        lease_filter = " AND (lease_expires IS NULL OR lease_expires <= ?)" if lease_expired else ""
+        parameters = (*ACTIVE_JOB_STATES, time.time()) if lease_expired else ACTIVE_JOB_STATES
+        with connect(self.db_path) as conn:
+            rows = conn.execute(
+                f"SELECT job_id FROM jobs WHERE status IN ({placeholders}){lease_filter} ORDER BY created_at",
+                parameters,
+            ).fetchall()
+        return [self.get_job(row["job_id"]) for row in rows]
@@ -1,30 +1,151 @@
 import os
-import requests
+import asyncio
+import logging
+import httpx
 import time
 import jwt
 import base64 # Import base64
-from typing import List, Dict
+import uuid
+import hmac
+import threading
+from typing import Dict, Optional, Tuple
 from dotenv import load_dotenv
+from http_pool import create_async_http_client
+from polling import PollingPolicy
+from clip_cache import ClipCache, clip_cache_key, hash_file
+from image_asset_cache import ImageAssetCache
+from rate_limit import OutboundLimiter
+from retry import ClipRejectedError, RetryPolicy
+from metrics import observe
+from providers import VideoProvider
+from storage import CLIPS, artifact_store
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-class KlingAIClient:
-    def __init__(self):
-        self.base_url = "https://api.klingai.com/v1"
+# Kling tasks typically take several minutes; give up after 15 minutes
+KLINGAI_POLLING_POLICY = PollingPolicy.from_env("KLINGAI", "KlingAI", expected_duration=300, timeout=900)
 
-    def _encode_jwt_token(self, access_key_id: str, access_key_secret: str) -> str:
-        """Generates a JWT token for Kling AI API authentication."""
-        headers = {
-            "alg": "HS256",
-            "typ": "JWT"
-        }
-        payload = {
-            "iss": access_key_id,
-            "exp": int(time.time()) + 1800, # Token valid for 30 minutes
-            "nbf": int(time.time()) - 5    # Token effective 5 seconds ago
+# Lifetime of a signed API token, and how long before expiry it is replaced
+KLINGAI_TOKEN_TTL = int(os.getenv("KLINGAI_TOKEN_TTL", "1800"))
+KLINGAI_TOKEN_REFRESH_AHEAD = int(os.getenv("KLINGAI_TOKEN_REFRESH_AHEAD", "300"))
+
+
+class KlingTokenCache:
+    """
+    Signed JWTs per access key id, reused until refresh_ahead seconds before they expire.
+    Shared by every Kling client, so all clips and jobs using the same credentials sign once.
+    Safe to use from worker threads.
+    """
+
+    def __init__(self, ttl: int = KLINGAI_TOKEN_TTL, refresh_ahead: int = KLINGAI_TOKEN_REFRESH_AHEAD):
+        self.ttl = ttl
+        # Never refresh so early that a token is re-signed on every call
+        self.refresh_ahead = min(refresh_ahead, ttl // 2)
+        # access_key_id -> (access_key_secret, token, refresh_at)
+        self._tokens: Dict[str, Tuple[str, str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, access_key_id: str, access_key_secret: str) -> str:
+        """Return a valid token for the credentials, signing a new one when needed."""
+        now = time.time()
+        with self._lock:
+            entry = self._tokens.get(access_key_id)
+            # A different secret for the same key id (e.g. a corrected typo) must not reuse the old token
+            if entry and now < entry[2] and hmac.compare_digest(entry[0], access_key_secret):
+                return entry[1]
+            token = _sign_token(access_key_id, access_key_secret, int(now), self.ttl)
+            # Drop tokens that expired, so key ids that stopped being used do not pile up
+            self._tokens = {key: value for key, value in self._tokens.items() if value[2] > now}
+            self._tokens[access_key_id] = (access_key_secret, token, now + self.ttl - self.refresh_ahead)
+            return token
+
+
+def _sign_token(access_key_id: str, access_key_secret: str, issued_at: int, ttl: int) -> str:
+    """Sign an HS256 JWT for Kling AI API authentication."""
+    headers = {
+        "alg": "HS256",
+        "typ": "JWT"
+    }
+    payload = {
+        "iss": access_key_id,
+        "exp": issued_at + ttl,
+        "nbf": issued_at - 5    # Token effective 5 seconds ago
+    }
+    return jwt.encode(payload, access_key_secret, headers=headers)
+
+
+# One cache for the process: tokens are valid for any request with the same credentials
+kling_token_cache = KlingTokenCache()
+
+class AsyncKlingAIClient(VideoProvider):
+    """
+    Kling image2video client, usable as a VideoProvider. All requests go through one
+    pooled keep-alive HTTP client, so many clips can be polled from a single event loop.
+    Without its own access key pair it uses the credentials that come with each job.
+    """
+
+    kind = "kling"
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        clip_cache: Optional[ClipCache] = None,
+        asset_cache: Optional[ImageAssetCache] = None,
+        name: str = "kling",
+        display_name: str = "Kling",
+        base_url: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        access_key_secret: Optional[str] = None,
+    ):
+        # Overridable to point the client at a local stand-in such as mock_provider.py
+        self.base_url = (base_url or os.getenv("KLINGAI_BASE_URL", "https://api.klingai.com/v1")).rstrip("/")
+        # Clips in flight per access key, across all jobs (see self.limiter)
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("KLINGAI_MAX_CONCURRENCY", "6"))
+        self.max_concurrency = max(1, max_concurrency)
+        # Shared by every Kling client so the learned completion time covers all jobs
+        self.polling_policy = KLINGAI_POLLING_POLICY
+        # Model parameters sent with every clip; they are part of the clip cache key
+        self.generation_params = {
+            "model_name": "kling-v1",
+            "mode": "pro",
+            "duration": "10", # Consider making this dynamic or configurable
+            "cfg_scale": 0.5
         }
-        token = jwt.encode(payload, access_key_secret, headers=headers)
-        return token
+        self.clip_duration = float(self.generation_params["duration"])
+        # Optional cache of generated clips, so retries of the same image and prompt skip the API
+        self.clip_cache = clip_cache
+        # Optional per-image cache of the Base64 payload, so retries skip re-encoding the image
+        self.asset_cache = asset_cache
+        self.name = name
+        self.display_name = display_name
+        # Optional account of this provider; jobs then need not bring their own keys
+        self.access_key_id = access_key_id
+        self.access_key_secret = access_key_secret
+        self._http: Optional[httpx.AsyncClient] = None
+        # Per access key: request rate and clips in flight across all jobs
+        self.limiter = OutboundLimiter.from_env("KLINGAI", name, self.max_concurrency)
+        # Per-clip retries of transient failures, and optional hedging of slow clips
+        self.retry_policy = RetryPolicy.from_env("KLINGAI")
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """The shared connection pool, created on first use."""
+        if self._http is None:
+            self._http = create_async_http_client("KLINGAI")
+        return self._http
+
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _encode_jwt_token(self, access_key_id: str, access_key_secret: str) -> str:
+        """JWT for Kling AI API authentication, reused from the shared cache until shortly before it expires."""
+        return kling_token_cache.get(access_key_id, access_key_secret)
 
     def _get_auth_headers(self, access_key_id: str, access_key_secret: str, content_type="application/json") -> Dict[str, str]:
         """Get headers with JWT authorization token."""
@@ -34,202 +155,138 @@ class KlingAIClient:
             "Authorization": f"Bearer {token}"
         }
 
-    def generate_video(self, image_path: str, prompt: str, access_key_id: str, access_key_secret: str) -> str:
+    def _build_generation_payload(self, image_base64: str, prompt: str) -> Dict:
+        """Build the image2video request body for a Base64-encoded image."""
+        return {
+            **self.generation_params,
+            "image": image_base64, # Pass Base64 string here
+            "prompt": prompt,
+        }
+
+    def _parse_task_id(self, gen_response_json: Dict) -> str:
+        """Extract the task ID from an image2video submission response."""
+        if "data" in gen_response_json and "task_id" in gen_response_json["data"]:
+            return gen_response_json["data"]["task_id"]
+        logger.error("'data' or 'task_id' key not found in generation response JSON: %s", gen_response_json)
+        raise KeyError("Could not extract task ID from generation response.")
+
+    def _parse_task_status(self, status_response_json: Dict) -> Tuple[Optional[str], Optional[str]]:
         """
-        Generate a 10-second video from an image and prompt using KlingAI API.
-        Sends the image as Base64 directly to the image2video endpoint.
-        Returns the path to the generated video.
+        Parse a task query response into (task_status, video_url).
+        video_url is only set once the task has succeeded; a failed task raises.
         """
-        try:
-            print(f"Generating video for image: {image_path} with prompt: {prompt}")
-
-            # Step 1: Read image and encode as Base64
-            print("Step 1: Reading and encoding image as Base64")
-            try:
-                with open(image_path, "rb") as image_file:
-                    image_bytes = image_file.read()
-                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                print(f"Image encoded successfully (first 30 chars): {image_base64[:30]}...")
-            except FileNotFoundError:
-                print(f"Error: Image file not found at {image_path}")
-                raise
-            except Exception as e:
-                print(f"Error reading or encoding image file: {str(e)}")
-                raise
-
-            # Step 2: Start video generation using Base64 image
-            print("Step 2: Starting video generation using Base64 image")
-            generation_headers = self._get_auth_headers(access_key_id, access_key_secret) # Default content-type is json
-            generation_payload = {
-                "model_name": "kling-v1",
-                "mode": "pro",
-                "duration": "10", # Consider making this dynamic or configurable
-                "image": image_base64, # Pass Base64 string here
-                "prompt": prompt,
-                "cfg_scale": 0.5
+        if "data" in status_response_json:
+            status_data = status_response_json["data"]
+        else:
+            logger.error("'data' key not found in status response JSON: %s", status_response_json)
+            raise KeyError("Could not extract status data from polling response.")
+
+        # Adjusted parsing based on Query Task documentation
+        status = status_data.get("task_status")
+        status_msg = status_data.get("task_status_msg", "") # Get status message if available
+        logger.debug("Current task status: %s %s", status, status_msg)
+
+        if status == "succeed": # Changed from "completed" based on doc
+            # Parse task_result structure based on doc
+            task_result = status_data.get("task_result", {})
+            videos = task_result.get("videos", [])
+            if videos and videos[0].get("url"):
+                video_url = videos[0]["url"]
+            else:
+                logger.error("'task_result.videos[0].url' not found in successful task data: %s", status_data)
+                raise KeyError("'videoUrl' missing from successful task.")
+            logger.debug("Video generation succeeded", extra={"video_url": video_url})
+            return status, video_url
+        elif status == "failed":
+            error_msg = status_data.get("task_status_msg", "Unknown error")
+            logger.warning("Video generation task failed: %s", error_msg)
+            raise ClipRejectedError(f"Video generation task failed: {error_msg}")
+        elif status not in ("processing", "submitted"):
+            # Handle potential unknown statuses if the API defines others
+            logger.warning("Unknown task status encountered: %s", status)
+        return status, None
+
+    def _output_path(self, task_id: str) -> str:
+        """Path of the temporary file a finished clip is downloaded to."""
+        return artifact_store.path(CLIPS, f"kling_{task_id}.mp4")
+
+    def _image_digest(self, image_path: str) -> Optional[str]:
+        """SHA-256 of the submitted image when the asset cache needs it, else None."""
+        if self.asset_cache:
+            return hash_file(image_path)
+        return None
+
+    def clip_cache_key(self, image_digest: str, prompt: str) -> str:
+        """Clip cache key for an image and prompt with this client's model parameters."""
+        return clip_cache_key("kling", image_digest, prompt, self.generation_params)
+
+    def _encoded_image(self, image_path: str, image_digest: Optional[str]) -> str:
+        """The image as Base64, reused from the asset cache when the same bytes were encoded before."""
+        if self.asset_cache:
+            image_base64 = self.asset_cache.get(image_digest, "kling_base64")
+            if image_base64:
+                return image_base64
+        image_base64 = _read_image_base64(image_path)
+        if self.asset_cache:
+            self.asset_cache.put(image_digest, "kling_base64", image_base64)
+        return image_base64
+
+    def _cached_clip(self, cache_key: str) -> Optional[str]:
+        """Copy a cached clip to a fresh temporary path, or return None on a miss."""
+        output_path = self._output_path(f"cached_{uuid.uuid4().hex}")
+        if self.clip_cache.get(cache_key, output_path):
+            logger.info("Clip cache hit", extra={"path": output_path})
+            return output_path
+        return None
+
+    def credentials_for(self, request_credentials: Dict[str, str]) -> Optional[Dict[str, str]]:
+        if self.access_key_id and self.access_key_secret:
+            return {"access_key_id": self.access_key_id, "access_key_secret": self.access_key_secret}
+        if request_credentials.get("access_key_id") and request_credentials.get("access_key_secret"):
+            return {
+                "access_key_id": request_credentials["access_key_id"],
+                "access_key_secret": request_credentials["access_key_secret"],
             }
-            
-            # Log payload size for debugging (optional, Base64 can be long)
-            # print(f"Generation payload size: {len(str(generation_payload))} bytes")
-            
-            generation_response = requests.post(
+        return None
+
+    def account_key(self, credentials: Dict[str, str]) -> str:
+        return credentials["access_key_id"]
+
+    def _get_async_auth_headers(self, access_key_id: str, access_key_secret: str, content_type: Optional[str] = "application/json") -> Dict[str, str]:
+        """Auth headers without empty values, which httpx does not accept."""
+        headers = self._get_auth_headers(access_key_id, access_key_secret, content_type)
+        return {name: value for name, value in headers.items() if value is not None}
+
+    async def submit(self, image_path: str, image_digest: Optional[str], prompt: str, credentials: Dict[str, str]) -> str:
+        """Send the image as Base64 to image2video and return the task ID."""
+        # Read and encode the image off the event loop
+        with observe("encode", self.name):
+            image_base64 = await asyncio.to_thread(self._encoded_image, image_path, image_digest)
+
+        await self.limiter.throttle(credentials["access_key_id"])
+        with observe("submit", self.name) as span:
+            generation_response = await self.http.post(
                 f"{self.base_url}/videos/image2video",
-                headers=generation_headers,
-                json=generation_payload
+                headers=self._get_async_auth_headers(credentials["access_key_id"], credentials["access_key_secret"]),
+                json=self._build_generation_payload(image_base64, prompt)
             )
-            print(f"Generation response status: {generation_response.status_code}")
             generation_response.raise_for_status()
-            # Ensure the response is parsed correctly
-            gen_response_json = generation_response.json()
-            if "data" in gen_response_json and "task_id" in gen_response_json["data"]:
-                task_id = gen_response_json["data"]["task_id"]
-            else:
-                print("Error: 'data' or 'task_id' key not found in generation response JSON")
-                print(f"Generation Response JSON: {gen_response_json}")
-                raise KeyError("Could not extract task ID from generation response.")
-            print(f"Video generation started with task ID: {task_id}")
-
-            # Step 3: Poll for completion
-            print("Step 3: Polling for completion")
-            max_retries = 180  # Increased to 15 minutes (180 * 5 seconds)
-            retry_count = 0
-
-            while retry_count < max_retries:
-                # Generate a fresh token for each poll request, as the old one might expire
-                polling_headers = self._get_auth_headers(access_key_id, access_key_secret, content_type=None) # No Content-Type for GET
-
-                status_response = requests.get(
-                    f"{self.base_url}/videos/image2video/{task_id}", # Corrected polling endpoint
-                    headers=polling_headers
-                )
-                print(f"Status check response: {status_response.status_code} for task {task_id}")
-                status_response.raise_for_status()
-                # Ensure the response is parsed correctly
-                status_response_json = status_response.json()
-                if "data" in status_response_json:
-                    status_data = status_response_json["data"]
-                else:
-                    print("Error: 'data' key not found in status response JSON")
-                    print(f"Status Response JSON: {status_response_json}")
-                    raise KeyError("Could not extract status data from polling response.")
-
-                # Adjusted parsing based on Query Task documentation
-                status = status_data.get("task_status")
-                status_msg = status_data.get("task_status_msg", "") # Get status message if available
-                # Progress might not be available in this response structure, remove if causing errors
-                # progress = status_data.get("progress", 0) 
-                print(f"Current task status: {status} {status_msg}")
-
-                if status == "succeed": # Changed from "completed" based on doc
-                     # Parse task_result structure based on doc
-                    task_result = status_data.get("task_result", {})
-                    videos = task_result.get("videos", [])
-                    if videos and videos[0].get("url"):
-                        video_url = videos[0]["url"]
-                    else:
-                        print("Error: 'task_result.videos[0].url' not found in successful task data")
-                        print(f"Status Data: {status_data}")
-                        raise KeyError("'videoUrl' missing from successful task.")
-                    print(f"Video generation succeeded. URL: {video_url}")
-                    break
-                elif status == "failed":
-                    error_msg = status_data.get("task_status_msg", "Unknown error")
-                    print(f"Video generation task failed: {error_msg}")
-                    raise Exception(f"Video generation task failed: {error_msg}")
-                elif status == "processing" or status == "submitted": # Handle both processing states
-                    print(f"Video task still processing... ({retry_count + 1}/{max_retries} checks)")
-                else:
-                    # Handle potential unknown statuses if the API defines others
-                    print(f"Warning: Unknown task status encountered: {status}")
-
-                retry_count += 1
-                if retry_count >= max_retries:
-                    print("Error: Video generation timed out.")
-                    raise Exception("Video generation timed out after 15 minutes")
-
-                time.sleep(5)  # Poll every 5 seconds
-
-            # Step 4: Download the video
-            print("Step 4: Downloading video")
-            # No specific headers usually needed for direct download links
-            video_response = requests.get(video_url)
-            print(f"Video download response status: {video_response.status_code}")
-            video_response.raise_for_status()
-
-            # Save the video to a temporary file
-            UPLOAD_DIR = "uploads"
-            if not os.path.exists(UPLOAD_DIR):
-                 os.makedirs(UPLOAD_DIR)
-            # Use a consistent naming convention, maybe based on task ID
-            output_path = os.path.join(UPLOAD_DIR, f"temp_{task_id}.mp4")
-
-            with open(output_path, "wb") as f:
-                f.write(video_response.content)
-            print(f"Video saved to: {output_path}")
+            task_id = self._parse_task_id(generation_response.json())
+            span["task_id"] = task_id
+        return task_id
 
-            return output_path
-        except requests.exceptions.RequestException as e:
-            # Handle specific request errors (like connection errors, timeouts)
-            print(f"Network or API Request Error: {str(e)}")
-            if e.response is not None:
-                print(f"Response Status Code: {e.response.status_code}")
-                try:
-                    print(f"Response Body: {e.response.text}")
-                except Exception:
-                    print("Could not read response body.")
-            raise # Re-raise after logging
-        except KeyError as e:
-            # Handle errors from missing keys in API responses
-             print(f"API Response Format Error: Missing expected key - {str(e)}")
-             raise # Re-raise after logging
-        except Exception as e:
-            # Catch other potential errors during the process
-            print(f"An unexpected error occurred in generate_video: {str(e)}")
-            # Consider logging the full traceback here for debugging
-            # import traceback
-            # print(traceback.format_exc())
-            raise # Re-raise the original exception
-
-    def generate_videos(self, image_paths: List[str], prompts: List[str], access_key_id: str, access_key_secret: str) -> List[str]:
-        """
-        Generate multiple videos from images and prompts.
-        Returns a list of paths to the generated videos.
-        """
-        try:
-            print(f"Generating videos for {len(image_paths)} images using KlingAI.")
-            if len(image_paths) != len(prompts):
-                raise ValueError("Number of images must match number of prompts")
-            
-            generated_videos = []
-            for i, (image_path, prompt) in enumerate(zip(image_paths, prompts)):
-                print(f"--- Processing video {i+1}/{len(image_paths)} ---")
-                try:
-                    video_path = self.generate_video(image_path, prompt, access_key_id, access_key_secret)
-                    generated_videos.append(video_path)
-                    print(f"--- Video {i+1} generated successfully: {video_path} ---")
-                except Exception as e:
-                    # Catch errors during single video generation but continue if possible
-                    print(f"!!! Failed to generate video {i+1} for image {image_path}. Error: {str(e)} !!!")
-                    # Decide if you want to stop all generation on first error or continue
-                    # Option 1: Stop all generation
-                    # raise Exception(f"Failed on video {i+1}. Stopping generation.") from e
-                    # Option 2: Continue with next video (current behavior implicitly)
-                    print("--- Continuing with next video generation ---")
-                    # Optionally, add a placeholder or skip this video in the results
-                    # generated_videos.append(None) # Or handle differently
-
-            # Check if any videos were successfully generated
-            successful_videos = [v for v in generated_videos if v is not None]
-            if not successful_videos:
-                 raise Exception("All video generations failed.")
-
-            print(f"Finished generating videos. Successful count: {len(successful_videos)}/{len(image_paths)}")
-            print(f"Generated video paths: {successful_videos}")
-            return successful_videos # Return only successfully generated paths
-        except ValueError as e: # Catch specific validation error
-             print(f"Input Error in generate_videos: {str(e)}")
-             raise
-        except Exception as e:
-            # Catch broader errors during the loop or final processing
-            print(f"Error during bulk video generation (generate_videos): {str(e)}")
-            raise 
\ No newline at end of file
+    async def poll(self, task_id: str, credentials: Dict[str, str]) -> Tuple[str, Optional[str]]:
+        """Query a task once: (task_status, video_url once it has succeeded)."""
+        await self.limiter.throttle(credentials["access_key_id"])
+        status_response = await self.http.get(
+            f"{self.base_url}/videos/image2video/{task_id}",
+            headers=self._get_async_auth_headers(credentials["access_key_id"], credentials["access_key_secret"], content_type=None)
+        )
+        status_response.raise_for_status()
+        return self._parse_task_status(status_response.json())
+
+
+def _read_image_base64(image_path: str) -> str:
+    """Read an image file and return it Base64-encoded."""
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
@@ -0,0 +1,91 @@
+import sqlite3
+import time
+import urllib.parse
+from typing import Optional
+
+from limits.storage import Storage
+
+from sqlite_db import connect, prepare_database
+
+# Expired counters are deleted once every this many increments
+_PURGE_EVERY = 1000
+
+
+class SQLiteStorage(Storage):
+    """
+    limits storage backend in a SQLite file, so the API rate limits are shared by every
+    worker process on a host (fixed-window strategy). Registered as the sqlite:// scheme:
+    sqlite:///ratelimits.db is relative to the working directory, sqlite:////var/lib/app/ratelimits.db absolute.
+    Use a network store such as redis:// when the workers run on several hosts.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.db_path = urllib.parse.urlparse(uri).path[1:]
+        self._increments = 0
+        prepare_database(self.db_path)
+        with connect(self.db_path) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    key TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        now = time.time()
+        self._increments += 1
+        with connect(self.db_path) as conn:
+            # A counter whose window has passed starts again from amount
+            count = conn.execute(
+                """
+                INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END,
+                    expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END
+                RETURNING count
+                """,
+                (key, amount, now + expiry, now, now),
+            ).fetchone()[0]
+            if self._increments % _PURGE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        return count
+
+    def _row(self, key: str) -> Optional[sqlite3.Row]:
+        with connect(self.db_path) as conn:
+            return conn.execute(
+                "SELECT count, expires_at FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+
+    def get(self, key: str) -> int:
+        row = self._row(key)
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._row(key)
+        return row[1] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            with connect(self.db_path) as conn:
+                conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        with connect(self.db_path) as conn:
+            return conn.execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str) -> None:
+        with connect(self.db_path) as conn:
+            conn.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
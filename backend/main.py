@@ -1,43 +1,190 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
 import os
 import uuid
 import re
-from typing import List, Optional
-from moviepy.editor import VideoFileClip, concatenate_videoclips
-from klingai_client import KlingAIClient
-from minimax_client import MinimaxClient
+import asyncio
+import hashlib
+import logging
+import anyio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+from provider_registry import ProviderRegistry
+from providers import VideoProvider
+from clip_scheduler import generate_clips
+from storage import IMAGES, STREAMS, VIDEOS, artifact_store
+from video_merge import MergeExecutor, IncrementalMerger, PROGRESSIVE_STREAMING, HLS_PLAYLIST_NAME
+from clip_cache import ClipCache
+from image_asset_cache import ImageAssetCache
+from upload_registry import UploadRegistry
+from image_preprocess import ImagePreprocessor, IMAGE_PREPROCESSING
+from video_serving import VideoMetadataCache, video_response
+from job_events import JobEventBus, format_sse, poll_job_events
+from job_checkpoints import JobCheckpointStore, CLIP_READY
+from job_store import JobLeaseLost, JobStore, JOB_QUEUED, JOB_GENERATING, JOB_MERGING, JOB_COMPLETED, JOB_FAILED
+from metrics import JOBS, MetricsMiddleware, current_trace, observe, registry, traces
+from log_config import configure_logging, current_job_id
+import limit_storage  # noqa: F401 - registers the sqlite:// scheme for RATE_LIMIT_STORAGE_URI
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Leveled, structured logs (LOG_LEVEL, LOG_FORMAT) instead of bare prints
+configure_logging()
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    import sys
+    import uvicorn
+    # Workers share jobs.db and the artifact store; give them a shared RATE_LIMIT_STORAGE_URI too
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and os.getenv("RATE_LIMIT_STORAGE_URI", "memory://").startswith("memory://"):
+        logger.warning("RATE_LIMIT_STORAGE_URI is memory://, so each of the %d workers applies the request limits separately", workers)
+    # The app is set up in the "main" module uvicorn imports, so this script stops before the
+    # setup below. Processes spawned from here (uvicorn and merge workers) would re-run the
+    # script as __mp_main__, setup included, unless it has no file to run
+    del sys.modules["__main__"].__file__
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+    sys.exit()
+
+# Security headers applied to every response
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+    (b"content-security-policy", b"default-src 'self'"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+    (b"permissions-policy", b"geolocation=(), microphone=(), camera=()"),
+]
+
 # Security headers middleware
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        # Add security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        response.headers["Content-Security-Policy"] = "default-src 'self'"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
-        return response
+# Plain ASGI rather than BaseHTTPMiddleware, so response bodies (such as streamed videos)
+# pass straight through instead of being re-streamed by the middleware
+class SecurityHeadersMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                names = {name for name, _ in SECURITY_HEADERS}
+                headers = [(name, value) for name, value in message.get("headers", []) if name.lower() not in names]
+                message = {**message, "headers": headers + SECURITY_HEADERS}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects a request to path with 413 once its body exceeds max_bytes: up front from
+    Content-Length, or as it arrives for chunked bodies. Runs before the multipart parser,
+    which would otherwise spool an oversized body to disk before the endpoint sees it.
+    """
+
+    def __init__(self, app, path: str, max_bytes: int):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        too_large = JSONResponse({"detail": f"Upload exceeds maximum size of {self.max_bytes / (1024*1024):.0f}MB"}, status_code=413)
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes and not rejected:
+                    rejected = True
+                    await too_large(scope, receive, send)
+                    # The parser stops as if the client had gone away
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            # Nothing more goes out once the 413 has been sent
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # The parser failing on the body cut short is expected; the client already has its 413
+            if not rejected:
+                raise
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up the jobs that were in flight when the server last stopped
+    resumed = await resume_interrupted_jobs()
+    if resumed:
+        logger.info("Resumed %d interrupted job(s)", resumed)
+    # Started after the resumed jobs, so the files they need are already retained
+    sweeper = asyncio.create_task(artifact_store.run_sweeper())
+    lease_keeper = asyncio.create_task(keep_job_leases())
+    yield
+    sweeper.cancel()
+    lease_keeper.cancel()
+    # Stop the local jobs first, so none writes to a job after its lease is released
+    jobs = list(running_jobs)
+    for task in jobs:
+        task.cancel()
+    await asyncio.gather(*jobs, return_exceptions=True)
+    # Store the checkpoints still queued, then let another worker pick up this worker's unfinished jobs right away
+    await asyncio.wrap_future(checkpoint_writer.submit(lambda: None))
+    await asyncio.to_thread(job_store.release_leases, WORKER_ID)
+    # Close the pooled provider connections
+    await provider_registry.aclose()
+    await asyncio.to_thread(merge_executor.shutdown)
+    if image_preprocessor:
+        image_preprocessor.shutdown()
 
 # Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
-app = FastAPI()
+# Per-client request limits; set RATE_LIMIT_ENABLED=false for load tests from a single address
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Counter storage; memory:// counts per worker, so several workers need sqlite:///<file> (one host) or redis://
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+limiter = Limiter(key_func=get_remote_address, enabled=RATE_LIMIT_ENABLED, storage_uri=RATE_LIMIT_STORAGE_URI)
+app = FastAPI(lifespan=lifespan)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+# Configuration for file uploads
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_UPLOAD_FILES = 6
+# A whole /upload-images body: every file at its limit, plus room for the multipart framing
+MAX_UPLOAD_BYTES = MAX_UPLOAD_FILES * MAX_FILE_SIZE + 64 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read per step while streaming an upload to disk
+ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/jpg", "image/png", "image/gif"}
+
+app.add_middleware(UploadSizeLimitMiddleware, path="/upload-images", max_bytes=MAX_UPLOAD_BYTES)
+
 # Add security headers middleware
 app.add_middleware(SecurityHeadersMiddleware)
 
@@ -53,47 +200,105 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization"],  # Restrict headers
 )
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = "uploads"
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
-
-# Initialize API clients
-klingai_client = None
-minimax_client = None
-
-try:
-    print("Attempting to initialize KlingAI client...")
-    klingai_client = KlingAIClient()
-    print("KlingAI client initialized successfully")
-except ValueError as e:
-    print(f"Warning: KlingAI client initialization failed - {str(e)}")
-except Exception as e:
-    print(f"Error initializing KlingAI client: {str(e)}")
-
-try:
-    print("Attempting to initialize Minimax client...")
-    minimax_client = MinimaxClient()
-    print("Minimax client initialized successfully")
-except ValueError as e:
-    print(f"Warning: Minimax client not available - {str(e)}")
-except Exception as e:
-    print(f"Error initializing Minimax client: {str(e)}")
-
-# Define API providers and check which ones are available
-api_providers = []
-if klingai_client:
-    print("Adding KlingAI to available providers")
-    api_providers.append({"id": "kling", "name": "Kling"})
-if minimax_client:
-    print("Adding Minimax to available providers")
-    api_providers.append({"id": "minmax", "name": "Minimax"})
-
-print(f"Available providers: {api_providers}")
+# Outermost, so request counts and latencies cover every response, including errors and CORS preflights
+app.add_middleware(MetricsMiddleware)
+
+# Uploaded images, clips, final videos and HLS streams live in the artifact store (STORAGE_DIR),
+# sharded per type and swept by TTL and size quota
+STORAGE_ROOT_ABS = os.path.abspath(artifact_store.root)
+
+def stream_dir(job_id: str) -> str:
+    """Progressive HLS output directory of a job."""
+    return artifact_store.candidates(STREAMS, job_id)[0]
+
+def remote_node_url(job: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Base URL of the node holding a job's files, when that is another node."""
+    if job and job["node_url"] and job["node_url"] != NODE_URL:
+        return job["node_url"]
+    return None
+
+# This worker, and the base URL other nodes and clients reach its node at (for its videos)
+NODE_ID = os.getenv("NODE_ID", socket.gethostname())
+NODE_URL = os.getenv("NODE_URL", "").rstrip("/")
+WORKER_ID = f"{NODE_ID}:{os.getpid()}"
+# A worker renews its jobs' leases every third of this; jobs it stops renewing are taken over
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+# Persistent job store, shared by all workers using the same file, and the process pool that runs CPU-heavy merges
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+job_store = JobStore(JOB_DB_PATH)
+upload_registry = UploadRegistry(JOB_DB_PATH)
+# Per-clip provider task checkpoints, so interrupted jobs resume instead of starting over
+job_checkpoints = JobCheckpointStore(JOB_DB_PATH)
+# Clip checkpoints are written on one thread in the order they are reported, so progress
+# callbacks never block the event loop on SQLite
+checkpoint_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoints")
+merge_executor = MergeExecutor()
+# Strong references to running job tasks so they are not garbage collected mid-flight
+running_jobs: Set[asyncio.Task] = set()
+# Progress events pushed to clients over /jobs/{job_id}/events
+job_events = JobEventBus()
+
+# Generated clips are cached by (provider, image, prompt, model params) so retries skip the provider
+clip_cache = ClipCache()
+# Size, mtime and ETag of finished videos, revalidated with a stat every few seconds
+video_metadata = VideoMetadataCache()
+
+def forget_removed_artifact(kind: str, path: str):
+    """Drop the cached metadata of videos the storage sweeper deletes."""
+    if kind == VIDEOS:
+        video_metadata.invalidate(os.path.splitext(os.path.basename(path))[0])
+
+artifact_store.on_remove = forget_removed_artifact
+
+def active_job_files() -> List[str]:
+    """Images and finished clips of every worker's running jobs, which the sweeper must keep."""
+    paths = []
+    for job in job_store.get_active_jobs():
+        paths.extend(job["image_paths"])
+        paths.extend(clip["video_path"] for clip in job_checkpoints.get_clips(job["job_id"]).values() if clip["video_path"])
+    return paths
+
+# Retained paths only cover this process; other workers' jobs are protected through the job store
+artifact_store.protected = active_job_files
+# Base64 payloads and uploaded image URLs are cached per image digest, shared by all workers
+asset_cache = ImageAssetCache()
+# Uploaded images are downscaled and re-encoded once per digest before they reach a provider
+image_preprocessor = ImagePreprocessor() if IMAGE_PREPROCESSING else None
+
+# Initialize the video providers (VIDEO_PROVIDERS, or the default Kling and Minimax pair);
+# providers that are not configured are left out
+provider_registry = ProviderRegistry.from_env(clip_cache=clip_cache, asset_cache=asset_cache)
+api_providers = provider_registry.describe()
+
+logger.info("Available providers: %s", [p["id"] for p in api_providers])
+
+# Names of the built-in providers, for a clearer error when one is not configured
+PROVIDER_NAMES = {"kling": "Kling", "minmax": "Minimax"}
+
+def _limiter_queue_depths() -> Dict[tuple, float]:
+    depths = {}
+    for provider in provider_registry:
+        snapshot = provider.limiter.snapshot()
+        for key, limits in snapshot["keys"].items():
+            depths[(snapshot["provider"], key)] = limits["queue_depth"]
+    return depths
+
+# Read at scrape time, so they always reflect the current state
+registry.gauge("video_jobs_running", "Jobs currently generating or merging in this process.", collect=lambda: {(): len(running_jobs)})
+registry.gauge(
+    "storage_bytes",
+    "Bytes on disk per artifact type, as of the last storage sweep.",
+    ("kind",),
+    collect=lambda: {(kind,): size for kind, size in artifact_store.usage.items()},
+)
+registry.gauge(
+    "provider_admission_queue_depth",
+    "Clips waiting for a provider slot, per provider and API key fingerprint.",
+    ("provider", "api_key"),
+    collect=_limiter_queue_depths,
+)
 
-# Configuration for file uploads
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/jpg", "image/png", "image/gif"}
 MAX_PROMPT_LENGTH = 1000  # Maximum characters per prompt
 
 class VideoGenerationRequest(BaseModel):
@@ -102,85 +307,330 @@ class VideoGenerationRequest(BaseModel):
     apiKey: str
     accessKeySecret: Optional[str] = None
     groupId: Optional[str] = None
+    uploadId: str  # Returned by /upload-images; identifies the images to animate
+
+async def save_upload(file: UploadFile, safe_filename: str) -> Tuple[str, bool]:
+    """
+    Copy an upload to the artifact store in fixed-size chunks with non-blocking file I/O, hashing it on the fly.
+    Files are stored under their SHA-256, so identical images are only kept once.
+    Returns the stored path and whether this upload created it (rather than matching an
+    existing copy); raises a 400 as soon as the file exceeds MAX_FILE_SIZE.
+    """
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File {file.filename} exceeds maximum size of {MAX_FILE_SIZE / (1024*1024)}MB"
+        )
+
+    digest = hashlib.sha256()
+    size = 0
+    part_path = artifact_store.temp_path(IMAGES, ".part")
+    try:
+        async with await anyio.open_file(part_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"File {file.filename} exceeds maximum size of {MAX_FILE_SIZE / (1024*1024)}MB"
+                    )
+                digest.update(chunk)
+                await buffer.write(chunk)
+
+        extension = os.path.splitext(safe_filename)[1].lower()
+        file_path = await anyio.to_thread.run_sync(artifact_store.path, IMAGES, f"{digest.hexdigest()}{extension}")
+        if await anyio.Path(file_path).exists():
+            # Same bytes uploaded before: keep the existing copy
+            await anyio.Path(part_path).unlink()
+            artifact_store.touch(file_path)
+            return file_path, False
+        await anyio.to_thread.run_sync(os.replace, part_path, file_path)
+        return file_path, True
+    except BaseException:
+        await anyio.Path(part_path).unlink(missing_ok=True)
+        raise
 
 @app.post("/upload-images")
 @limiter.limit("10/minute")
 async def upload_images(request: Request, files: List[UploadFile] = File(...)):
-    if len(files) < 1 or len(files) > 6:
-        raise HTTPException(status_code=400, detail="Number of images must be between 1 and 6")
+    if len(files) < 1 or len(files) > MAX_UPLOAD_FILES:
+        raise HTTPException(status_code=400, detail=f"Number of images must be between 1 and {MAX_UPLOAD_FILES}")
 
-    saved_files = []
+    # Validate every file type before storing any of the files
     for file in files:
-        # Validate file type
         if file.content_type not in ALLOWED_IMAGE_TYPES:
             raise HTTPException(
                 status_code=400,
                 detail=f"Invalid file type: {file.content_type}. Only JPEG, PNG, and GIF images are allowed."
             )
 
-        # Validate filename - only allow safe characters
-        safe_filename = re.sub(r'[^a-zA-Z0-9._-]', '_', file.filename)
-
-        # Read file content to check size
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File {file.filename} exceeds maximum size of {MAX_FILE_SIZE / (1024*1024)}MB"
-            )
-
-        # Save file with sanitized name
-        file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_{safe_filename}")
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
-        saved_files.append(file_path)
-
-    return {"message": "Images uploaded successfully", "files": saved_files}
+    saved_files = []
+    created_files = []
+    try:
+        for file in files:
+            # Validate filename - only allow safe characters
+            safe_filename = re.sub(r'[^a-zA-Z0-9._-]', '_', file.filename)
+
+            # Stream the file to disk, stopping as soon as it exceeds the size limit
+            with observe("upload"):
+                file_path, created = await save_upload(file, safe_filename)
+            saved_files.append(file_path)
+            if created:
+                created_files.append(file_path)
+
+        # Bind the files to an upload id so /generate-video uses exactly these images, in this order
+        upload_id = str(uuid.uuid4())
+        await asyncio.to_thread(upload_registry.register_batch, upload_id, saved_files)
+    except BaseException:
+        # A failed batch is never registered: remove the files it added, but not existing copies other batches use
+        for file_path in created_files:
+            await anyio.Path(file_path).unlink(missing_ok=True)
+        raise
+
+    return {"message": "Images uploaded successfully", "upload_id": upload_id, "files": saved_files}
 
 @app.get("/api-providers")
 async def get_api_providers():
     return {"providers": api_providers}
 
-async def merge_videos(video_paths: List[str], output_path: str):
-    """Merge multiple videos into one"""
-    clips = [VideoFileClip(path) for path in video_paths]
-    final_clip = concatenate_videoclips(clips)
-    final_clip.write_videofile(output_path)
-    
-    # Clean up
-    for clip in clips:
-        clip.close()
-    final_clip.close()
-    
-    # Remove temporary video files
-    for path in video_paths:
+@app.get("/api-providers/limits")
+@limiter.limit("60/minute")
+async def get_api_provider_limits(request: Request):
+    """Outbound limiter state per provider and API key: queue depth, clips in flight and wait times."""
+    return {
+        "limits": [provider.limiter.snapshot() for provider in provider_registry]
+    }
+
+async def set_job_status(job_id: str, status: str, **details):
+    """Record a job's new status and announce it to its event stream; raises JobLeaseLost if another worker owns the job."""
+    await asyncio.to_thread(job_store.update_job, job_id, WORKER_ID, status=status)
+    job_events.publish(job_id, "status", status=status, **details)
+
+async def fail_job(job_id: str, error: str, provider: str = ""):
+    """Mark a job as failed, announce it and drop its saved credentials; raises JobLeaseLost if another worker owns the job."""
+    await asyncio.to_thread(job_store.update_job, job_id, WORKER_ID, status=JOB_FAILED, error=error)
+    JOBS.inc(provider=provider, outcome="failed")
+    job_events.publish(job_id, "failed", error=error)
+    await asyncio.to_thread(job_checkpoints.clear_credentials, job_id)
+
+async def ensure_lease(job_id: str):
+    """Extend this worker's lease on a job, or raise JobLeaseLost if another worker has claimed it."""
+    if not await asyncio.to_thread(job_store.renew_lease, job_id, WORKER_ID, JOB_LEASE_SECONDS):
+        raise JobLeaseLost(f"Job {job_id} was taken over by another worker")
+
+async def hand_off_job(job_id: str):
+    """End the job's local event streams, pointing them at the worker that runs it now."""
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    job_events.hand_off(job_id, owner=job and job["owner"], node_url=job and job["node_url"])
+
+def _log_checkpoint_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Could not save a clip checkpoint: %s", future.exception())
+
+def write_checkpoint(job_id: str, index: int, state: str, **fields) -> asyncio.Future:
+    """Queue a clip checkpoint write on checkpoint_writer; await the result to know it is stored."""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(checkpoint_writer, partial(job_checkpoints.record_clip, job_id, index, state, **fields))
+    future.add_done_callback(_log_checkpoint_error)
+    return future
+
+async def run_video_job(
+    job_id: str,
+    provider: str,
+    image_paths: List[str],
+    prompts: List[str],
+    credentials: Dict[str, str],
+    checkpoints: Optional[Dict[int, Dict[str, Any]]] = None,
+):
+    """
+    Generate the clips for a job and merge them, recording progress in the job store.
+    provider selects the providers the clips may run on (see ProviderRegistry.match).
+    Each clip's provider task is checkpointed, so with checkpoints from an interrupted run
+    the job picks up where it stopped.
+    """
+    # Logs and stage timings of this task and the clip tasks it starts are tagged with the job
+    current_job_id.set(job_id)
+    current_trace.set(traces.start(job_id))
+    # Finished clips are appended to a playable HLS stream while the rest are still generating
+    incremental_merger = None
+    if PROGRESSIVE_STREAMING:
+        # Clips may land on any of the job's providers, so the longest requested clip sets the target duration
+        clip_duration = max((p.clip_duration for p in provider_registry.select(provider, credentials)), default=VideoProvider.clip_duration)
+        incremental_merger = IncrementalMerger(stream_dir(job_id), len(prompts), clip_duration)
+
+    # The job's images and finished clips are kept from the storage sweeper until it ends
+    retained = list(image_paths) + [
+        checkpoint["video_path"] for checkpoint in (checkpoints or {}).values() if checkpoint["video_path"]
+    ]
+    artifact_store.retain(retained)
+
+    async def on_clip_ready(index: int, path: Optional[str]):
+        if path:
+            artifact_store.retain([path])
+            retained.append(path)
+            await write_checkpoint(job_id, index, CLIP_READY, video_path=path)
+        if incremental_merger:
+            await incremental_merger.add_clip(index, path)
+        if path:
+            stream_url = f"/video/{job_id}/{HLS_PLAYLIST_NAME}" if incremental_merger else None
+            job_events.publish(job_id, "clip", index=index, state=CLIP_READY, stream_url=stream_url)
+
+    def on_clip_progress(index: int):
+        publish = job_events.clip_progress(job_id, index)
+
+        def report(state: str, details: Dict[str, Any]):
+            # Download progress is too frequent to be worth a write
+            if state != "downloading":
+                task_id = details.get("task_id")
+                write_checkpoint(
+                    job_id, index, state,
+                    task_id=task_id,
+                    # The provider that owns the task, so a resumed job polls it there
+                    provider=details.get("provider") if task_id else None,
+                    error=details.get("error"),
+                )
+            publish(state, details)
+        return report
+
+    try:
+        await ensure_lease(job_id)
+        await set_job_status(job_id, JOB_GENERATING)
+        providers = provider_registry.select(provider, credentials)
+        if not providers:
+            raise Exception(f"No provider available for {provider}")
+        # Provider clients are native asyncio, so all clips are polled from the event loop;
+        # each clip goes to the least loaded of the job's providers
+        video_paths = await generate_clips(
+            providers,
+            image_paths,
+            prompts,
+            credentials,
+            on_clip_ready=on_clip_ready,
+            on_clip_progress=on_clip_progress,
+            job_id=job_id,
+            checkpoints=checkpoints,
+            # Images are preprocessed for the provider each clip lands on
+            prepare_image=image_preprocessor.prepare if image_preprocessor else None,
+            # Nothing is submitted (and paid for) once another worker runs the job
+            before_submit=lambda: ensure_lease(job_id),
+        )
+        logger.info("Generated %d video(s)", len(video_paths))
+        if incremental_merger:
+            await incremental_merger.finish()
+
+        final_video_path = artifact_store.path(VIDEOS, f"{job_id}.mp4")
+        await ensure_lease(job_id)
+        await set_job_status(job_id, JOB_MERGING, clip_count=len(video_paths))
+        with observe("merge", provider, clips=len(video_paths)):
+            # Merged under a temporary name, so the video only appears once it is complete
+            with artifact_store.atomic_write(final_video_path) as merge_path:
+                await merge_executor.merge(video_paths, merge_path)
+        await asyncio.to_thread(job_store.update_job, job_id, WORKER_ID, status=JOB_COMPLETED, output_path=final_video_path)
+        await asyncio.to_thread(job_checkpoints.clear_credentials, job_id)
+        job_events.publish(job_id, "ready", video_url=f"/video/{job_id}")
+        JOBS.inc(provider=provider, outcome="completed")
+        logger.info("Final video ready: %s", final_video_path)
+    except JobLeaseLost as e:
+        # The new owner resumes the job from its checkpoints; its state is no longer ours to change
+        logger.warning("Stopped job: %s", e)
+        await hand_off_job(job_id)
+    except Exception as e:
+        logger.exception("Error during video generation: %s", e)
         try:
-            os.remove(path)
-        except:
-            pass
+            await fail_job(job_id, str(e), provider)
+        except JobLeaseLost as lost:
+            logger.warning("Stopped job: %s", lost)
+            await hand_off_job(job_id)
+    finally:
+        artifact_store.release(retained)
+
+async def keep_job_leases():
+    """Renew this worker's job leases, and take over jobs whose worker stopped renewing them."""
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            local_jobs = {task.get_name(): task for task in running_jobs}
+            lost = await asyncio.to_thread(job_store.renew_leases, WORKER_ID, JOB_LEASE_SECONDS, list(local_jobs))
+            for job_id in lost:
+                # Our lease lapsed (e.g. the loop or database stalled) and another worker resumed the job
+                logger.warning("Job taken over by another worker, stopping it here", extra={"job_id": job_id})
+                local_jobs[job_id].cancel()
+                await hand_off_job(job_id)
+            resumed = await resume_interrupted_jobs()
+            if resumed:
+                logger.info("Took over %d job(s) from a stopped worker", resumed)
+        except Exception as e:
+            logger.exception("Job lease upkeep failed: %s", e)
+
+def start_job(job_id: str, provider: str, image_paths: List[str], prompts: List[str], credentials: Dict[str, str], checkpoints=None):
+    """Run a job in the background, keeping a reference to its task until it finishes."""
+    task = asyncio.create_task(run_video_job(job_id, provider, image_paths, prompts, credentials, checkpoints), name=job_id)
+    running_jobs.add(task)
+    task.add_done_callback(running_jobs.discard)
+
+async def resume_interrupted_jobs() -> int:
+    """
+    Restart the jobs that were in flight when their worker stopped: this server restarting,
+    or another worker dying and its leases running out. Each job is claimed in the job store
+    first, so only one worker resumes it. Clips that were already submitted are polled again
+    by task id and downloaded clips are reused, so nothing is generated twice.
+    Returns the number of jobs resumed.
+    """
+    resumed = 0
+    # Jobs still leased are running in a live worker
+    for job in await asyncio.to_thread(job_store.get_active_jobs, lease_expired=True):
+        job_id, provider = job["job_id"], job["provider"]
+        if any(task.get_name() == job_id for task in running_jobs):
+            # Ours, with a lease that lapsed while the loop was busy
+            continue
+        if not await asyncio.to_thread(job_store.claim_job, job_id, WORKER_ID, JOB_LEASE_SECONDS, NODE_URL or None):
+            # Another worker claimed it first
+            continue
+        # Providers without their own configured account need the credentials sent with the job
+        credentials = await asyncio.to_thread(job_checkpoints.get_credentials, job_id) or {}
+        if not provider_registry.select(provider, credentials):
+            try:
+                await fail_job(job_id, "Server restarted before the job finished", provider)
+            except JobLeaseLost:
+                # Claimed by another worker meanwhile, which decides the job's fate
+                pass
+            continue
+        logger.info("Resuming interrupted job", extra={"job_id": job_id})
+        checkpoints = await asyncio.to_thread(job_checkpoints.get_clips, job_id)
+        start_job(job_id, provider, job["image_paths"], job["prompts"], credentials, checkpoints)
+        resumed += 1
+    return resumed
 
 @app.post("/generate-video")
 @limiter.limit("5/minute")
-async def generate_video(request_obj: Request, request: VideoGenerationRequest, background_tasks: BackgroundTasks):
+async def generate_video(request: Request, payload: VideoGenerationRequest):
     try:
-        prompts = request.prompts
-        provider = request.provider
-
-        print(f"Received video generation request - Provider: {provider}")
-
-        # Validate provider
-        if provider == "kling" and not klingai_client:
-            print("Error: KlingAI client not initialized")
-            raise HTTPException(status_code=500, detail="Kling API not configured")
-        elif provider == "minmax" and not minimax_client:
-            print("Error: Minimax client not initialized")
-            raise HTTPException(status_code=500, detail="Minimax API not configured")
-        elif provider not in ["kling", "minmax"]:
-            print(f"Error: Invalid provider {provider}")
+        prompts = payload.prompts
+        provider = payload.provider
+
+        logger.info("Received video generation request", extra={"provider": provider})
+
+        # Validate provider: a provider id, a provider type or "auto" for all of them
+        candidates = provider_registry.match(provider)
+        if not candidates:
+            if provider in PROVIDER_NAMES:
+                logger.error("%s provider not initialized", PROVIDER_NAMES[provider])
+                raise HTTPException(status_code=500, detail=f"{PROVIDER_NAMES[provider]} API not configured")
+            logger.warning("Invalid provider %s", provider)
             raise HTTPException(status_code=400, detail="Invalid API provider")
 
+        # Kling keys sent with the request, for providers without an account of their own
+        credentials = {}
+        if payload.accessKeySecret:
+            credentials = {"access_key_id": payload.apiKey, "access_key_secret": payload.accessKeySecret}
+        if not provider_registry.select(provider, credentials):
+            raise HTTPException(status_code=400, detail="Access Key Secret is required for Kling API")
+        if provider == "minmax" and not payload.groupId:
+            logger.warning("Missing Group ID for Minimax")
+            raise HTTPException(status_code=400, detail="Group ID is required for Minimax API")
+
         if len(prompts) < 1 or len(prompts) > 6:
-            print(f"Error: Invalid number of prompts {len(prompts)}")
+            logger.warning("Invalid number of prompts %d", len(prompts))
             raise HTTPException(status_code=400, detail="Number of prompts must be between 1 and 6")
 
         # Validate and sanitize prompts
@@ -202,83 +652,184 @@ async def generate_video(request_obj: Request, request: VideoGenerationRequest,
 
         prompts = sanitized_prompts
         
-        # Get the latest uploaded images
-        image_files = sorted([f for f in os.listdir(UPLOAD_DIR) if not f.startswith("temp_")], 
-                           key=lambda x: os.path.getctime(os.path.join(UPLOAD_DIR, x)))
-        image_paths = [os.path.join(UPLOAD_DIR, f) for f in image_files[-len(prompts):]]
-        
-        print(f"Found image paths: {image_paths}")
+        # Resolve the images registered by /upload-images for this request
+        if not re.match(r'^[a-zA-Z0-9\-]+$', payload.uploadId):
+            raise HTTPException(status_code=400, detail="Invalid upload ID format")
+        image_paths = await asyncio.to_thread(upload_registry.get_batch, payload.uploadId)
+        if image_paths is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
         
         if len(image_paths) != len(prompts):
-            print(f"Error: Number of images ({len(image_paths)}) does not match number of prompts ({len(prompts)})")
+            logger.warning("Number of images (%d) does not match number of prompts (%d)", len(image_paths), len(prompts))
             raise HTTPException(status_code=400, detail="Number of images does not match number of prompts")
-        
-        try:
-            # Generate individual videos based on selected provider
-            if provider == "kling":
-                print("Generating videos with KlingAI")
-                if not request.accessKeySecret:
-                    raise HTTPException(status_code=400, detail="Access Key Secret is required for Kling API")
-                video_paths = klingai_client.generate_videos(
-                    image_paths, 
-                    prompts, 
-                    access_key_id=request.apiKey,
-                    access_key_secret=request.accessKeySecret
-                )
-            else:  # minmax
-                if not request.groupId:
-                    print("Error: Missing Group ID for Minimax")
-                    raise HTTPException(status_code=400, detail="Group ID is required for Minimax API")
-                print("Generating videos with Minimax")
-                video_paths = minimax_client.generate_videos(image_paths, prompts)
-            
-            print(f"Generated video paths: {video_paths}")
-            
-            # Generate a unique ID for the final video
-            video_id = str(uuid.uuid4())
-            final_video_path = os.path.join(UPLOAD_DIR, f"{video_id}.mp4")
-            
-            print(f"Final video path: {final_video_path}")
-            
-            # Merge videos in the background
-            background_tasks.add_task(merge_videos, video_paths, final_video_path)
-            
-            return {
-                "message": "Video generation started",
-                "status": "processing",
-                "video_id": video_id,
-                "provider": provider
-            }
-        except Exception as e:
-            print(f"Error during video generation: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
+        # Uploads that sat unused past their TTL have been swept
+        if not all(os.path.exists(path) for path in image_paths):
+            raise HTTPException(status_code=410, detail="Uploaded images have expired, please upload them again")
+        for path in image_paths:
+            artifact_store.touch(path)
+
+        # The job id doubles as the id of the final video
+        video_id = str(uuid.uuid4())
+        await asyncio.to_thread(
+            job_store.create_job, video_id, provider, prompts, image_paths,
+            owner=WORKER_ID, lease_seconds=JOB_LEASE_SECONDS, node_url=NODE_URL or None,
+        )
+        await asyncio.to_thread(job_checkpoints.save_credentials, video_id, credentials)
+        job_events.publish(video_id, "status", status=JOB_QUEUED, clip_count=len(prompts))
+
+        # Run the provider and merge work in the background and answer right away
+        start_job(video_id, provider, image_paths, prompts, credentials)
+
+        return {
+            "message": "Video generation started",
+            "status": "processing",
+            "video_id": video_id,
+            "job_id": video_id,
+            "events_url": f"/jobs/{video_id}/events",
+            "provider": provider
+        }
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Unexpected error in generate_video: {str(e)}")
+        logger.exception("Unexpected error in generate_video: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.api_route("/video/{video_id}", methods=["GET", "HEAD"])
+@app.get("/jobs/{job_id}")
+@limiter.limit("60/minute")
+async def get_job(request: Request, job_id: str):
+    # Job ids share the video id format
+    if not re.match(r'^[a-zA-Z0-9\-]+$', job_id):
+        raise HTTPException(status_code=400, detail="Invalid job ID format")
+
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # A job on another node streams from there; /video/{id}/... redirects to it
+    has_stream = os.path.exists(os.path.join(stream_dir(job_id), HLS_PLAYLIST_NAME)) or (
+        PROGRESSIVE_STREAMING and remote_node_url(job) is not None and job["status"] != JOB_FAILED
+    )
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "provider": job["provider"],
+        "clip_count": len(job["prompts"]),
+        "error": job["error"],
+        "video_url": f"/video/{job_id}" if job["status"] == JOB_COMPLETED else None,
+        "stream_url": f"/video/{job_id}/{HLS_PLAYLIST_NAME}" if has_stream else None,
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+@app.get("/jobs/{job_id}/events")
 @limiter.limit("30/minute")
+async def get_job_events(request: Request, job_id: str):
+    """
+    Server-sent event stream of a job's progress: status changes, per-clip states
+    (submitted/processing/succeed/failed, download progress, ready) and a final ready or failed event.
+    A handoff event means another worker took the job over; the stream then follows it there.
+    """
+    if not re.match(r'^[a-zA-Z0-9\-]+$', job_id):
+        raise HTTPException(status_code=400, detail="Invalid job ID format")
+
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        if not job_events.has_events(job_id) and job["status"] in (JOB_COMPLETED, JOB_FAILED):
+            # Finished before this process started or long enough ago that its events were dropped
+            if job["status"] == JOB_COMPLETED:
+                yield format_sse({"type": "ready", "job_id": job_id, "video_url": f"/video/{job_id}"})
+            else:
+                yield format_sse({"type": "failed", "job_id": job_id, "error": job["error"]})
+            return
+        if not job_events.has_events(job_id):
+            # Running in another worker: follow it through the shared job store
+            async for event in poll_job_events(job_id, job_store.get_job, job_checkpoints.get_clips):
+                yield format_sse(event)
+            return
+        async for event in job_events.subscribe(job_id):
+            yield format_sse(event)
+            if event is not None and event["type"] == "handoff":
+                # Another worker took the job over: keep following it through the job store
+                async for event in poll_job_events(job_id, job_store.get_job, job_checkpoints.get_clips):
+                    yield format_sse(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop proxies from caching or buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/jobs/{job_id}/trace")
+@limiter.limit("60/minute")
+async def get_job_trace(request: Request, job_id: str):
+    """Timed spans of a recent job's stages (encode, submit, each poll, provider queue, download, merge)."""
+    if not re.match(r'^[a-zA-Z0-9\-]+$', job_id):
+        raise HTTPException(status_code=400, detail="Invalid job ID format")
+
+    trace = traces.get(job_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {"job_id": job_id, "started_at": trace.started, "spans": list(trace.spans)}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text-format metrics: stage timings, clip and job outcomes, HTTP requests."""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.api_route("/video/{video_id}", methods=["GET", "HEAD"])
+@limiter.limit("120/minute")
 async def get_video(request: Request, video_id: str):
     # Validate video_id to prevent path traversal attacks
     # Only allow alphanumeric characters and hyphens (UUID format)
     if not re.match(r'^[a-zA-Z0-9\-]+$', video_id):
         raise HTTPException(status_code=400, detail="Invalid video ID format")
 
-    # Construct the full path
-    video_path = os.path.join(UPLOAD_DIR, f"{video_id}.mp4")
-
-    # Verify the resolved path is within UPLOAD_DIR to prevent path traversal
-    upload_dir_abs = os.path.abspath(UPLOAD_DIR)
-    video_path_abs = os.path.abspath(video_path)
-
-    if not video_path_abs.startswith(upload_dir_abs):
-        raise HTTPException(status_code=400, detail="Invalid video path")
-
-    if not os.path.exists(video_path):
+    # Its shard first, then the flat layout older videos were written to
+    info = None
+    for video_path in artifact_store.candidates(VIDEOS, f"{video_id}.mp4"):
+        # Verify the resolved path is within the storage root to prevent path traversal
+        if not os.path.abspath(video_path).startswith(STORAGE_ROOT_ABS):
+            raise HTTPException(status_code=400, detail="Invalid video path")
+        info = video_metadata.lookup(video_id, video_path)
+        if info is not None:
+            break
+    if info is None:
+        # Merged on another node: send the client there
+        node_url = remote_node_url(await asyncio.to_thread(job_store.get_job, video_id))
+        if node_url:
+            return RedirectResponse(f"{node_url}/video/{video_id}", status_code=307)
         raise HTTPException(status_code=404, detail="Video not found")
+    # Watched videos stay longest under the storage quota
+    artifact_store.touch(info.path)
 
-    return FileResponse(video_path)
+    # Supports Range (206/416) for seeking and ETag/Last-Modified revalidation (304)
+    return video_response(request, info)
 
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+@app.get("/video/{video_id}/{file_name}")
+@limiter.limit("120/minute")
+async def get_video_stream(request: Request, video_id: str, file_name: str):
+    """Serve the progressive HLS playlist and its segments while a job is still running."""
+    if not re.match(r'^[a-zA-Z0-9\-]+$', video_id):
+        raise HTTPException(status_code=400, detail="Invalid video ID format")
+    if file_name == HLS_PLAYLIST_NAME:
+        media_type = "application/vnd.apple.mpegurl"
+    elif re.match(r'^segment_\d+\.ts$', file_name):
+        media_type = "video/mp2t"
+    else:
+        raise HTTPException(status_code=400, detail="Invalid stream file name")
+
+    stream_path = os.path.join(stream_dir(video_id), file_name)
+    if not os.path.exists(stream_path):
+        node_url = remote_node_url(await asyncio.to_thread(job_store.get_job, video_id))
+        if node_url:
+            return RedirectResponse(f"{node_url}/video/{video_id}/{file_name}", status_code=307)
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    # The playlist grows while the job runs, so players must not cache it
+    headers = {"Cache-Control": "no-cache"} if file_name == HLS_PLAYLIST_NAME else None
+    return FileResponse(stream_path, media_type=media_type, headers=headers)
+ 
\ No newline at end of file
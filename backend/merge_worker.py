@@ -0,0 +1,20 @@
+"""
+Entry points of the merge worker processes. The spawned workers import this module, so it
+must stay free of import-time side effects: no stores, pools or provider clients.
+"""
+from typing import List
+
+from log_config import configure_logging
+
+
+def initialize() -> None:
+    """Set up a fresh worker process, which starts without the server's logging setup."""
+    configure_logging()
+
+
+def run_merge(video_paths: List[str], output_path: str) -> None:
+    """Merge video_paths into output_path in this worker."""
+    # Imported here so merely loading this module does not pull in the video stack
+    from video_merge import merge_videos
+
+    merge_videos(video_paths, output_path)
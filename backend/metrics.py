@@ -0,0 +1,289 @@
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Keep per-job trace spans in memory for /jobs/{job_id}/trace
+JOB_TRACING = os.getenv("JOB_TRACING", "true").lower() == "true"
+# How many recent job traces are kept
+JOB_TRACE_LIMIT = int(os.getenv("JOB_TRACE_LIMIT", "200"))
+
+# Seconds: from sub-second HTTP calls up to provider tasks that take many minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+# Bytes per second, for download throughput
+THROUGHPUT_BUCKETS = (64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Current value per label set, read from a callback at scrape time."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], collect: Callable[[], Dict[LabelValues, float]]):
+        super().__init__(name, documentation, label_names)
+        self._collect = collect
+
+    def _samples(self) -> List[str]:
+        try:
+            values = self._collect()
+        except Exception:
+            logger.exception("Could not collect gauge %s", self.name)
+            return []
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observations per label set, in cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """The process's metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: "OrderedDict[str, _Metric]" = OrderedDict()
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = (), *, collect: Callable[[], Dict[LabelValues, float]]) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names, collect))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Pipeline stages: upload, preprocess, encode, submit, poll, provider_queue, download, merge
+STAGE_SECONDS = registry.histogram(
+    "video_stage_duration_seconds", "Time spent in each pipeline stage.", ("stage", "provider", "outcome")
+)
+DOWNLOAD_BYTES = registry.counter("video_download_bytes_total", "Bytes of generated clips downloaded.", ("provider",))
+DOWNLOAD_THROUGHPUT = registry.histogram(
+    "video_download_bytes_per_second", "Download throughput of generated clips.", ("provider",), THROUGHPUT_BUCKETS
+)
+CLIPS = registry.counter(
+    "video_clips_total",
+    "Clip outcomes (succeeded, failed, restored) and events along the way (cached, retried, hedged).",
+    ("provider", "outcome"),
+)
+JOBS = registry.counter("video_jobs_total", "Jobs by final outcome.", ("provider", "outcome"))
+HTTP_REQUESTS = registry.counter("http_requests_total", "HTTP requests served.", ("method", "route", "status"))
+HTTP_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time to serve HTTP requests, including streaming the body.", ("method", "route")
+)
+
+
+class JobTrace:
+    """Timed spans of one job, e.g. each clip's submit, polls, download and the merge."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.started = time.time()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, start: float, duration: float, attributes: Dict[str, Any]) -> None:
+        self.spans.append({
+            "name": name,
+            "start": round(start - self.started, 4),
+            "duration": round(duration, 4),
+            **attributes,
+        })
+
+
+class TraceStore:
+    """The most recent job traces, by job id."""
+
+    def __init__(self, limit: int = JOB_TRACE_LIMIT):
+        self.limit = limit
+        self._traces: "OrderedDict[str, JobTrace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, job_id: str) -> Optional[JobTrace]:
+        if not JOB_TRACING:
+            return None
+        with self._lock:
+            trace = self._traces.get(job_id) or JobTrace(job_id)
+            self._traces[job_id] = trace
+            self._traces.move_to_end(job_id)
+            while len(self._traces) > self.limit:
+                self._traces.popitem(last=False)
+        return trace
+
+    def get(self, job_id: str) -> Optional[JobTrace]:
+        with self._lock:
+            return self._traces.get(job_id)
+
+
+traces = TraceStore()
+
+# The trace of the job the current task works for; copied into child tasks and worker threads
+current_trace: contextvars.ContextVar[Optional[JobTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def observe(stage: str, provider: str = "", **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time a pipeline stage: records it in the stage histogram (outcome ok or error) and, inside
+    a traced job, as a span. Attributes set on the yielded dict are added to the span.
+    """
+    started_wall = time.time()
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield attributes
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=stage, provider=provider, outcome=outcome)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(stage, started_wall, duration, {"provider": provider, "outcome": outcome, **attributes})
+
+
+def record_download(provider: str, size: int, duration: float) -> None:
+    """Count a finished clip download and its throughput."""
+    DOWNLOAD_BYTES.inc(size, provider=provider)
+    if duration > 0:
+        DOWNLOAD_THROUGHPUT.observe(size / duration, provider=provider)
+
+
+class MetricsMiddleware:
+    """Counts and times every HTTP request by method, route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The route template keeps ids out of the labels; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=status)
+            HTTP_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=route)
@@ -1,106 +1,203 @@
 import os
-import requests
-import time
-from typing import List, Dict
+import asyncio
+import uuid
+import logging
+import httpx
+from typing import Dict, Optional, Tuple
 from dotenv import load_dotenv
+from http_pool import create_async_http_client
+from polling import PollingPolicy
+from clip_cache import ClipCache, clip_cache_key, hash_file
+from image_asset_cache import ImageAssetCache
+from rate_limit import OutboundLimiter
+from retry import ClipRejectedError, RetryPolicy
+from metrics import observe
+from providers import VideoProvider
+from storage import CLIPS, artifact_store
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-class MinimaxClient:
-    def __init__(self):
-        self.api_key = os.getenv("MINIMAX_API_KEY")
+# Minimax tasks typically take a couple of minutes; give up after 5 minutes
+MINIMAX_POLLING_POLICY = PollingPolicy.from_env("MINIMAX", "Minimax", expected_duration=120, timeout=300)
+
+class AsyncMinimaxClient(VideoProvider):
+    """
+    Minimax image-to-video client, usable as a VideoProvider. All requests go through one
+    pooled keep-alive HTTP client, so many clips can be polled from a single event loop.
+    """
+
+    kind = "minimax"
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        clip_cache: Optional[ClipCache] = None,
+        asset_cache: Optional[ImageAssetCache] = None,
+        name: str = "minmax",
+        display_name: str = "Minimax",
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        group_id: Optional[str] = None,
+    ):
+        self.api_key = api_key or os.getenv("MINIMAX_API_KEY")
         if not self.api_key:
             raise ValueError("MINIMAX_API_KEY not found in environment variables")
         
-        self.group_id = os.getenv("MINIMAX_GROUP_ID", "")
+        self.group_id = group_id or os.getenv("MINIMAX_GROUP_ID", "")
         if not self.group_id:
             raise ValueError("MINIMAX_GROUP_ID not found in environment variables")
         
-        self.base_url = "https://api.minimax.chat/v1"
+        # Overridable to point the client at a local stand-in such as mock_provider.py
+        self.base_url = (base_url or os.getenv("MINIMAX_BASE_URL", "https://api.minimax.chat/v1")).rstrip("/")
+        # Clips in flight per API key, across all jobs (see self.limiter)
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("MINIMAX_MAX_CONCURRENCY", "6"))
+        self.max_concurrency = max(1, max_concurrency)
+        # Shared by every Minimax client so the learned completion time covers all jobs
+        self.polling_policy = MINIMAX_POLLING_POLICY
+        # Model parameters sent with every clip; they are part of the clip cache key
+        self.generation_params = {
+            "model": "video-gen",
+            "duration": 10,
+            "quality": "high"
+        }
+        self.clip_duration = float(self.generation_params["duration"])
+        # Optional cache of generated clips, so retries of the same image and prompt skip the API
+        self.clip_cache = clip_cache
+        # Optional per-image cache of uploaded image URLs, so retries skip /media/upload
+        self.asset_cache = asset_cache
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self.name = name
+        self.display_name = display_name
+        self._http: Optional[httpx.AsyncClient] = None
+        # Per API key: request rate and clips in flight across all jobs
+        self.limiter = OutboundLimiter.from_env("MINIMAX", name, self.max_concurrency)
+        # Per-clip retries of transient failures, and optional hedging of slow clips
+        self.retry_policy = RetryPolicy.from_env("MINIMAX")
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """The shared connection pool, created on first use."""
+        if self._http is None:
+            self._http = create_async_http_client("MINIMAX")
+        return self._http
 
-    def generate_video(self, image_path: str, prompt: str) -> str:
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _build_generation_payload(self, image_url: str, prompt: str) -> Dict:
+        """Build the text_to_video request body for an uploaded image."""
+        return {
+            **self.generation_params,
+            "image_url": image_url,
+            "prompt": prompt,
+            "group_id": self.group_id,
+        }
+
+    def _parse_task_status(self, status_data: Dict) -> Tuple[Optional[str], Optional[str]]:
         """
-        Generate a 10-second video from an image and prompt using Minimax API.
-        Returns the path to the generated video.
+        Parse a status response into (status, video_url).
+        video_url is only set once the task has completed; a failed task raises.
         """
-        # Step 1: Upload the image to get a URL
-        with open(image_path, "rb") as image_file:
-            files = {"file": image_file}
-            upload_response = requests.post(
-                f"{self.base_url}/media/upload",
-                headers={"Authorization": f"Bearer {self.api_key}"},
-                files=files
+        status = status_data.get("status")
+        if status == "completed":
+            video_url = (status_data.get("result") or {}).get("video_url")
+            if not video_url:
+                # The file may be published after the status flips: keep polling until it appears or the poll times out
+                logger.warning("Completed task has no video_url yet: %s", status_data)
+                return "processing", None
+            return status, video_url
+        elif status == "failed":
+            raise ClipRejectedError(f"Video generation failed: {status_data.get('error', 'Unknown error')}")
+        return status, None
+
+    def _output_path(self, task_id: str) -> str:
+        """Path of the temporary file a finished clip is downloaded to."""
+        return artifact_store.path(CLIPS, f"minimax_{task_id}.mp4")
+
+    def _image_digest(self, image_path: str) -> Optional[str]:
+        """SHA-256 of the submitted image when the asset cache needs it, else None."""
+        if self.asset_cache:
+            return hash_file(image_path)
+        return None
+
+    def clip_cache_key(self, image_digest: str, prompt: str) -> str:
+        """Clip cache key for an image and prompt with this client's model parameters."""
+        return clip_cache_key("minimax", image_digest, prompt, self.generation_params)
+
+    def _cached_image_url(self, image_digest: Optional[str]) -> Optional[str]:
+        """URL of an earlier upload of the same image bytes to this account, if still cached."""
+        if self.asset_cache:
+            return self.asset_cache.get(image_digest, f"minimax_url:{self.group_id}")
+        return None
+
+    def _remember_image_url(self, image_digest: Optional[str], image_url: str) -> None:
+        if self.asset_cache and image_url:
+            self.asset_cache.put(image_digest, f"minimax_url:{self.group_id}", image_url)
+
+    def _cached_clip(self, cache_key: str) -> Optional[str]:
+        """Copy a cached clip to a fresh temporary path, or return None on a miss."""
+        output_path = self._output_path(f"cached_{uuid.uuid4().hex}")
+        if self.clip_cache.get(cache_key, output_path):
+            return output_path
+        return None
+
+    def account_key(self, credentials: Dict[str, str]) -> str:
+        # Minimax always uses the server's own key
+        return self.api_key
+
+    async def submit(self, image_path: str, image_digest: Optional[str], prompt: str, credentials: Dict[str, str]) -> str:
+        """Upload the image (unless these bytes were uploaded recently), request the video and return the task ID."""
+        image_url = await asyncio.to_thread(self._cached_image_url, image_digest)
+        if not image_url:
+            image_bytes = await asyncio.to_thread(_read_file, image_path)
+            await self.limiter.throttle(self.api_key)
+            with observe("image_upload", self.name, bytes=len(image_bytes)):
+                upload_response = await self.http.post(
+                    f"{self.base_url}/media/upload",
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    files={"file": (os.path.basename(image_path), image_bytes)}
+                )
+                upload_response.raise_for_status()
+                image_url = upload_response.json().get("url")
+            await asyncio.to_thread(self._remember_image_url, image_digest, image_url)
+
+        await self.limiter.throttle(self.api_key)
+        with observe("submit", self.name) as span:
+            generation_response = await self.http.post(
+                f"{self.base_url}/text_to_video",
+                headers=self.headers,
+                json=self._build_generation_payload(image_url, prompt)
             )
-            upload_response.raise_for_status()
-            image_url = upload_response.json().get("url")
-
-        # Step 2: Request video generation
-        generation_response = requests.post(
-            f"{self.base_url}/text_to_video",
-            headers=self.headers,
-            json={
-                "model": "video-gen",
-                "image_url": image_url,
-                "prompt": prompt,
-                "duration": 10,
-                "group_id": self.group_id,
-                "quality": "high"
-            }
+            generation_response.raise_for_status()
+            task_id = generation_response.json().get("task_id")
+            span["task_id"] = task_id
+        return task_id
+
+    async def poll(self, task_id: str, credentials: Dict[str, str]) -> Tuple[str, Optional[str]]:
+        """Query a task once: (state in the Kling vocabulary, video_url once it has completed)."""
+        await self.limiter.throttle(self.api_key)
+        status_response = await self.http.get(
+            f"{self.base_url}/text_to_video/status/{task_id}",
+            headers=self.headers
         )
-        generation_response.raise_for_status()
-        task_id = generation_response.json().get("task_id")
+        status_response.raise_for_status()
+        status, video_url = self._parse_task_status(status_response.json())
+        return _CLIP_STATES.get(status, "processing"), video_url
 
-        # Step 3: Poll for completion
-        max_retries = 60  # 5 minutes with 5 second intervals
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            status_response = requests.get(
-                f"{self.base_url}/text_to_video/status/{task_id}",
-                headers=self.headers
-            )
-            status_response.raise_for_status()
-            status_data = status_response.json()
-            
-            if status_data.get("status") == "completed":
-                video_url = status_data.get("result", {}).get("video_url")
-                if video_url:
-                    break
-            elif status_data.get("status") == "failed":
-                raise Exception(f"Video generation failed: {status_data.get('error', 'Unknown error')}")
-            
-            time.sleep(5)
-            retry_count += 1
-            
-        if retry_count >= max_retries:
-            raise Exception("Video generation timed out")
-
-        # Step 4: Download the video
-        video_response = requests.get(video_url)
-        video_response.raise_for_status()
-        
-        # Save the video to a temporary file
-        output_path = f"uploads/temp_minimax_{task_id}.mp4"
-        with open(output_path, "wb") as f:
-            f.write(video_response.content)
-        
-        return output_path
 
-    def generate_videos(self, image_paths: List[str], prompts: List[str]) -> List[str]:
-        """
-        Generate multiple videos from images and prompts.
-        Returns a list of paths to the generated videos.
-        """
-        if len(image_paths) != len(prompts):
-            raise ValueError("Number of images must match number of prompts")
-        
-        generated_videos = []
-        for image_path, prompt in zip(image_paths, prompts):
-            video_path = self.generate_video(image_path, prompt)
-            generated_videos.append(video_path)
-        
-        return generated_videos 
\ No newline at end of file
+# Minimax task states mapped onto the Kling task_status values used in progress events
+_CLIP_STATES = {"queued": "submitted", "completed": "succeed", "failed": "failed"}
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
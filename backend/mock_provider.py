@@ -0,0 +1,246 @@
+"""
+Local stand-in for the Kling and Minimax APIs, for load tests and development without real keys.
+
+Run it next to the backend and point the clients at it:
+
+    uvicorn mock_provider:app --port 9000
+    KLINGAI_BASE_URL=http://localhost:9000/kling/v1 MINIMAX_BASE_URL=http://localhost:9000/minimax/v1 python main.py
+
+Task durations, request latency, failures and 429 throttling are set with the MOCK_* variables below.
+"""
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List
+
+import anyio
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse
+from moviepy.config import get_setting
+
+# Median seconds from submission until a task has finished
+MOCK_TASK_SECONDS = float(os.getenv("MOCK_TASK_SECONDS", "5"))
+# Median seconds added to every API call
+MOCK_REQUEST_SECONDS = float(os.getenv("MOCK_REQUEST_SECONDS", "0.05"))
+# Spread of both: each value is drawn from a log-normal distribution with this sigma (0 = fixed)
+MOCK_LATENCY_SIGMA = float(os.getenv("MOCK_LATENCY_SIGMA", "0.5"))
+# Share of tasks that end as failed, like a moderation rejection
+MOCK_TASK_FAILURE_RATE = float(os.getenv("MOCK_TASK_FAILURE_RATE", "0"))
+# Share of API calls answered with a 500
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+# API calls per second allowed per API key before answering 429 (0 = unlimited), and the Retry-After sent
+MOCK_RATE_LIMIT = float(os.getenv("MOCK_RATE_LIMIT", "0"))
+MOCK_RETRY_AFTER = int(os.getenv("MOCK_RETRY_AFTER", "1"))
+# Sample clips served as task results, generated with ffmpeg on startup if missing
+MOCK_CLIPS_DIR = os.getenv("MOCK_CLIPS_DIR", "mock_clips")
+MOCK_CLIP_COUNT = int(os.getenv("MOCK_CLIP_COUNT", "3"))
+MOCK_CLIP_SECONDS = int(os.getenv("MOCK_CLIP_SECONDS", "2"))
+
+_CLIP_COLORS = ("red", "green", "blue", "yellow", "purple", "orange")
+# Tasks are forgotten this long after they finish
+_TASK_RETENTION = 3600
+
+
+def _latency(median: float) -> float:
+    """A log-normal sample around median, so most values are close and a few are much slower."""
+    if median <= 0:
+        return 0.0
+    if MOCK_LATENCY_SIGMA <= 0:
+        return median
+    return random.lognormvariate(math.log(median), MOCK_LATENCY_SIGMA)
+
+
+def ensure_sample_clips(clips_dir: str = MOCK_CLIPS_DIR, count: int = MOCK_CLIP_COUNT) -> List[str]:
+    """
+    Paths of the sample clips, rendering any that are missing. All clips share codec
+    parameters, so the backend can merge them by stream copy like real provider output.
+    """
+    os.makedirs(clips_dir, exist_ok=True)
+    paths = []
+    for i in range(max(1, count)):
+        path = os.path.join(clips_dir, f"sample_{i}.mp4")
+        if not os.path.exists(path):
+            color = _CLIP_COLORS[i % len(_CLIP_COLORS)]
+            subprocess.run(
+                [
+                    get_setting("FFMPEG_BINARY"), "-hide_banner", "-loglevel", "error", "-y",
+                    "-f", "lavfi", "-i", f"color=c={color}:s=640x360:r=24:d={MOCK_CLIP_SECONDS}",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart", path,
+                ],
+                check=True,
+            )
+        paths.append(path)
+    return paths
+
+
+class MockTask:
+    def __init__(self, clip: str):
+        self.created = time.monotonic()
+        duration = _latency(MOCK_TASK_SECONDS)
+        # Like the real APIs, a task sits in the queue for a while before it starts processing
+        self.started = self.created + duration * 0.2
+        self.finished = self.created + duration
+        self.failed = random.random() < MOCK_TASK_FAILURE_RATE
+        self.clip = clip
+
+    def state(self) -> str:
+        """"queued", "processing", "succeed" or "failed"."""
+        now = time.monotonic()
+        if now < self.started:
+            return "queued"
+        if now < self.finished:
+            return "processing"
+        return "failed" if self.failed else "succeed"
+
+
+class MockProvider:
+    """Task bookkeeping, failure injection and per-key throttling shared by both fake APIs."""
+
+    def __init__(self):
+        self.tasks: Dict[str, MockTask] = {}
+        self.clips: List[str] = []
+        self.stats: Dict[str, int] = {"requests": 0, "throttled": 0, "errors": 0, "submitted": 0, "downloads": 0}
+        self._calls: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    async def call(self, request: Request) -> None:
+        """Apply request latency, 429 throttling and injected 500s to one API call."""
+        self.stats["requests"] += 1
+        await anyio.sleep(_latency(MOCK_REQUEST_SECONDS))
+        key = request.headers.get("authorization")
+        if not key:
+            raise HTTPException(status_code=401, detail="Missing Authorization header")
+        if MOCK_RATE_LIMIT > 0 and self._throttled(key):
+            self.stats["throttled"] += 1
+            raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(MOCK_RETRY_AFTER)})
+        if random.random() < MOCK_ERROR_RATE:
+            self.stats["errors"] += 1
+            raise HTTPException(status_code=500, detail="Injected server error")
+
+    def _throttled(self, key: str) -> bool:
+        # Sliding one-second window per key
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls.setdefault(key, deque())
+            while calls and calls[0] <= now - 1:
+                calls.popleft()
+            if len(calls) >= MOCK_RATE_LIMIT:
+                return True
+            calls.append(now)
+            return False
+
+    def submit(self) -> str:
+        self._prune()
+        task_id = uuid.uuid4().hex
+        self.tasks[task_id] = MockTask(random.choice(self.clips))
+        self.stats["submitted"] += 1
+        return task_id
+
+    def get(self, task_id: str) -> MockTask:
+        task = self.tasks.get(task_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return task
+
+    def clip_url(self, request: Request, task: MockTask) -> str:
+        return str(request.url_for("get_clip", name=os.path.basename(task.clip)))
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - _TASK_RETENTION
+        for task_id in [task_id for task_id, task in self.tasks.items() if task.finished < cutoff]:
+            del self.tasks[task_id]
+
+
+provider = MockProvider()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    provider.clips = await anyio.to_thread.run_sync(ensure_sample_clips)
+    yield
+
+
+app = FastAPI(title="Mock video providers", lifespan=lifespan)
+
+# Task states in Kling's vocabulary
+_KLING_STATES = {"queued": "submitted", "processing": "processing", "succeed": "succeed", "failed": "failed"}
+# Task states in Minimax's vocabulary
+_MINIMAX_STATES = {"queued": "queued", "processing": "processing", "succeed": "completed", "failed": "failed"}
+
+
+@app.post("/kling/v1/videos/image2video")
+async def kling_submit(request: Request):
+    await provider.call(request)
+    payload = await request.json()
+    if not payload.get("image"):
+        raise HTTPException(status_code=400, detail="image is required")
+    task_id = provider.submit()
+    return {"code": 0, "message": "SUCCEED", "data": {"task_id": task_id, "task_status": "submitted"}}
+
+
+@app.get("/kling/v1/videos/image2video/{task_id}")
+async def kling_status(request: Request, task_id: str):
+    await provider.call(request)
+    task = provider.get(task_id)
+    state = task.state()
+    data = {"task_id": task_id, "task_status": _KLING_STATES[state], "task_status_msg": ""}
+    if state == "succeed":
+        data["task_result"] = {"videos": [{"id": task_id, "url": provider.clip_url(request, task)}]}
+    elif state == "failed":
+        data["task_status_msg"] = "Mock task failure"
+    return {"code": 0, "message": "SUCCEED", "data": data}
+
+
+@app.post("/minimax/v1/media/upload")
+async def minimax_upload(request: Request, file: UploadFile = File(...)):
+    await provider.call(request)
+    await file.read()
+    return {"url": f"https://mock.invalid/media/{uuid.uuid4().hex}/{file.filename}"}
+
+
+@app.post("/minimax/v1/text_to_video")
+async def minimax_submit(request: Request):
+    await provider.call(request)
+    payload = await request.json()
+    if not payload.get("image_url"):
+        raise HTTPException(status_code=400, detail="image_url is required")
+    return {"task_id": provider.submit()}
+
+
+@app.get("/minimax/v1/text_to_video/status/{task_id}")
+async def minimax_status(request: Request, task_id: str):
+    await provider.call(request)
+    task = provider.get(task_id)
+    state = task.state()
+    data = {"task_id": task_id, "status": _MINIMAX_STATES[state]}
+    if state == "succeed":
+        data["result"] = {"video_url": provider.clip_url(request, task)}
+    elif state == "failed":
+        data["error"] = "Mock task failure"
+    return data
+
+
+@app.get("/clips/{name}")
+async def get_clip(name: str):
+    path = os.path.join(MOCK_CLIPS_DIR, os.path.basename(name))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Clip not found")
+    provider.stats["downloads"] += 1
+    return FileResponse(path, media_type="video/mp4")
+
+
+@app.get("/stats")
+async def get_stats():
+    """Request, throttle, error, submission and download counts since startup."""
+    return JSONResponse({**provider.stats, "tasks": len(provider.tasks)})
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("MOCK_PORT", "9000")))
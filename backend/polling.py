@@ -0,0 +1,241 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, List, Mapping, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean "slow down" rather than "failed"
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date), if present."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class PollingPolicy:
+    """
+    Adaptive poll intervals for one provider.
+    Polls come every early_interval seconds while a task is young and tighten as it nears
+    the time the fastest tasks finish, then back off exponentially from min_interval.
+    That time is a low percentile of recent completion times, or expected_duration until
+    enough tasks have finished, so a typical task finishes while polls are still frequent.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        expected_duration: float,
+        min_interval: float = 2.0,
+        max_interval: float = 30.0,
+        early_interval: float = 5.0,
+        backoff: float = 1.5,
+        jitter: float = 0.2,
+        timeout: float = 900.0,
+    ):
+        self.name = name
+        self.expected_duration = expected_duration
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.early_interval = early_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.timeout = timeout
+        # Recent completion times, for percentile estimates
+        self._recent: Deque[float] = deque(maxlen=200)
+
+    @classmethod
+    def from_env(cls, env_prefix: str, name: str, expected_duration: float, timeout: float) -> "PollingPolicy":
+        """Build a policy from <env_prefix>_POLL_* environment variables."""
+        return cls(
+            name,
+            expected_duration=float(os.getenv(f"{env_prefix}_POLL_EXPECTED_SECONDS", str(expected_duration))),
+            min_interval=float(os.getenv(f"{env_prefix}_POLL_MIN_INTERVAL", "2")),
+            max_interval=float(os.getenv(f"{env_prefix}_POLL_MAX_INTERVAL", "30")),
+            early_interval=float(os.getenv(f"{env_prefix}_POLL_EARLY_INTERVAL", "5")),
+            timeout=float(os.getenv(f"{env_prefix}_POLL_TIMEOUT", str(timeout))),
+        )
+
+    def backoff_after(self) -> float:
+        """Seconds after submission from which polls back off: when the fastest tasks finish."""
+        earliest = self.completion_percentile(0.1)
+        return self.expected_duration if earliest is None else earliest
+
+    def next_delay(self, elapsed: float, overdue_polls: int = 0) -> float:
+        """
+        Delay before the next poll of a task submitted elapsed seconds ago.
+        overdue_polls counts the polls already made after backoff_after().
+        """
+        remaining = self.backoff_after() - elapsed
+        if remaining > 0:
+            # Halve the distance to when tasks start finishing, polling at least every early_interval
+            delay = min(self.early_interval, remaining / 2)
+        else:
+            delay = self.min_interval * (self.backoff ** overdue_polls)
+        delay = min(self.max_interval, max(self.min_interval, delay))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def throttled_delay(self, elapsed: float, headers: Mapping[str, str]) -> float:
+        """Delay after the provider answered 429/503, honouring Retry-After when given."""
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            return retry_after
+        return min(self.max_interval, self.next_delay(elapsed) * 2)
+
+    def record_completion(self, duration: float) -> None:
+        """Record the time from submission to completion of a finished task."""
+        self._recent.append(duration)
+
+    def completion_percentile(self, fraction: float, min_samples: int = 10) -> Optional[float]:
+        """A percentile (0-1) of recent completion times, or None until min_samples tasks have finished."""
+        if len(self._recent) < min_samples:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def completion_p95(self, min_samples: int = 10) -> Optional[float]:
+        """95th percentile of recent completion times, or None until min_samples tasks have finished."""
+        return self.completion_percentile(0.95, min_samples)
+
+
+def _throttle_response(error: Exception):
+    """The HTTP response behind a 429/503 error from httpx, else None."""
+    response = getattr(error, "response", None)
+    if response is not None and response.status_code in THROTTLE_STATUS_CODES:
+        return response
+    return None
+
+
+class _PollEntry:
+    def __init__(self, poll: Callable[[], Awaitable[Any]], policy: PollingPolicy, future: asyncio.Future, resumed: bool = False):
+        self.poll = poll
+        self.policy = policy
+        self.future = future
+        # Submitted before this wait started, so started is not the submission time
+        self.resumed = resumed
+        # Polls run in the waiting caller's context (e.g. its job trace), not the scheduler's
+        self.context = contextvars.copy_context()
+        self.started = time.monotonic()
+        self.deadline = self.started + policy.timeout
+        self.overdue_polls = 0
+
+
+class PollScheduler:
+    """
+    One timer loop for every outstanding provider task.
+    Tasks wait in a heap ordered by their next poll time; a single loop sleeps until the
+    earliest one is due and fires its poll, so no task holds a sleeping thread or coroutine.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, _PollEntry]] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Strong references to polls in flight so they are not garbage collected
+        self._in_flight: Set[asyncio.Task] = set()
+
+    def _ensure_running(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._runner is None or self._runner.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._runner = loop.create_task(self._run())
+
+    def _schedule(self, entry: _PollEntry, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), entry))
+        self._wakeup.set()
+
+    async def wait_for(
+        self,
+        poll: Callable[[], Awaitable[Any]],
+        policy: PollingPolicy,
+        first_delay: Optional[float] = None,
+        resumed: bool = False,
+    ) -> Any:
+        """
+        Poll until poll() returns something other than None and return it.
+        Raises TimeoutError after policy.timeout seconds, and re-raises any error from poll()
+        other than a 429/503 throttle response. resumed marks a task submitted earlier (e.g.
+        before a restart), whose completion time is unknown and so not recorded.
+        """
+        self._ensure_running()
+        entry = _PollEntry(poll, policy, self._loop.create_future(), resumed)
+        self._schedule(entry, policy.next_delay(0) if first_delay is None else first_delay)
+        return await entry.future
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, entry = heapq.heappop(self._heap)
+                if not entry.future.done():
+                    task = entry.context.run(self._loop.create_task, self._poll(entry))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, entry: _PollEntry) -> None:
+        elapsed = time.monotonic() - entry.started
+        try:
+            result = await entry.poll()
+        except Exception as e:
+            throttled = _throttle_response(e)
+            if throttled is None:
+                self._fail(entry, e)
+                return
+            logger.warning("%s throttled status polling (%s), backing off", entry.policy.name, throttled.status_code)
+            self._reschedule(entry, entry.policy.throttled_delay(elapsed, throttled.headers))
+            return
+
+        if result is not None:
+            if not entry.resumed:
+                entry.policy.record_completion(time.monotonic() - entry.started)
+            if not entry.future.done():
+                entry.future.set_result(result)
+            return
+        elapsed = time.monotonic() - entry.started
+        delay = entry.policy.next_delay(elapsed, entry.overdue_polls)
+        if elapsed > entry.policy.backoff_after():
+            entry.overdue_polls += 1
+        self._reschedule(entry, delay)
+
+    def _reschedule(self, entry: _PollEntry, delay: float) -> None:
+        now = time.monotonic()
+        if now >= entry.deadline:
+            self._fail(entry, TimeoutError(f"{entry.policy.name} task did not finish within {entry.policy.timeout:.0f} seconds"))
+            return
+        # Always make one last poll right at the deadline
+        self._schedule(entry, min(delay, entry.deadline - now))
+
+    def _fail(self, entry: _PollEntry, error: Exception) -> None:
+        if not entry.future.done():
+            entry.future.set_exception(error)
+
+
+# Shared by every async provider client in the process
+poll_scheduler = PollScheduler()
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+
+from klingai_client import AsyncKlingAIClient
+from minimax_client import AsyncMinimaxClient
+from providers import Credentials, VideoProvider
+
+logger = logging.getLogger(__name__)
+
+# Provider accounts as a JSON list, e.g.
+# [{"id": "kling", "type": "kling"},
+#  {"id": "kling-team", "type": "kling", "name": "Kling (team)", "access_key_id": "...", "access_key_secret": "..."},
+#  {"id": "minmax", "type": "minimax", "api_key": "...", "group_id": "...", "max_concurrency": 4}]
+# Unset, there is one Kling provider using the keys sent with each job and one Minimax
+# provider using MINIMAX_API_KEY and MINIMAX_GROUP_ID.
+VIDEO_PROVIDERS = os.getenv("VIDEO_PROVIDERS", "")
+
+_DEFAULT_PROVIDERS = [
+    {"id": "kling", "type": "kling", "name": "Kling"},
+    {"id": "minmax", "type": "minimax", "name": "Minimax"},
+]
+
+# Client class per provider type; an entry's other fields are passed to it as keyword arguments
+PROVIDER_TYPES = {
+    "kling": AsyncKlingAIClient,
+    "minimax": AsyncMinimaxClient,
+}
+
+# Job provider value that spreads the job's clips over every available provider
+AUTO_PROVIDER = "auto"
+# Provider values jobs have always used for a type
+_KIND_ALIASES = {"minmax": "minimax"}
+
+
+class ProviderRegistry:
+    """The configured video providers, by id, in configuration order."""
+
+    def __init__(self, providers: List[VideoProvider]):
+        self._providers: "OrderedDict[str, VideoProvider]" = OrderedDict((provider.name, provider) for provider in providers)
+
+    @classmethod
+    def from_config(cls, entries: List[Dict[str, Any]], **shared: Any) -> "ProviderRegistry":
+        """
+        Build a provider per entry ({"id", "type", optional "name" and client options}).
+        shared keyword arguments (the clip and asset caches) go to every client. Entries that
+        cannot be set up, e.g. for lack of an API key, are skipped with a warning.
+        """
+        providers = []
+        for entry in entries:
+            options = dict(entry)
+            provider_id = options.pop("id", None) or options.get("type")
+            provider_type = options.pop("type", provider_id)
+            display_name = options.pop("name", provider_id)
+            client_class = PROVIDER_TYPES.get(provider_type)
+            if client_class is None:
+                logger.error("Unknown provider type %r for provider %r", provider_type, provider_id)
+                continue
+            try:
+                providers.append(client_class(name=provider_id, display_name=display_name, **options, **shared))
+                logger.info("%s provider initialized successfully", display_name, extra={"provider": provider_id})
+            except ValueError as e:
+                logger.warning("%s provider not available - %s", display_name, e, extra={"provider": provider_id})
+            except Exception as e:
+                logger.error("Error initializing %s provider: %s", display_name, e, extra={"provider": provider_id})
+        return cls(providers)
+
+    @classmethod
+    def from_env(cls, **shared: Any) -> "ProviderRegistry":
+        """Build the providers listed in VIDEO_PROVIDERS, or the default Kling and Minimax pair."""
+        entries = json.loads(VIDEO_PROVIDERS) if VIDEO_PROVIDERS else _DEFAULT_PROVIDERS
+        return cls.from_config(entries, **shared)
+
+    def __iter__(self) -> Iterator[VideoProvider]:
+        return iter(self._providers.values())
+
+    def __len__(self) -> int:
+        return len(self._providers)
+
+    def get(self, name: str) -> Optional[VideoProvider]:
+        return self._providers.get(name)
+
+    def match(self, selector: str) -> List[VideoProvider]:
+        """
+        Providers a job asking for selector may use: every provider of that type (e.g. "kling"
+        with several Kling accounts), the provider with that id, or all of them for "auto".
+        """
+        if selector == AUTO_PROVIDER:
+            return list(self)
+        kind = _KIND_ALIASES.get(selector, selector)
+        same_kind = [provider for provider in self if provider.kind == kind]
+        if same_kind:
+            return same_kind
+        provider = self._providers.get(selector)
+        return [provider] if provider else []
+
+    def select(self, selector: str, credentials: Credentials) -> List[VideoProvider]:
+        """The matching providers that can run with the job's credentials."""
+        return [provider for provider in self.match(selector) if provider.credentials_for(credentials) is not None]
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [provider.describe() for provider in self]
+
+    async def aclose(self) -> None:
+        for provider in self:
+            await provider.aclose()
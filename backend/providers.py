@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from downloads import async_download_to_file
+from job_events import ClipProgressCallback
+from metrics import CLIPS, observe, record_download
+from polling import PollingPolicy, poll_scheduler
+from rate_limit import OutboundLimiter
+from retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# Provider credentials, e.g. {"access_key_id": ..., "access_key_secret": ...} for Kling
+Credentials = Dict[str, str]
+
+
+class VideoProvider(ABC):
+    """
+    One video generation backend: a provider API and the account used with it.
+
+    Subclasses implement the three stages of a clip:
+      submit(image_path, image_digest, prompt, credentials) -> task id
+      poll(task_id, credentials) -> (state, video_url), with state one of submitted,
+          processing or succeed (a failed task raises ClipRejectedError), and the URL once succeeded
+      fetch(task_id, video_url, on_progress) -> (path, bytes written)
+    generate_video runs them for one clip, with metrics and progress reports; callers look the
+    clip up first with clip_cache_key and cached_clip, before they pick a provider or preprocess.
+    """
+
+    # Registry id, e.g. "kling", and the name shown to users
+    name = ""
+    display_name = ""
+    # API flavour ("kling" or "minimax"); selects the image preprocessing profile
+    kind = ""
+    # Seconds of video each clip is requested with
+    clip_duration = 10.0
+
+    limiter: OutboundLimiter
+    retry_policy: RetryPolicy
+    polling_policy: PollingPolicy
+    http: httpx.AsyncClient
+    clip_cache = None
+
+    def credentials_for(self, request_credentials: Credentials) -> Optional[Credentials]:
+        """
+        The credentials this provider's calls use: its own configured account, or the ones that
+        came with the request. None when neither is available, so the provider cannot take the job.
+        """
+        return {}
+
+    @abstractmethod
+    def account_key(self, credentials: Credentials) -> str:
+        """The API key that the limiter counts this provider's requests and clips against."""
+
+    def load(self, credentials: Credentials) -> float:
+        """How busy the account is: clips in flight and queued per clip slot."""
+        return self.limiter.load(self.account_key(credentials))
+
+    @abstractmethod
+    async def submit(self, image_path: str, image_digest: Optional[str], prompt: str, credentials: Credentials) -> str:
+        """Start a generation task for the image and prompt and return its task id."""
+
+    @abstractmethod
+    async def poll(self, task_id: str, credentials: Credentials) -> Tuple[str, Optional[str]]:
+        """The task's state and, once it has succeeded, the URL of its video."""
+
+    async def fetch(self, task_id: str, video_url: str, on_progress=None) -> Tuple[str, int]:
+        """Stream the finished clip to a temporary file."""
+        output_path = self._output_path(task_id)
+        size = await async_download_to_file(self.http, video_url, output_path, on_progress=on_progress)
+        return output_path, size
+
+    async def aclose(self) -> None:
+        """Release the provider's connections."""
+
+    @abstractmethod
+    def _output_path(self, task_id: str) -> str:
+        """Where a task's clip is downloaded to."""
+
+    @abstractmethod
+    def _image_digest(self, image_path: str) -> Optional[str]:
+        """SHA-256 of the submitted image for the provider's image asset cache, or None without one."""
+
+    @abstractmethod
+    def clip_cache_key(self, image_digest: str, prompt: str) -> str:
+        """Clip cache key of a source image's digest (as uploaded, before preprocessing) and prompt."""
+
+    @abstractmethod
+    def _cached_clip(self, cache_key: str) -> Optional[str]:
+        """Blocking clip cache lookup behind cached_clip."""
+
+    async def cached_clip(self, cache_key: str) -> Optional[str]:
+        """A copy of the clip cached under cache_key, or None on a miss."""
+        cached_path = await asyncio.to_thread(self._cached_clip, cache_key)
+        if cached_path:
+            CLIPS.inc(provider=self.name, outcome="cached")
+        return cached_path
+
+    async def generate_video(
+        self,
+        image_path: str,
+        prompt: str,
+        credentials: Credentials,
+        on_progress: Optional[ClipProgressCallback] = None,
+        task_id: Optional[str] = None,
+        cache_key: Optional[str] = None,
+    ) -> str:
+        """
+        Generate one clip from an image and prompt and return its path.
+        on_progress(state, details) reports submitted, processing and succeed, and download progress.
+        Passing the task_id of an earlier submission resumes it without submitting again.
+        The downloaded clip is stored in the clip cache under cache_key, when given.
+        """
+        report = on_progress or (lambda state, details: None)
+        resumed = task_id is not None
+        try:
+            logger.info("Generating video for image %s", image_path, extra={"provider": self.name, "prompt": prompt})
+
+            if not resumed:
+                image_digest = await asyncio.to_thread(self._image_digest, image_path)
+                task_id = await self.submit(image_path, image_digest, prompt, credentials)
+                logger.info("Video generation started", extra={"provider": self.name, "task_id": task_id})
+                report("submitted", {"task_id": task_id})
+            else:
+                logger.info("Resuming video generation task", extra={"provider": self.name, "task_id": task_id})
+
+            # Poll for completion through the shared scheduler
+            last_state = "submitted"
+
+            async def check_status() -> Optional[str]:
+                nonlocal last_state
+                with observe("poll", self.name, task_id=task_id) as span:
+                    state, video_url = await self.poll(task_id, credentials)
+                    span["status"] = state
+                if state != last_state:
+                    last_state = state
+                    report(state, {"task_id": task_id})
+                return video_url
+
+            try:
+                # Time from submission (or resumption) until the provider has the clip ready
+                with observe("provider_queue", self.name, task_id=task_id):
+                    video_url = await poll_scheduler.wait_for(check_status, self.polling_policy, resumed=resumed)
+            except TimeoutError:
+                logger.error("Video generation timed out", extra={"provider": self.name, "task_id": task_id})
+                raise TimeoutError(f"Video generation timed out after {self.polling_policy.timeout / 60:.0f} minutes")
+
+            # Stream the video to disk
+            download_started = time.perf_counter()
+            with observe("download", self.name, task_id=task_id) as span:
+                output_path, size = await self.fetch(
+                    task_id, video_url,
+                    on_progress=lambda written, total: report("downloading", {"bytes": written, "total": total}),
+                )
+                span["bytes"] = size
+            record_download(self.name, size, time.perf_counter() - download_started)
+            logger.info("Video saved to %s", output_path, extra={"task_id": task_id, "bytes": size})
+            if cache_key:
+                await asyncio.to_thread(self.clip_cache.put, cache_key, output_path)
+
+            return output_path
+        except httpx.HTTPStatusError as e:
+            logger.error("API Request Error: %s", e, extra={"provider": self.name, "response_body": e.response.text})
+            raise
+        except httpx.RequestError as e:
+            logger.error("Network Error: %s", e, extra={"provider": self.name})
+            raise
+        except KeyError as e:
+            logger.error("API Response Format Error: Missing expected key - %s", e, extra={"provider": self.name})
+            raise
+
+    def describe(self) -> Dict[str, Any]:
+        """The provider as listed by /api-providers; requires_credentials means jobs must bring their own keys."""
+        return {
+            "id": self.name,
+            "name": self.display_name,
+            "type": self.kind,
+            "requires_credentials": self.credentials_for({}) is None,
+        }
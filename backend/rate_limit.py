@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+# Seconds between sweeps that drop the state of API keys with nothing in flight
+IDLE_KEY_SWEEP_INTERVAL = 60.0
+
+
+class TokenBucket:
+    """
+    Limits requests to `rate` per second with bursts of up to `burst`.
+    Callers reserve a token up front, so waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self.waiting = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    def full(self, now: float) -> bool:
+        """True once the bucket has refilled to its burst, i.e. a fresh bucket would behave the same."""
+        return self._tokens + (now - self._updated) * self.rate >= self.burst
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return
+        # The token is borrowed from the future: wait until it has been refilled
+        delay = -self._tokens / self.rate
+        self.throttled += 1
+        self.total_wait += delay
+        self.waiting += 1
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+
+
+class FairAdmissionQueue:
+    """
+    Concurrency cap whose waiters are admitted round-robin by job, so one large batch
+    cannot hold every slot while other jobs wait behind it.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.active = 0
+        # job id -> waiting futures, in the order jobs take turns
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def acquire(self, job_id: str) -> None:
+        started = time.monotonic()
+        if self.active < self.capacity and not self._waiters:
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(job_id, deque()).append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was granted as we were cancelled: hand it on
+                    self.release()
+                else:
+                    self._remove(job_id, future)
+                raise
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def release(self) -> None:
+        self.active -= 1
+        while self.active < self.capacity and self._waiters:
+            # Next job in turn gets one slot, then moves to the back of the rotation
+            job_id, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiters.move_to_end(job_id)
+            else:
+                del self._waiters[job_id]
+            if not future.done():
+                future.set_result(None)
+                self.active += 1
+
+    def _remove(self, job_id: str, future: asyncio.Future) -> None:
+        waiters = self._waiters.get(job_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._waiters[job_id]
+
+
+class _KeyLimits:
+    def __init__(self, rate: float, burst: float, concurrency: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.admission = FairAdmissionQueue(concurrency)
+
+    def idle(self, now: float) -> bool:
+        """Nothing in flight, queued or throttled, and a full bucket: dropping the state loses nothing."""
+        admission = self.admission
+        return admission.active == 0 and not admission.depth and self.bucket.waiting == 0 and self.bucket.full(now)
+
+
+class OutboundLimiter:
+    """
+    Limits what we send to one provider, separately for each API key: a token bucket on
+    API requests and a cap on clips in flight, shared fairly between jobs.
+    Per-key overrides are a JSON object of {api_key: {"rate", "burst", "concurrency"}}.
+    Keys that go idle are forgotten, so jobs bringing their own keys do not grow it forever.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, concurrency: int, overrides: Optional[Dict[str, Dict[str, float]]] = None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.overrides = overrides or {}
+        self._keys: Dict[str, _KeyLimits] = {}
+        self._last_sweep = time.monotonic()
+
+    @classmethod
+    def from_env(cls, prefix: str, name: str, concurrency: int) -> "OutboundLimiter":
+        """Read {prefix}_RATE_LIMIT (requests/second), {prefix}_RATE_BURST and {prefix}_KEY_LIMITS."""
+        return cls(
+            name,
+            rate=float(os.getenv(f"{prefix}_RATE_LIMIT", "5")),
+            burst=float(os.getenv(f"{prefix}_RATE_BURST", "10")),
+            concurrency=concurrency,
+            overrides=json.loads(os.getenv(f"{prefix}_KEY_LIMITS", "{}")),
+        )
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < IDLE_KEY_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for api_key in [key for key, limits in self._keys.items() if limits.idle(now)]:
+            del self._keys[api_key]
+
+    def _limits(self, api_key: str) -> _KeyLimits:
+        self._evict_idle()
+        limits = self._keys.get(api_key)
+        if limits is None:
+            override = self.overrides.get(api_key, {})
+            limits = _KeyLimits(
+                rate=float(override.get("rate", self.rate)),
+                burst=float(override.get("burst", self.burst)),
+                concurrency=int(override.get("concurrency", self.concurrency)),
+            )
+            self._keys[api_key] = limits
+        return limits
+
+    @asynccontextmanager
+    async def admit(self, api_key: str, job_id: str) -> AsyncIterator[None]:
+        """Hold one of the key's clip slots for the duration of the block."""
+        admission = self._limits(api_key).admission
+        await admission.acquire(job_id)
+        try:
+            yield
+        finally:
+            admission.release()
+
+    async def throttle(self, api_key: str) -> None:
+        """Wait until the key's request rate allows another API call."""
+        await self._limits(api_key).bucket.acquire()
+
+    def load(self, api_key: str) -> float:
+        """Clips in flight and queued per clip slot of the key: 0 is idle, above 1 means clips are waiting."""
+        limits = self._keys.get(api_key)
+        if limits is None:
+            return 0.0
+        admission = limits.admission
+        return (admission.active + admission.depth) / max(1, admission.capacity)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue depth, in-flight clips and wait statistics per API key in use."""
+        self._evict_idle()
+        keys = {}
+        for api_key, limits in self._keys.items():
+            admission, bucket = limits.admission, limits.bucket
+            # Keys are reported by a short fingerprint, never in the clear
+            label = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+            keys[label] = {
+                "queue_depth": admission.depth,
+                "active": admission.active,
+                "concurrency": admission.capacity,
+                "admitted": admission.admitted,
+                "avg_admission_wait": admission.total_wait / admission.admitted if admission.admitted else 0.0,
+                "max_admission_wait": admission.max_wait,
+                "rate_limit": bucket.rate,
+                "rate_burst": bucket.burst,
+                "throttled_requests": bucket.throttled,
+                "throttle_waiting": bucket.waiting,
+                "total_throttle_wait": bucket.total_wait,
+            }
+        return {"provider": self.name, "keys": keys}
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import random
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from downloads import IncompleteDownloadError
+from polling import parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# What happens to a batch when a clip still fails after its retries:
+# "skip" merges the clips that succeeded, "abort" fails the whole job
+CLIP_FAILURE_POLICY = os.getenv("CLIP_FAILURE_POLICY", "skip").lower()
+
+FAILURE_TRANSIENT = "transient"
+FAILURE_REJECTED = "rejected"
+
+# HTTP statuses worth trying again: timeouts, throttling and server errors
+_TRANSIENT_STATUS_CODES = (408, 425, 429)
+
+
+class ClipRejectedError(Exception):
+    """The provider refused or failed the task itself (e.g. content moderation); resubmitting will not help."""
+
+
+class ClipAttemptError(Exception):
+    """
+    A failed clip attempt: the error it failed with and the provider task it had submitted
+    (None if it failed before submitting), so a retry can pick that task up again.
+    """
+
+    def __init__(self, task_id: Optional[str], cause: BaseException):
+        super().__init__(str(cause))
+        self.task_id = task_id
+        self.cause = cause
+
+
+def classify_failure(error: BaseException) -> str:
+    """
+    FAILURE_TRANSIENT for network errors, timeouts, throttling and 5xx responses,
+    FAILURE_REJECTED for everything else, including failed tasks and other 4xx responses.
+    """
+    if isinstance(error, ClipRejectedError):
+        return FAILURE_REJECTED
+    response = getattr(error, "response", None)
+    if isinstance(error, httpx.HTTPStatusError) and response is not None:
+        status = response.status_code
+        if status >= 500 or status in _TRANSIENT_STATUS_CODES:
+            return FAILURE_TRANSIENT
+        return FAILURE_REJECTED
+    if isinstance(error, (httpx.TransportError, TimeoutError, IncompleteDownloadError)):
+        return FAILURE_TRANSIENT
+    return FAILURE_REJECTED
+
+
+class RetryPolicy:
+    """
+    Per-clip retries for one provider: how often a transiently failed clip is resubmitted,
+    the backoff between attempts, and when a slow clip gets a hedged duplicate submission.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        base_delay: float = 5.0,
+        max_delay: float = 60.0,
+        hedge: bool = False,
+        hedge_factor: float = 1.5,
+    ):
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_factor = hedge_factor
+
+    @classmethod
+    def from_env(cls, env_prefix: str) -> "RetryPolicy":
+        """Build a policy from <env_prefix>_CLIP_RETRIES, _RETRY_* and _HEDGE* environment variables."""
+        return cls(
+            max_retries=int(os.getenv(f"{env_prefix}_CLIP_RETRIES", "2")),
+            base_delay=float(os.getenv(f"{env_prefix}_RETRY_BASE_DELAY", "5")),
+            max_delay=float(os.getenv(f"{env_prefix}_RETRY_MAX_DELAY", "60")),
+            hedge=os.getenv(f"{env_prefix}_HEDGE", "false").lower() == "true",
+            hedge_factor=float(os.getenv(f"{env_prefix}_HEDGE_FACTOR", "1.5")),
+        )
+
+    def retry_delay(self, retry: int, error: BaseException) -> float:
+        """Delay before retry number `retry` (1-based), honouring Retry-After on throttling responses."""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = parse_retry_after(response.headers)
+            if retry_after is not None:
+                return min(self.max_delay, retry_after)
+        delay = min(self.max_delay, self.base_delay * (2 ** (retry - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def hedge_delay(self, p95: Optional[float]) -> Optional[float]:
+        """Seconds after which a still-running clip is submitted a second time, or None for no hedging."""
+        if not self.hedge or p95 is None:
+            return None
+        return p95 * self.hedge_factor
+
+
+# attempt(task_id, started): generate one clip, resuming task_id if given, and set started once
+# it holds a provider slot. Returns the clip path; may wrap its failure in a ClipAttemptError.
+ClipAttempt = Callable[[Optional[str], asyncio.Event], Awaitable[str]]
+
+
+async def run_clip(
+    attempt: ClipAttempt,
+    policy: RetryPolicy,
+    task_id: Optional[str] = None,
+    hedge_after: Optional[float] = None,
+    on_retry: Optional[Callable[[int, BaseException], None]] = None,
+    on_hedge: Optional[Callable[[], None]] = None,
+) -> str:
+    """
+    Generate one clip, retrying it after transient failures (never after rejections).
+    With hedge_after set, an attempt still running that many seconds after it started gets a
+    duplicate submission, and whichever finishes first wins.
+    on_retry(retry, error) is called before each resubmission, on_hedge() before each hedged one.
+    Raises the last attempt's error, unwrapped from its ClipAttemptError.
+    """
+    retry = 0
+    while True:
+        try:
+            return await _hedged(attempt, task_id, hedge_after, on_hedge)
+        except Exception as e:
+            error = e.cause if isinstance(e, ClipAttemptError) else e
+            if retry >= policy.max_retries or classify_failure(error) != FAILURE_TRANSIENT:
+                raise error
+            retry += 1
+            if on_retry:
+                on_retry(retry, error)
+            await asyncio.sleep(policy.retry_delay(retry, error))
+            task_id = _resumable_task(e)
+
+
+def _resumable_task(error: BaseException) -> Optional[str]:
+    """
+    The provider task to pick up again after a failure, or None to resubmit.
+    A failed poll or download leaves the submitted task intact, while a timed-out task is submitted afresh.
+    """
+    if not isinstance(error, ClipAttemptError) or isinstance(error.cause, TimeoutError):
+        return None
+    return error.task_id
+
+
+async def _hedged(
+    attempt: ClipAttempt,
+    task_id: Optional[str],
+    hedge_after: Optional[float],
+    on_hedge: Optional[Callable[[], None]],
+) -> str:
+    started = asyncio.Event()
+    primary = asyncio.ensure_future(attempt(task_id, started))
+    if hedge_after is None:
+        return await primary
+
+    tasks = {primary}
+    try:
+        # The hedge clock starts once the attempt holds a slot, not while it queues for one
+        waiter = asyncio.ensure_future(started.wait())
+        await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if not done:
+            logger.info("Clip still running after %.1fs, submitting a hedged duplicate", hedge_after)
+            if on_hedge:
+                on_hedge()
+            tasks.add(asyncio.ensure_future(attempt(None, asyncio.Event())))
+
+        # First success wins; fail only when every attempt has failed
+        error: Optional[BaseException] = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
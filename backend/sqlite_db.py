@@ -0,0 +1,31 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+
+@contextmanager
+def connect(db_path: str) -> Iterator[sqlite3.Connection]:
+    """
+    A connection for one transaction: committed when the block succeeds, rolled back otherwise.
+    A fresh connection per call keeps the SQLite stores safe to use from worker threads.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def prepare_database(db_path: str) -> None:
+    """
+    Create the database file's directory and switch it to WAL, so readers are not blocked
+    by the writer in other worker processes.
+    """
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    with connect(db_path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+# The store is created at import, so its settings must be loaded first
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Root of the files the service writes: uploaded images, downloaded clips, final videos,
+# preprocessed images, HLS streams and cached image assets, each type in its own subdirectory
+STORAGE_DIR = os.getenv("STORAGE_DIR", "uploads")
+# Bytes kept under STORAGE_DIR; above it the sweeper evicts the least recently used artifacts
+STORAGE_MAX_BYTES = int(os.getenv("STORAGE_MAX_BYTES", str(20 * 1024 * 1024 * 1024)))
+# Seconds between sweeps
+STORAGE_SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL", "300"))
+
+# Artifact types
+IMAGES = "images"
+CLIPS = "clips"
+VIDEOS = "videos"
+PREPROCESSED = "preprocessed"
+STREAMS = "streams"
+ASSETS = "assets"
+
+# Seconds each type is kept after it was last written or used
+ARTIFACT_TTLS = {
+    IMAGES: float(os.getenv("STORAGE_IMAGE_TTL", str(24 * 3600))),
+    CLIPS: float(os.getenv("STORAGE_CLIP_TTL", str(6 * 3600))),
+    VIDEOS: float(os.getenv("STORAGE_VIDEO_TTL", str(7 * 24 * 3600))),
+    PREPROCESSED: float(os.getenv("STORAGE_PREPROCESSED_TTL", str(24 * 3600))),
+    STREAMS: float(os.getenv("STORAGE_STREAM_TTL", str(24 * 3600))),
+    ASSETS: float(os.getenv("STORAGE_ASSET_TTL", str(3600))),
+}
+
+# Temporary files not renamed into place within this many seconds were left behind by a crash
+TEMP_FILE_TTL = 3600
+
+
+def shard_path(directory: str, name: str) -> str:
+    """
+    directory/ab/cd/name, with ab and cd taken from the SHA-256 of name, so no directory
+    holds more than a few hundred entries however many files there are.
+    """
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+    return os.path.join(directory, digest[:2], digest[2:4], name)
+
+
+def _is_temp(name: str) -> bool:
+    return name.startswith(".") or name.endswith((".tmp", ".part"))
+
+
+def _legacy_kind(name: str) -> str:
+    """Type of a file from the flat layout that predates the per-type subdirectories."""
+    if name.startswith("temp_"):
+        return CLIPS
+    if name.endswith(".mp4"):
+        return VIDEOS
+    return IMAGES
+
+
+class ArtifactStore:
+    """
+    Files on local disk, hash-sharded per artifact type and written through temp-and-rename,
+    so readers never see a partial file.
+
+    A background sweep removes artifacts that were not used within their type's TTL and,
+    while the total is above max_bytes, the least recently used ones. Files a running job
+    has retained are never removed until it releases them.
+    """
+
+    def __init__(self, root: str = STORAGE_DIR, max_bytes: int = STORAGE_MAX_BYTES, ttls: Optional[Dict[str, float]] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttls = ttls or ARTIFACT_TTLS
+        self._lock = threading.Lock()
+        # Absolute path -> number of holders
+        self._refs: Counter = Counter()
+        # Bytes per type as of the last sweep
+        self.usage: Dict[str, int] = {}
+        # on_remove(kind, path) is called for every file the sweeper deletes, e.g. to drop cached metadata
+        self.on_remove: Optional[Callable[[str, str], None]] = None
+        # protected() lists further paths to keep, e.g. those of jobs in other worker processes
+        self.protected: Optional[Callable[[], Iterable[str]]] = None
+        for kind in self.ttls:
+            os.makedirs(os.path.join(root, kind), exist_ok=True)
+
+    def path(self, kind: str, name: str) -> str:
+        """Where the artifact `name` of a type lives, creating its shard directory."""
+        path = shard_path(os.path.join(self.root, kind), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def candidates(self, kind: str, name: str) -> Tuple[str, str]:
+        """Where an artifact may be: its shard, or the flat layout files were written to before."""
+        return shard_path(os.path.join(self.root, kind), name), os.path.join(self.root, name)
+
+    def temp_path(self, kind: str, suffix: str = "") -> str:
+        """A fresh temporary path in the type's directory, to be moved into place with os.replace."""
+        return os.path.join(self.root, kind, f".{uuid.uuid4().hex}.tmp{suffix}")
+
+    @contextmanager
+    def atomic_write(self, path: str) -> Iterator[str]:
+        """
+        Yield a temporary path next to path; once the block succeeds it replaces path in one
+        rename, and on error it is removed. The temp name keeps path's extension, for tools
+        such as ffmpeg that infer the format from it.
+        """
+        directory, name = os.path.split(path)
+        temp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp{os.path.splitext(name)[1]}")
+        try:
+            yield temp_path
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def touch(self, path: str) -> None:
+        """
+        Record a use of path in its access time, so it is kept from expiring and from LRU
+        eviction by every worker's sweeper. The mtime is left alone: it is part of a video's ETag.
+        """
+        try:
+            stat = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            # Gone already, or not ours to update; the sweeper then goes by its mtime
+            pass
+
+    def retain(self, paths: Iterable[str]) -> None:
+        """Protect paths from sweeping until a matching release."""
+        with self._lock:
+            for path in paths:
+                self._refs[os.path.abspath(path)] += 1
+
+    def release(self, paths: Iterable[str]) -> None:
+        released = []
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                self._refs[path] -= 1
+                if self._refs[path] <= 0:
+                    del self._refs[path]
+                    released.append(path)
+        # Released files count as used now, so their TTL starts over
+        for path in released:
+            self.touch(path)
+
+    def _scan(self) -> List[Tuple[str, str, int, float, float]]:
+        """
+        (path, type, size, mtime, last use) of every file in the type directories and the root
+        itself; the last use is the later of the access time touch records and the mtime.
+        """
+        files = []
+        for directory, subdirectories, names in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root)
+            if relative == ".":
+                # Other directories under the root are not ours to sweep
+                subdirectories[:] = [name for name in subdirectories if name in self.ttls]
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                kind = relative.split(os.sep)[0] if relative != "." else _legacy_kind(name)
+                files.append((path, kind, stat.st_size, stat.st_mtime, max(stat.st_atime, stat.st_mtime)))
+        return files
+
+    def _remove(self, path: str, kind: str, protected: Set[str]) -> bool:
+        """Delete path unless a job holds it or retained it since the scan."""
+        absolute = os.path.abspath(path)
+        with self._lock:
+            if absolute in self._refs or absolute in protected:
+                return False
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Could not remove %s: %s", path, e)
+                return False
+        if self.on_remove:
+            self.on_remove(kind, path)
+        return True
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        Remove expired artifacts and stale temp files, then evict least recently used
+        artifacts until the total fits max_bytes. Returns files and bytes removed.
+        """
+        now = time.time()
+        protected = {os.path.abspath(path) for path in self.protected()} if self.protected else set()
+        removed, freed = 0, 0
+        usage: Counter = Counter()
+        candidates = []
+        for path, kind, size, mtime, last_used in self._scan():
+            name = os.path.basename(path)
+            absolute = os.path.abspath(path)
+            with self._lock:
+                retained = absolute in self._refs or absolute in protected
+            if retained:
+                usage[kind] += size
+            elif _is_temp(name):
+                # In-progress writes keep their mtime fresh; old ones were abandoned
+                if now - mtime > TEMP_FILE_TTL and self._remove(path, kind, protected):
+                    removed, freed = removed + 1, freed + size
+                else:
+                    usage[kind] += size
+            elif now - last_used > self.ttls[kind]:
+                if self._remove(path, kind, protected):
+                    removed, freed = removed + 1, freed + size
+                else:
+                    usage[kind] += size
+            else:
+                usage[kind] += size
+                candidates.append((last_used, path, kind, size))
+
+        total = sum(usage.values())
+        if total > self.max_bytes:
+            for _, path, kind, size in sorted(candidates):
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path, kind, protected):
+                    total -= size
+                    usage[kind] -= size
+                    removed, freed = removed + 1, freed + size
+
+        self._remove_empty_streams(now)
+        self.usage = {kind: usage.get(kind, 0) for kind in self.ttls}
+        if removed:
+            logger.info("Storage sweep removed %d file(s)", removed, extra={"bytes": freed, "total_bytes": total})
+        return {"removed": removed, "freed_bytes": freed, "total_bytes": total}
+
+    def _remove_empty_streams(self, now: float) -> None:
+        """Drop per-job stream directories whose files have all been swept."""
+        streams = os.path.join(self.root, STREAMS)
+        for directory, subdirectories, names in os.walk(streams, topdown=False):
+            # Only the job directories themselves: streams/ab/cd/<job id>
+            if names or subdirectories or os.path.relpath(directory, streams).count(os.sep) != 2:
+                continue
+            try:
+                if now - os.stat(directory).st_mtime > self.ttls[STREAMS]:
+                    os.rmdir(directory)
+            except OSError:
+                pass
+
+    async def run_sweeper(self, interval: float = STORAGE_SWEEP_INTERVAL) -> None:
+        """Sweep every interval seconds until cancelled."""
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.exception("Storage sweep failed: %s", e)
+            await asyncio.sleep(interval)
+
+
+# Shared by the API and the provider clients
+artifact_store = ArtifactStore()
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The backend modules import each other by bare name, as when main.py runs from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The shared artifact store and main's databases are created on import; keep them out of the working tree
+_state_dir = tempfile.mkdtemp(prefix="video-generator-tests-")
+os.environ["STORAGE_DIR"] = _state_dir
+os.environ["JOB_DB_PATH"] = os.path.join(_state_dir, "jobs.db")
+os.environ["IMAGE_CACHE_DB_PATH"] = os.path.join(_state_dir, "image_cache.db")
+os.environ["CLIP_CACHE_DIR"] = os.path.join(_state_dir, "clip_cache")
+os.environ["RATE_LIMIT_ENABLED"] = "false"
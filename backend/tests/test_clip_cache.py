@@ -0,0 +1,77 @@
+import os
+import time
+
+from clip_cache import ClipCache, clip_cache_key, hash_file
+from storage import TEMP_FILE_TTL
+
+
+def _clip(path, size: int, content: bytes = b"x") -> str:
+    path.write_bytes(content * size)
+    return str(path)
+
+
+def test_cache_key_depends_on_every_input():
+    key = clip_cache_key("kling", "digest", "a cat", {"duration": 5, "mode": "std"})
+    # Parameter order does not matter
+    assert clip_cache_key("kling", "digest", "a cat", {"mode": "std", "duration": 5}) == key
+    assert clip_cache_key("minimax", "digest", "a cat", {"duration": 5, "mode": "std"}) != key
+    assert clip_cache_key("kling", "other", "a cat", {"duration": 5, "mode": "std"}) != key
+    assert clip_cache_key("kling", "digest", "a dog", {"duration": 5, "mode": "std"}) != key
+    assert clip_cache_key("kling", "digest", "a cat", {"duration": 10, "mode": "std"}) != key
+
+
+def test_hash_file_reads_in_chunks(tmp_path):
+    path = _clip(tmp_path / "image.png", 1000, b"ab")
+    assert hash_file(path, chunk_size=7) == hash_file(path)
+    assert hash_file(path) != hash_file(_clip(tmp_path / "other.png", 1000, b"ba"))
+
+
+def test_get_places_a_copy_of_the_cached_clip(tmp_path):
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=1000)
+    assert not cache.get("key", str(tmp_path / "miss.mp4"))
+    assert not (tmp_path / "miss.mp4").exists()
+    cache.put("key", _clip(tmp_path / "clip.mp4", 100))
+    os.remove(tmp_path / "clip.mp4")
+    destination = tmp_path / "hit.mp4"
+    assert cache.get("key", str(destination))
+    assert destination.read_bytes() == b"x" * 100
+
+
+def test_least_recently_used_clips_are_evicted(tmp_path):
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=250)
+    for key in ("a", "b"):
+        cache.put(key, _clip(tmp_path / f"{key}.mp4", 100))
+    # Age both clips, then use "a" so "b" is the least recently used
+    for key in ("a", "b"):
+        past = time.time() - 60
+        os.utime(cache._path(key), (past, past))
+    assert cache.get("a", str(tmp_path / "a-copy.mp4"))
+    cache.put("c", _clip(tmp_path / "c.mp4", 100))
+    assert cache.get("a", str(tmp_path / "a-again.mp4"))
+    assert not cache.get("b", str(tmp_path / "b-copy.mp4"))
+    assert cache.get("c", str(tmp_path / "c-copy.mp4"))
+
+
+def test_new_clip_is_kept_even_when_over_budget(tmp_path):
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=50)
+    cache.put("large", _clip(tmp_path / "large.mp4", 100))
+    assert cache.get("large", str(tmp_path / "copy.mp4"))
+
+
+def test_stale_temp_files_are_swept(tmp_path):
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=1000)
+    stale = tmp_path / "cache" / ".abandoned.tmp"
+    stale.write_bytes(b"partial")
+    past = time.time() - TEMP_FILE_TTL - 60
+    os.utime(stale, (past, past))
+    cache.put("key", _clip(tmp_path / "clip.mp4", 10))
+    assert not stale.exists()
+
+
+def test_flat_clips_are_moved_into_shards(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    (cache_dir / "oldkey.mp4").write_bytes(b"old")
+    cache = ClipCache(str(cache_dir), max_bytes=1000)
+    assert not (cache_dir / "oldkey.mp4").exists()
+    assert cache.get("oldkey", str(tmp_path / "old.mp4"))
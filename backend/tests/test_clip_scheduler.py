@@ -0,0 +1,212 @@
+import asyncio
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+import httpx
+import pytest
+
+import clip_scheduler
+from clip_scheduler import generate_clips
+from job_store import JobLeaseLost
+from polling import PollingPolicy
+from providers import VideoProvider
+from rate_limit import OutboundLimiter
+from retry import ClipRejectedError, RetryPolicy
+
+
+class FakeClipCache:
+    def __init__(self, clips: Optional[Dict[str, str]] = None):
+        self.clips = dict(clips or {})
+        self.stored = []
+
+    def put(self, key: str, path: str) -> None:
+        self.stored.append((key, path))
+
+
+class FakeProvider(VideoProvider):
+    """Finishes every task after one processing poll; records submissions and the image each got."""
+
+    def __init__(self, name: str, kind: str = "kling", concurrency: int = 3, clip_cache: Optional[FakeClipCache] = None, fail: Optional[Exception] = None):
+        self.name = self.display_name = name
+        self.kind = kind
+        self.limiter = OutboundLimiter(name, rate=1000, burst=1000, concurrency=concurrency)
+        self.retry_policy = RetryPolicy(max_retries=1, base_delay=0, max_delay=0)
+        self.polling_policy = PollingPolicy(name, expected_duration=0.02, min_interval=0.01, max_interval=0.01, jitter=0.0, timeout=5)
+        self.clip_cache = clip_cache
+        self.fail = fail
+        self.submitted = []
+        self.polls: Counter = Counter()
+
+    def account_key(self, credentials: Dict[str, str]) -> str:
+        return self.name
+
+    async def submit(self, image_path: str, image_digest: Optional[str], prompt: str, credentials: Dict[str, str]) -> str:
+        if self.fail:
+            raise self.fail
+        self.submitted.append((image_path, prompt))
+        return f"{self.name}-{len(self.submitted)}"
+
+    async def poll(self, task_id: str, credentials: Dict[str, str]) -> Tuple[str, Optional[str]]:
+        self.polls[task_id] += 1
+        if self.polls[task_id] < 2:
+            return "processing", None
+        return "succeed", f"https://cdn.test/{task_id}.mp4"
+
+    async def fetch(self, task_id: str, video_url: str, on_progress=None) -> Tuple[str, int]:
+        # Long enough that every clip of a batch is in flight at once
+        await asyncio.sleep(0.05)
+        return f"/clips/{task_id}.mp4", 1
+
+    def _output_path(self, task_id: str) -> str:
+        return f"/clips/{task_id}.mp4"
+
+    def _image_digest(self, image_path: str) -> Optional[str]:
+        return None
+
+    def clip_cache_key(self, image_digest: str, prompt: str) -> str:
+        return f"{self.name}:{image_digest[:8]}:{prompt}"
+
+    def _cached_clip(self, cache_key: str) -> Optional[str]:
+        return self.clip_cache.clips.get(cache_key)
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"image{i}.png"
+        path.write_bytes(f"image {i}".encode())
+        paths.append(str(path))
+    return paths
+
+
+async def _prepare(image_path: str, kind: str) -> str:
+    # Preprocessing runs on a worker thread, so it yields to the event loop like the real one
+    await asyncio.to_thread(lambda: None)
+    return f"{image_path}.{kind}.jpg"
+
+
+def _providers_of(*providers: FakeProvider) -> Counter:
+    return Counter(provider.name for provider in providers for _ in provider.submitted)
+
+
+@pytest.mark.parametrize("with_cache_and_preprocessing", [False, True])
+def test_clips_spread_over_providers(images, with_cache_and_preprocessing):
+    cache = FakeClipCache() if with_cache_and_preprocessing else None
+    a, b = FakeProvider("a", clip_cache=cache), FakeProvider("b", clip_cache=cache)
+    prepare = _prepare if with_cache_and_preprocessing else None
+
+    paths = asyncio.run(generate_clips([a, b], images, ["prompt"] * 6, {}, job_id="job-1", prepare_image=prepare))
+
+    assert len(paths) == 6
+    assert _providers_of(a, b) == {"a": 3, "b": 3}
+
+
+def test_images_are_prepared_for_the_provider_kind(images):
+    kling, minimax = FakeProvider("kling", kind="kling", concurrency=1), FakeProvider("minimax", kind="minimax", concurrency=1)
+    asyncio.run(generate_clips([kling, minimax], images[:2], ["p"] * 2, {}, prepare_image=_prepare))
+    assert [path for path, _ in kling.submitted] == [f"{images[0]}.kling.jpg"]
+    assert [path for path, _ in minimax.submitted] == [f"{images[1]}.minimax.jpg"]
+
+
+def test_cache_hit_skips_preprocessing_and_providers(images):
+    cache = FakeClipCache()
+    provider = FakeProvider("a", clip_cache=cache)
+    prepared = []
+
+    async def prepare(image_path, kind):
+        prepared.append(image_path)
+        return image_path
+
+    # Learn the key the provider uses for the first image, then seed the cache with it
+    keys = asyncio.run(clip_scheduler.clip_cache_keys([provider], images[0], "prompt"))
+    cache.clips[keys["a"]] = "/cache/clip.mp4"
+    events = []
+
+    paths = asyncio.run(generate_clips(
+        [provider], images[:2], ["prompt", "prompt"], {}, prepare_image=prepare,
+        on_clip_progress=lambda i: lambda state, details: events.append((i, state, details.get("cached"))),
+    ))
+
+    assert paths[0] == "/cache/clip.mp4"
+    assert prepared == [images[1]]
+    assert [path for path, _ in provider.submitted] == [images[1]]
+    assert (0, "succeed", True) in events
+    # The generated clip was stored for next time
+    assert [key for key, _ in cache.stored] == [asyncio.run(clip_scheduler.clip_cache_keys([provider], images[1], "prompt"))["a"]]
+
+
+def test_checkpointed_task_resumes_on_its_provider(images):
+    a, b = FakeProvider("a"), FakeProvider("b")
+    checkpoints = {0: {"task_id": "b-old", "provider": "b", "status": "processing", "video_path": None, "error": None}}
+    paths = asyncio.run(generate_clips([a, b], images[:1], ["p"], {}, checkpoints=checkpoints))
+    assert paths == ["/clips/b-old.mp4"]
+    assert a.submitted == [] and b.submitted == []
+    assert b.polls["b-old"] == 2
+
+
+def test_downloaded_clip_is_reused_after_a_restart(images, tmp_path):
+    clip = tmp_path / "clip.mp4"
+    clip.write_bytes(b"clip")
+    provider = FakeProvider("a")
+    checkpoints = {0: {"task_id": "a-old", "provider": "a", "status": "ready", "video_path": str(clip), "error": None}}
+    paths = asyncio.run(generate_clips([provider], images[:2], ["p"] * 2, {}, checkpoints=checkpoints))
+    assert paths == [str(clip), "/clips/a-1.mp4"]
+    assert provider.submitted == [(images[1], "p")]
+    assert provider.polls["a-old"] == 0
+
+
+def test_failed_poll_is_retried_on_the_submitted_task(images):
+    provider = FakeProvider("a")
+    poll = provider.poll
+    failures = []
+
+    async def flaky_poll(task_id, credentials):
+        if not failures:
+            failures.append(task_id)
+            raise httpx.ConnectError("connection reset")
+        return await poll(task_id, credentials)
+
+    provider.poll = flaky_poll
+    paths = asyncio.run(generate_clips([provider], images[:1], ["p"], {}))
+    assert paths == ["/clips/a-1.mp4"]
+    # The retry polled the task again rather than submitting a second one
+    assert failures == ["a-1"] and len(provider.submitted) == 1
+
+
+def test_failed_clip_is_skipped(images, monkeypatch):
+    monkeypatch.setattr(clip_scheduler, "CLIP_FAILURE_POLICY", "skip")
+    good, bad = FakeProvider("good", concurrency=1), FakeProvider("bad", concurrency=1, fail=ClipRejectedError("moderation"))
+    ready = []
+
+    async def on_clip_ready(index, path):
+        ready.append((index, path))
+
+    paths = asyncio.run(generate_clips([good, bad], images[:2], ["p"] * 2, {}, on_clip_ready=on_clip_ready))
+    assert paths == ["/clips/good-1.mp4"]
+    assert sorted(ready) == [(0, "/clips/good-1.mp4"), (1, None)]
+
+
+def test_failed_clip_aborts_batch(images, monkeypatch):
+    monkeypatch.setattr(clip_scheduler, "CLIP_FAILURE_POLICY", "abort")
+    provider = FakeProvider("bad", fail=ClipRejectedError("moderation"))
+    with pytest.raises(ClipRejectedError):
+        asyncio.run(generate_clips([provider], images[:2], ["p"] * 2, {}))
+
+
+def test_lost_lease_stops_batch_before_submitting(images):
+    provider = FakeProvider("a")
+
+    async def before_submit():
+        raise JobLeaseLost("job-1")
+
+    with pytest.raises(JobLeaseLost):
+        asyncio.run(generate_clips([provider], images[:2], ["p"] * 2, {}, before_submit=before_submit))
+    assert provider.submitted == []
+
+
+def test_mismatched_inputs_are_rejected(images):
+    with pytest.raises(ValueError):
+        asyncio.run(generate_clips([FakeProvider("a")], images[:2], ["p"], {}))
+    with pytest.raises(ValueError):
+        asyncio.run(generate_clips([], images[:1], ["p"], {}))
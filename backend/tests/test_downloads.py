@@ -0,0 +1,106 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+import downloads
+from downloads import IncompleteDownloadError, async_download_to_file
+
+CLIP = bytes(range(256)) * 64
+
+
+class _Body(httpx.AsyncByteStream):
+    """A response body that fails with a network error after fail_after bytes, if given."""
+
+    def __init__(self, data: bytes, fail_after: int = None):
+        self.data = data
+        self.fail_after = fail_after
+
+    async def __aiter__(self):
+        if self.fail_after is None:
+            yield self.data
+            return
+        yield self.data[:self.fail_after]
+        raise httpx.ReadError("connection reset")
+
+
+def _download(handler, output_path: str, **kwargs) -> int:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            return await async_download_to_file(http, "https://cdn.test/clip.mp4", output_path, **kwargs)
+
+    return asyncio.run(run())
+
+
+def test_download_writes_the_body_uncompressed(tmp_path):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, headers={"Content-Length": str(len(CLIP))}, stream=_Body(CLIP))
+
+    output = tmp_path / "clip.mp4"
+    progress = []
+    assert _download(handler, str(output), on_progress=lambda written, total: progress.append((written, total))) == len(CLIP)
+    assert output.read_bytes() == CLIP
+    assert requests[0].headers["accept-encoding"] == "identity"
+    assert "range" not in requests[0].headers
+    assert progress[-1] == (len(CLIP), len(CLIP))
+
+
+def test_interrupted_download_resumes_with_a_range_request(tmp_path, monkeypatch):
+    # Chunks are only written once complete, so the 1000 bytes before the failure are kept
+    monkeypatch.setattr(downloads, "DOWNLOAD_CHUNK_SIZE", 100)
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if "range" not in request.headers:
+            return httpx.Response(200, headers={"Content-Length": str(len(CLIP))}, stream=_Body(CLIP, fail_after=1000))
+        start = int(request.headers["range"].removeprefix("bytes=").rstrip("-"))
+        headers = {"Content-Range": f"bytes {start}-{len(CLIP) - 1}/{len(CLIP)}", "Content-Length": str(len(CLIP) - start)}
+        return httpx.Response(206, headers=headers, stream=_Body(CLIP[start:]))
+
+    output = tmp_path / "clip.mp4"
+    assert _download(handler, str(output)) == len(CLIP)
+    assert output.read_bytes() == CLIP
+    assert [request.headers.get("range") for request in requests] == [None, "bytes=1000-"]
+    assert requests[1].headers["accept-encoding"] == "identity"
+
+
+def test_resume_ignored_by_the_server_starts_over(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloads, "DOWNLOAD_CHUNK_SIZE", 100)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        # Sends the whole body every time, failing the first time
+        fail_after = 1000 if len(calls) == 1 else None
+        return httpx.Response(200, headers={"Content-Length": str(len(CLIP))}, stream=_Body(CLIP, fail_after=fail_after))
+
+    output = tmp_path / "clip.mp4"
+    assert _download(handler, str(output)) == len(CLIP)
+    assert output.read_bytes() == CLIP
+    assert calls[1].headers["range"] == "bytes=1000-"
+
+
+def test_download_gives_up_after_max_resumes(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloads, "DOWNLOAD_MAX_RESUMES", 1)
+
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Length": str(len(CLIP))}, stream=_Body(CLIP, fail_after=10))
+
+    output = tmp_path / "clip.mp4"
+    with pytest.raises(httpx.ReadError):
+        _download(handler, str(output))
+    assert os.listdir(tmp_path) == []
+
+
+def test_short_download_is_incomplete(tmp_path):
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Length": str(len(CLIP) + 10)}, stream=_Body(CLIP))
+
+    with pytest.raises(IncompleteDownloadError):
+        _download(handler, str(tmp_path / "clip.mp4"))
+    assert os.listdir(tmp_path) == []
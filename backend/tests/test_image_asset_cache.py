@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from image_asset_cache import ImageAssetCache
+from storage import ARTIFACT_TTLS, ArtifactStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(root=str(tmp_path / "storage"), max_bytes=10_000_000, ttls={kind: 3600 for kind in ARTIFACT_TTLS})
+
+
+@pytest.fixture
+def cache(tmp_path, store):
+    return ImageAssetCache(db_path=str(tmp_path / "image_cache.db"), ttl_seconds=60, store=store)
+
+
+def _asset_files(store):
+    return [os.path.join(directory, name) for directory, _, names in os.walk(store.root) for name in names]
+
+
+def test_values_are_cached_per_digest_and_kind(cache):
+    cache.put("digest", "kling_base64", "payload")
+    cache.put("digest", "minimax_url:group/1", "https://files.test/image.png")
+    assert cache.get("digest", "kling_base64") == "payload"
+    assert cache.get("digest", "minimax_url:group/1") == "https://files.test/image.png"
+    assert cache.get("digest", "minimax_url:group/2") is None
+    assert cache.get("other", "kling_base64") is None
+
+
+def test_put_replaces_a_value(cache, store):
+    cache.put("digest", "kling_base64", "old")
+    cache.put("digest", "kling_base64", "new")
+    assert cache.get("digest", "kling_base64") == "new"
+    assert len(_asset_files(store)) == 1
+
+
+def test_workers_share_entries(cache, store):
+    cache.put("digest", "kling_base64", "payload")
+    other_worker = ImageAssetCache(db_path=cache.db_path, ttl_seconds=60, store=store)
+    assert other_worker.get("digest", "kling_base64") == "payload"
+
+
+def test_expired_entries_are_missed_and_purged(cache, store):
+    cache.put("digest", "minimax_url:group", "https://files.test/image.png", ttl_seconds=-1)
+    assert cache.get("digest", "minimax_url:group") is None
+    cache.put("digest", "kling_base64", "payload")
+    # The put purged the expired entry and its file
+    assert len(_asset_files(store)) == 1
+    assert cache.purge_expired() == 0
+
+
+def test_swept_file_is_a_miss(cache, store):
+    cache.put("digest", "kling_base64", "payload")
+    for path in _asset_files(store):
+        os.remove(path)
+    assert cache.get("digest", "kling_base64") is None
@@ -0,0 +1,103 @@
+import asyncio
+import os
+
+import pytest
+from PIL import Image
+
+import image_preprocess
+from image_preprocess import ImagePreprocessor, preprocess_image
+from storage import ARTIFACT_TTLS, PREPROCESSED, ArtifactStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(root=str(tmp_path / "storage"), max_bytes=10_000_000, ttls={kind: 3600 for kind in ARTIFACT_TTLS})
+
+
+def _image(path, size=(400, 200), mode="RGB", **save_options) -> str:
+    Image.new(mode, size).save(path, **save_options)
+    return str(path)
+
+
+def test_preprocess_image_downscales_and_re_encodes(tmp_path):
+    source = _image(tmp_path / "source.png", size=(4000, 2000))
+    output = str(tmp_path / "output.jpg")
+    preprocess_image(source, output, max_side=1000, image_format="JPEG")
+    with Image.open(output) as image:
+        assert image.format == "JPEG"
+        assert image.size == (1000, 500)
+
+
+def test_preprocess_image_keeps_small_images_at_their_size(tmp_path):
+    source = _image(tmp_path / "small.png", size=(300, 100))
+    output = str(tmp_path / "output.jpg")
+    preprocess_image(source, output, max_side=1000, image_format="JPEG")
+    with Image.open(output) as image:
+        assert image.size == (300, 100)
+
+
+def test_preprocess_image_flattens_transparency_onto_white(tmp_path):
+    source = _image(tmp_path / "transparent.png", mode="RGBA")
+    output = str(tmp_path / "output.jpg")
+    preprocess_image(source, output, max_side=1000, image_format="JPEG")
+    with Image.open(output) as image:
+        assert image.mode == "RGB"
+        assert all(channel > 245 for channel in image.getpixel((10, 10)))
+
+
+def test_preprocess_image_applies_exif_orientation_and_drops_metadata(tmp_path):
+    exif = Image.Exif()
+    # Orientation 6: the camera was rotated, so the stored landscape image displays as portrait
+    exif[0x0112] = 6
+    source = _image(tmp_path / "rotated.jpg", size=(400, 200), exif=exif.tobytes())
+    output = str(tmp_path / "output.jpg")
+    preprocess_image(source, output, max_side=1000, image_format="JPEG")
+    with Image.open(output) as image:
+        assert image.size == (200, 400)
+        assert 0x0112 not in image.getexif()
+
+
+def test_prepare_caches_the_result_per_image_and_provider(tmp_path, store):
+    source = _image(tmp_path / "source.png", size=(3000, 1500))
+    preprocessor = ImagePreprocessor(store=store, max_workers=2)
+
+    async def run():
+        return await asyncio.gather(*(preprocessor.prepare(source, "kling") for _ in range(3)))
+
+    try:
+        paths = asyncio.run(run())
+        assert len(set(paths)) == 1
+        assert paths[0].startswith(os.path.join(store.root, PREPROCESSED))
+        with Image.open(paths[0]) as image:
+            assert max(image.size) == image_preprocess.PROVIDER_MAX_SIDE["kling"]
+        # A second request finds the stored image
+        assert asyncio.run(preprocessor.prepare(source, "kling")) == paths[0]
+    finally:
+        preprocessor.shutdown()
+
+
+def test_prepare_falls_back_to_the_original_image(tmp_path, store):
+    source = tmp_path / "broken.png"
+    source.write_bytes(b"not an image")
+    preprocessor = ImagePreprocessor(store=store, max_workers=1)
+    try:
+        assert asyncio.run(preprocessor.prepare(str(source), "kling")) == str(source)
+    finally:
+        preprocessor.shutdown()
+
+
+def test_prepare_leaves_no_temp_file_when_saving_fails(tmp_path, store, monkeypatch):
+    source = _image(tmp_path / "source.png")
+
+    def failing_save(self, path, *args, **kwargs):
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Image.Image, "save", failing_save)
+    preprocessor = ImagePreprocessor(store=store, max_workers=1)
+    try:
+        assert asyncio.run(preprocessor.prepare(source, "kling")) == source
+    finally:
+        preprocessor.shutdown()
+    assert [names for _, _, names in os.walk(os.path.join(store.root, PREPROCESSED)) if names] == []
@@ -0,0 +1,81 @@
+import base64
+
+import pytest
+
+from job_checkpoints import CLIP_READY, CredentialCipher, JobCheckpointStore, restored_clip
+
+CREDENTIALS = {"access_key_id": "key-id", "access_key_secret": "key-secret"}
+
+
+def _store(tmp_path, persist: bool = True, key: str = "server-key") -> JobCheckpointStore:
+    return JobCheckpointStore(str(tmp_path / "jobs.db"), persist_credentials=persist, credentials_key=key)
+
+
+def test_cipher_round_trip():
+    cipher = CredentialCipher("server-key")
+    token = cipher.encrypt(b"secret")
+    assert b"secret" not in token.encode()
+    assert cipher.decrypt(token) == b"secret"
+    # A fresh IV per message
+    assert cipher.encrypt(b"secret") != token
+
+
+def test_cipher_rejects_tampered_tokens():
+    cipher = CredentialCipher("server-key")
+    data = bytearray(base64.urlsafe_b64decode(cipher.encrypt(b"secret")))
+    data[-40] ^= 1
+    assert cipher.decrypt(base64.urlsafe_b64encode(bytes(data)).decode()) is None
+    assert cipher.decrypt("not a token") is None
+    assert cipher.decrypt("ünicode") is None
+
+
+def test_cipher_rejects_another_key():
+    token = CredentialCipher("server-key").encrypt(b"secret")
+    assert CredentialCipher("other-key").decrypt(token) is None
+
+
+def test_record_clip_keeps_earlier_fields(tmp_path):
+    store = _store(tmp_path)
+    store.record_clip("job-1", 0, "submitted", task_id="task-1", provider="kling")
+    store.record_clip("job-1", 0, "processing")
+    store.record_clip("job-1", 0, CLIP_READY, video_path="/clips/task-1.mp4")
+    store.record_clip("job-2", 0, "submitted", task_id="task-2")
+    clip = store.get_clips("job-1")[0]
+    assert clip["task_id"] == "task-1" and clip["provider"] == "kling"
+    assert clip["status"] == CLIP_READY and clip["video_path"] == "/clips/task-1.mp4"
+    assert list(store.get_clips("job-1")) == [0]
+
+
+def test_credentials_are_stored_encrypted(tmp_path):
+    store = _store(tmp_path)
+    store.save_credentials("job-1", CREDENTIALS)
+    assert store.get_credentials("job-1") == CREDENTIALS
+    assert b"key-secret" not in (tmp_path / "jobs.db").read_bytes()
+    store.clear_credentials("job-1")
+    assert store.get_credentials("job-1") is None
+
+
+def test_credentials_under_another_key_are_discarded(tmp_path):
+    _store(tmp_path, key="old-key").save_credentials("job-1", CREDENTIALS)
+    assert _store(tmp_path, key="new-key").get_credentials("job-1") is None
+
+
+@pytest.mark.parametrize("persist, key", [(False, "server-key"), (True, "")])
+def test_credentials_are_not_persisted_without_opting_in(tmp_path, persist, key):
+    _store(tmp_path).save_credentials("job-1", CREDENTIALS)
+    # Turning persistence off also drops what an earlier configuration stored
+    store = _store(tmp_path, persist=persist, key=key)
+    assert store.get_credentials("job-1") is None
+    store.save_credentials("job-2", CREDENTIALS)
+    assert _store(tmp_path).get_credentials("job-2") is None
+
+
+def test_restored_clip_needs_a_ready_checkpoint_and_its_file(tmp_path):
+    clip = tmp_path / "clip.mp4"
+    clip.write_bytes(b"clip")
+    checkpoint = {"status": CLIP_READY, "video_path": str(clip)}
+    assert restored_clip(checkpoint) == str(clip)
+    assert restored_clip({**checkpoint, "status": "processing"}) is None
+    assert restored_clip(None) is None
+    clip.unlink()
+    assert restored_clip(checkpoint) is None
@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+from job_events import JobEventBus, format_sse, poll_job_events
+
+
+def test_format_sse_keep_alive():
+    assert format_sse(None) == ": keep-alive\n\n"
+
+
+def test_format_sse_event():
+    event = {"type": "clip", "job_id": "job-1", "index": 0, "state": "succeed"}
+    frame = format_sse(event)
+    assert frame.endswith("\n\n")
+    event_line, data_line = frame.rstrip("\n").split("\n")
+    assert event_line == "event: clip"
+    assert json.loads(data_line.removeprefix("data: ")) == event
+
+
+def test_format_sse_data_stays_on_one_line():
+    event = {"type": "failed", "job_id": "job-1", "error": "line one\nline two\r\n"}
+    frame = format_sse(event)
+    assert frame.count("\n") == 3
+    assert json.loads(frame.split("\n")[1].removeprefix("data: "))["error"] == event["error"]
+
+
+async def _collect(stream, limit: int = 20):
+    events = []
+    async for event in stream:
+        events.append(event)
+        if len(events) >= limit:
+            break
+    return events
+
+
+def test_bus_replays_history_to_late_subscribers():
+    async def run():
+        bus = JobEventBus()
+        bus.publish("job-1", "status", status="generating")
+        bus.publish("job-1", "ready", video_url="/video/job-1")
+        return await _collect(bus.subscribe("job-1"))
+
+    events = asyncio.run(run())
+    assert [event["type"] for event in events] == ["status", "ready"]
+    assert events[0]["status"] == "generating"
+
+
+def test_bus_delivers_live_events_until_terminal():
+    async def run():
+        bus = JobEventBus()
+        stream = asyncio.ensure_future(_collect(bus.subscribe("job-1")))
+        await asyncio.sleep(0)
+        report = bus.clip_progress("job-1", 2)
+        report("submitted", {"task_id": "task-1"})
+        bus.publish("job-2", "status", status="queued")
+        bus.publish("job-1", "failed", error="boom")
+        bus.publish("job-1", "status", status="after the end")
+        events = await asyncio.wait_for(stream, 1)
+        return bus, events
+
+    bus, events = asyncio.run(run())
+    assert [event["type"] for event in events] == ["clip", "failed"]
+    assert events[0]["index"] == 2 and events[0]["state"] == "submitted" and events[0]["task_id"] == "task-1"
+    # The closed stream unsubscribed itself
+    assert bus._subscribers == {}
+
+
+def test_bus_sends_heartbeats_while_idle():
+    async def run():
+        bus = JobEventBus()
+        stream = bus.subscribe("job-1", heartbeat=0.01)
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(run()) is None
+
+
+def test_bus_drops_history_after_retention():
+    async def run():
+        bus = JobEventBus(retention=0.01)
+        bus.publish("job-1", "status", status="generating")
+        assert bus.has_events("job-1")
+        bus.publish("job-1", "ready")
+        assert bus.has_events("job-1")
+        await asyncio.sleep(0.05)
+        return bus
+
+    assert not asyncio.run(run()).has_events("job-1")
+
+
+def test_bus_hand_off_ends_streams_and_drops_history():
+    async def run():
+        bus = JobEventBus()
+        bus.publish("job-1", "status", status="generating")
+        stream = asyncio.ensure_future(_collect(bus.subscribe("job-1")))
+        await asyncio.sleep(0)
+        bus.hand_off("job-1", owner="worker-b", node_url="http://b")
+        events = await asyncio.wait_for(stream, 1)
+        return bus, events
+
+    bus, events = asyncio.run(run())
+    assert [event["type"] for event in events] == ["status", "handoff"]
+    assert events[1]["owner"] == "worker-b" and events[1]["node_url"] == "http://b"
+    # Later subscribers follow the job through the store instead
+    assert not bus.has_events("job-1")
+    assert bus._subscribers == {}
+
+
+def test_poll_job_events_rebuilds_progress_from_the_store():
+    jobs = [
+        {"status": "generating", "error": None},
+        {"status": "generating", "error": None},
+        {"status": "completed", "error": None},
+    ]
+    clips = [
+        {},
+        {0: {"status": "succeed", "task_id": "task-1", "provider": "kling"}},
+        {0: {"status": "succeed", "task_id": "task-1", "provider": "kling"}},
+    ]
+    reads = {"job": 0, "clips": 0}
+
+    def load_job(job_id):
+        job = jobs[min(reads["job"], len(jobs) - 1)]
+        reads["job"] += 1
+        return job
+
+    def load_clips(job_id):
+        state = clips[min(reads["clips"], len(clips) - 1)]
+        reads["clips"] += 1
+        return state
+
+    events = asyncio.run(_collect(poll_job_events("job-1", load_job, load_clips, interval=0, heartbeat=60)))
+    assert [event["type"] for event in events] == ["status", "clip", "status", "ready"]
+    assert events[1]["task_id"] == "task-1"
+    assert events[-1]["video_url"] == "/video/job-1"
+
+
+def test_poll_job_events_ends_when_job_is_gone():
+    events = asyncio.run(_collect(poll_job_events("job-1", lambda job_id: None, lambda job_id: {}, interval=0)))
+    assert events == []
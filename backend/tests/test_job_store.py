@@ -0,0 +1,96 @@
+import pytest
+
+from job_store import JOB_COMPLETED, JOB_FAILED, JOB_GENERATING, JOB_QUEUED, JobLeaseLost, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def _create(store: JobStore, job_id: str = "job-1", owner: str = "worker-a", lease_seconds: float = 60) -> dict:
+    return store.create_job(job_id, "kling", ["a prompt"], ["image.png"], owner=owner, lease_seconds=lease_seconds, node_url="http://a")
+
+
+def test_create_job(store):
+    job = _create(store)
+    assert job["status"] == JOB_QUEUED
+    assert job["owner"] == "worker-a"
+    assert job["prompts"] == ["a prompt"]
+    assert job["image_paths"] == ["image.png"]
+    assert store.get_job("missing") is None
+
+
+def test_claim_fails_while_lease_is_held(store):
+    _create(store)
+    assert not store.claim_job("job-1", "worker-b", 60)
+    assert store.get_job("job-1")["owner"] == "worker-a"
+
+
+def test_claim_expired_lease(store):
+    _create(store, lease_seconds=-1)
+    assert store.claim_job("job-1", "worker-b", 60, node_url="http://b")
+    job = store.get_job("job-1")
+    assert job["owner"] == "worker-b"
+    assert job["node_url"] == "http://b"
+    # Only one worker takes a job over
+    assert not store.claim_job("job-1", "worker-c", 60)
+
+
+def test_claim_unowned_job(store):
+    _create(store)
+    store.update_job("job-1", lease_expires=None)
+    assert store.claim_job("job-1", "worker-b", 60)
+
+
+def test_claim_ignores_finished_jobs(store):
+    _create(store, lease_seconds=-1)
+    store.update_job("job-1", status=JOB_COMPLETED)
+    assert not store.claim_job("job-1", "worker-b", 60)
+
+
+def test_renew_lease_only_by_owner(store):
+    _create(store, lease_seconds=-1)
+    assert store.renew_lease("job-1", "worker-a", 60)
+    assert not store.claim_job("job-1", "worker-b", 60)
+    assert not store.renew_lease("job-1", "worker-b", 60)
+
+
+def test_renew_leases_reports_jobs_taken_over(store):
+    _create(store, "job-1", lease_seconds=-1)
+    _create(store, "job-2", lease_seconds=-1)
+    assert store.claim_job("job-2", "worker-b", 60)
+    lost = store.renew_leases("worker-a", 60, ["job-1", "job-2"])
+    assert lost == ["job-2"]
+    # job-1 was renewed, so nobody else can take it
+    assert not store.claim_job("job-1", "worker-b", 60)
+
+
+def test_release_leases_lets_another_worker_resume(store):
+    _create(store)
+    store.update_job("job-1", status=JOB_GENERATING)
+    store.release_leases("worker-a")
+    assert [job["job_id"] for job in store.get_active_jobs(lease_expired=True)] == ["job-1"]
+    assert store.claim_job("job-1", "worker-b", 60)
+    assert store.get_active_jobs(lease_expired=True) == []
+
+
+def test_get_active_jobs(store):
+    _create(store, "job-1")
+    _create(store, "job-2", lease_seconds=-1)
+    _create(store, "job-3")
+    store.update_job("job-3", status=JOB_COMPLETED)
+    assert [job["job_id"] for job in store.get_active_jobs()] == ["job-1", "job-2"]
+    assert [job["job_id"] for job in store.get_active_jobs(lease_expired=True)] == ["job-2"]
+
+
+def test_update_job_owned_by_is_fenced_to_the_owner(store):
+    _create(store, lease_seconds=-1)
+    store.update_job("job-1", "worker-a", status=JOB_GENERATING)
+    assert store.get_job("job-1")["status"] == JOB_GENERATING
+    assert store.claim_job("job-1", "worker-b", 60)
+    # The old owner's late write does not overwrite the new owner's state
+    with pytest.raises(JobLeaseLost):
+        store.update_job("job-1", "worker-a", status=JOB_FAILED, error="stale")
+    job = store.get_job("job-1")
+    assert job["status"] == JOB_GENERATING and job["error"] is None
@@ -0,0 +1,63 @@
+import jwt
+
+import klingai_client
+from klingai_client import KlingTokenCache
+
+
+def _claims(token: str, secret: str) -> dict:
+    return jwt.decode(token, secret, algorithms=["HS256"], options={"verify_exp": False, "verify_nbf": False})
+
+
+def test_token_is_signed_for_the_access_key():
+    token = KlingTokenCache(ttl=1800).get("key-id", "secret")
+    claims = _claims(token, "secret")
+    assert claims["iss"] == "key-id"
+    assert claims["exp"] - claims["nbf"] == 1805
+
+
+def test_token_is_reused_until_refresh_ahead(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(klingai_client.time, "time", lambda: now[0])
+    cache = KlingTokenCache(ttl=1800, refresh_ahead=300)
+    token = cache.get("key-id", "secret")
+    now[0] += 1499
+    assert cache.get("key-id", "secret") == token
+    now[0] += 1
+    refreshed = cache.get("key-id", "secret")
+    assert refreshed != token
+    assert _claims(refreshed, "secret")["exp"] == 1_000_000 + 1500 + 1800
+
+
+def test_tokens_are_kept_per_access_key():
+    cache = KlingTokenCache()
+    first, second = cache.get("key-1", "secret-1"), cache.get("key-2", "secret-2")
+    assert _claims(first, "secret-1")["iss"] == "key-1"
+    assert _claims(second, "secret-2")["iss"] == "key-2"
+    assert cache.get("key-1", "secret-1") == first
+
+
+def test_changed_secret_signs_a_new_token():
+    cache = KlingTokenCache()
+    cache.get("key-id", "typo")
+    assert _claims(cache.get("key-id", "secret"), "secret")["iss"] == "key-id"
+
+
+def test_refresh_ahead_is_at_most_half_the_lifetime(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(klingai_client.time, "time", lambda: now[0])
+    cache = KlingTokenCache(ttl=60, refresh_ahead=300)
+    token = cache.get("key-id", "secret")
+    now[0] += 29
+    assert cache.get("key-id", "secret") == token
+    now[0] += 1
+    assert cache.get("key-id", "secret") != token
+
+
+def test_expired_tokens_of_other_keys_are_dropped(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(klingai_client.time, "time", lambda: now[0])
+    cache = KlingTokenCache(ttl=1800, refresh_ahead=300)
+    cache.get("unused", "secret")
+    now[0] += 1800
+    cache.get("key-id", "secret")
+    assert list(cache._tokens) == ["key-id"]
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+import metrics
+from metrics import HTTP_REQUESTS, STAGE_SECONDS, MetricsMiddleware, MetricsRegistry, TraceStore, current_trace, observe
+
+
+def _sample(metric, suffix: str = "", **labels) -> float:
+    """The value of one rendered sample of metric, or 0 if it has none."""
+    prefix = metric.name + suffix + "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+    for line in metric.render():
+        if line.startswith(prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+
+def test_counter_renders_labels_escaped():
+    registry = MetricsRegistry()
+    counter = registry.counter("things_total", "Things.", ("name",))
+    counter.inc(name='a "b"\n')
+    counter.inc(2, name='a "b"\n')
+    assert registry.render() == '# HELP things_total Things.\n# TYPE things_total counter\nthings_total{name="a \\"b\\"\\n"} 3\n'
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = MetricsRegistry().histogram("took_seconds", "Time.", ("stage",), buckets=(1, 5))
+    for value in (0.5, 2, 10):
+        histogram.observe(value, stage="merge")
+    assert histogram.render()[2:] == [
+        'took_seconds_bucket{stage="merge",le="1"} 1',
+        'took_seconds_bucket{stage="merge",le="5"} 2',
+        'took_seconds_bucket{stage="merge",le="+Inf"} 3',
+        'took_seconds_sum{stage="merge"} 12.5',
+        'took_seconds_count{stage="merge"} 3',
+    ]
+
+
+def test_gauge_reads_its_collector_at_scrape_time():
+    values = {("kling",): 2}
+    registry = MetricsRegistry()
+    registry.gauge("in_flight", "Clips in flight.", ("provider",), collect=lambda: values)
+    assert 'in_flight{provider="kling"} 2' in registry.render()
+    values[("kling",)] = 0.5
+    assert 'in_flight{provider="kling"} 0.5' in registry.render()
+
+
+def test_failing_gauge_collector_renders_no_samples():
+    registry = MetricsRegistry()
+    registry.gauge("broken", "Broken.", collect=lambda: 1 / 0)
+    assert registry.render() == "# HELP broken Broken.\n# TYPE broken gauge\n"
+
+
+def test_observe_records_the_outcome_and_a_span():
+    trace = TraceStore(limit=5).start("job-1")
+    token = current_trace.set(trace)
+    try:
+        before = _sample(STAGE_SECONDS, "_count", stage="download", provider="kling", outcome="error")
+        with observe("submit", "kling", clip=1) as span:
+            span["task_id"] = "task-1"
+        with pytest.raises(OSError):
+            with observe("download", "kling", clip=1):
+                raise OSError("reset")
+    finally:
+        current_trace.reset(token)
+    assert _sample(STAGE_SECONDS, "_count", stage="download", provider="kling", outcome="error") == before + 1
+    assert [(span["name"], span["outcome"]) for span in trace.spans] == [("submit", "ok"), ("download", "error")]
+    assert trace.spans[0]["task_id"] == "task-1" and trace.spans[0]["clip"] == 1
+
+
+def test_spans_from_child_tasks_and_threads_join_the_job_trace():
+    trace = TraceStore(limit=5).start("job-1")
+
+    async def clip(index):
+        with observe("poll", "kling", clip=index):
+            await asyncio.sleep(0)
+
+    def merge():
+        with observe("merge"):
+            pass
+
+    async def run():
+        current_trace.set(trace)
+        await asyncio.gather(clip(0), clip(1), asyncio.to_thread(merge))
+
+    asyncio.run(run())
+    assert sorted(span["name"] for span in trace.spans) == ["merge", "poll", "poll"]
+
+
+def test_trace_store_keeps_the_most_recent_jobs():
+    store = TraceStore(limit=2)
+    first = store.start("job-1")
+    store.start("job-2")
+    # Starting a job again reuses its trace and marks it recent
+    assert store.start("job-1") is first
+    store.start("job-3")
+    assert store.get("job-2") is None
+    assert store.get("job-1") is first and store.get("job-3") is not None
+
+
+def test_tracing_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(metrics, "JOB_TRACING", False)
+    store = TraceStore()
+    assert store.start("job-1") is None
+    assert store.get("job-1") is None
+
+
+def test_middleware_labels_requests_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        if item_id == "broken":
+            raise RuntimeError("broken")
+        return {"item_id": item_id}
+
+    client = TestClient(app, raise_server_exceptions=False)
+    before = {status: _sample(HTTP_REQUESTS, method="GET", route="/items/{item_id}", status=status) for status in (200, 500)}
+    unmatched = _sample(HTTP_REQUESTS, method="GET", route="unmatched", status=404)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/items/broken")
+    client.get("/missing")
+    assert _sample(HTTP_REQUESTS, method="GET", route="/items/{item_id}", status=200) == before[200] + 2
+    assert _sample(HTTP_REQUESTS, method="GET", route="/items/{item_id}", status=500) == before[500] + 1
+    assert _sample(HTTP_REQUESTS, method="GET", route="unmatched", status=404) == unmatched + 1
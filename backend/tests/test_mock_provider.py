@@ -0,0 +1,94 @@
+import os
+
+import pytest
+from starlette.testclient import TestClient
+
+import mock_provider
+from mock_provider import MockProvider, ensure_sample_clips
+from video_merge import can_stream_copy
+
+AUTH = {"Authorization": "Bearer key"}
+
+
+@pytest.fixture(scope="module")
+def clips_dir(tmp_path_factory):
+    clips_dir = str(tmp_path_factory.mktemp("mock_clips"))
+    ensure_sample_clips(clips_dir, count=2)
+    return clips_dir
+
+
+@pytest.fixture
+def client(clips_dir, monkeypatch):
+    monkeypatch.setattr(mock_provider, "MOCK_CLIPS_DIR", clips_dir)
+    monkeypatch.setattr(mock_provider, "MOCK_TASK_SECONDS", 0)
+    monkeypatch.setattr(mock_provider, "MOCK_REQUEST_SECONDS", 0)
+    provider = MockProvider()
+    provider.clips = ensure_sample_clips(clips_dir, count=2)
+    monkeypatch.setattr(mock_provider, "provider", provider)
+    # Without the lifespan, which would render clips into the working directory
+    return TestClient(mock_provider.app)
+
+
+def test_sample_clips_can_be_merged_by_stream_copy(clips_dir):
+    clips = ensure_sample_clips(clips_dir, count=2)
+    modified = [os.path.getmtime(path) for path in clips]
+    # Existing clips are not rendered again
+    assert ensure_sample_clips(clips_dir, count=2) == clips
+    assert [os.path.getmtime(path) for path in clips] == modified
+    assert can_stream_copy(clips)
+
+
+def test_kling_task_runs_to_a_downloadable_clip(client):
+    submitted = client.post("/kling/v1/videos/image2video", json={"image": "aGVsbG8="}, headers=AUTH).json()
+    assert submitted["data"]["task_status"] == "submitted"
+    status = client.get(f"/kling/v1/videos/image2video/{submitted['data']['task_id']}", headers=AUTH).json()["data"]
+    assert status["task_status"] == "succeed"
+    clip = client.get(status["task_result"]["videos"][0]["url"])
+    assert clip.status_code == 200
+    assert clip.headers["content-type"] == "video/mp4"
+    assert mock_provider.provider.stats["downloads"] == 1
+
+
+def test_minimax_task_runs_to_a_downloadable_clip(client):
+    image_url = client.post("/minimax/v1/media/upload", files={"file": ("a.png", b"png", "image/png")}, headers=AUTH).json()["url"]
+    task_id = client.post("/minimax/v1/text_to_video", json={"image_url": image_url}, headers=AUTH).json()["task_id"]
+    status = client.get(f"/minimax/v1/text_to_video/status/{task_id}", headers=AUTH).json()
+    assert status["status"] == "completed"
+    assert client.get(status["result"]["video_url"]).status_code == 200
+
+
+def test_requests_are_checked_like_the_real_apis(client):
+    assert client.post("/kling/v1/videos/image2video", json={"image": "aGVsbG8="}).status_code == 401
+    assert client.post("/kling/v1/videos/image2video", json={}, headers=AUTH).status_code == 400
+    assert client.post("/minimax/v1/text_to_video", json={}, headers=AUTH).status_code == 400
+    assert client.get("/kling/v1/videos/image2video/unknown", headers=AUTH).status_code == 404
+
+
+def test_tasks_are_queued_then_processing(client, monkeypatch):
+    monkeypatch.setattr(mock_provider, "MOCK_TASK_SECONDS", 60)
+    monkeypatch.setattr(mock_provider, "MOCK_LATENCY_SIGMA", 0)
+    task_id = client.post("/kling/v1/videos/image2video", json={"image": "aGVsbG8="}, headers=AUTH).json()["data"]["task_id"]
+    task = mock_provider.provider.tasks[task_id]
+    assert client.get(f"/kling/v1/videos/image2video/{task_id}", headers=AUTH).json()["data"]["task_status"] == "submitted"
+    task.started -= 13
+    assert client.get(f"/kling/v1/videos/image2video/{task_id}", headers=AUTH).json()["data"]["task_status"] == "processing"
+    assert task.finished - task.created == 60
+
+
+def test_injected_failures(client, monkeypatch):
+    monkeypatch.setattr(mock_provider, "MOCK_TASK_FAILURE_RATE", 1)
+    task_id = client.post("/minimax/v1/text_to_video", json={"image_url": "https://mock.invalid/a.png"}, headers=AUTH).json()["task_id"]
+    status = client.get(f"/minimax/v1/text_to_video/status/{task_id}", headers=AUTH).json()
+    assert status["status"] == "failed" and status["error"]
+    monkeypatch.setattr(mock_provider, "MOCK_ERROR_RATE", 1)
+    assert client.get(f"/minimax/v1/text_to_video/status/{task_id}", headers=AUTH).status_code == 500
+    assert client.get("/stats").json()["errors"] == 1
+
+
+def test_calls_over_the_rate_limit_are_throttled_per_key(client, monkeypatch):
+    monkeypatch.setattr(mock_provider, "MOCK_RATE_LIMIT", 1)
+    assert client.get("/kling/v1/videos/image2video/unknown", headers=AUTH).status_code == 404
+    throttled = client.get("/kling/v1/videos/image2video/unknown", headers=AUTH)
+    assert throttled.status_code == 429
+    assert throttled.headers["retry-after"] == str(mock_provider.MOCK_RETRY_AFTER)
+    assert client.get("/kling/v1/videos/image2video/unknown", headers={"Authorization": "Bearer other"}).status_code == 404
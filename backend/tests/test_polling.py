@@ -0,0 +1,127 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from polling import PollingPolicy, PollScheduler, parse_retry_after
+
+
+def _policy(**overrides) -> PollingPolicy:
+    settings = {"expected_duration": 60.0, "min_interval": 2.0, "max_interval": 30.0, "backoff": 1.5, "jitter": 0.0}
+    settings.update(overrides)
+    return PollingPolicy("test", **settings)
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after({"Retry-After": "12"}) == 12.0
+    assert parse_retry_after({"Retry-After": "1.5"}) == 1.5
+    assert parse_retry_after({"Retry-After": "-3"}) == 0.0
+
+
+def test_parse_retry_after_http_date():
+    in_a_minute = formatdate(time.time() + 60, usegmt=True)
+    assert parse_retry_after({"Retry-After": in_a_minute}) == pytest.approx(60, abs=2)
+    a_minute_ago = formatdate(time.time() - 60, usegmt=True)
+    assert parse_retry_after({"Retry-After": a_minute_ago}) == 0.0
+
+
+def test_parse_retry_after_missing_or_invalid():
+    assert parse_retry_after({}) is None
+    assert parse_retry_after({"Retry-After": ""}) is None
+    assert parse_retry_after({"Retry-After": "soon"}) is None
+
+
+def test_next_delay_polls_at_early_interval_then_tightens():
+    policy = _policy()
+    assert policy.next_delay(elapsed=0) == 5
+    assert policy.next_delay(elapsed=52) == 4
+    assert policy.next_delay(elapsed=58) == 2
+
+
+def test_next_delay_backs_off_from_the_fastest_completions():
+    policy = _policy(expected_duration=300.0)
+    # Half the tasks take 200s and the rest 100-190s: the fastest, not the average, set where polls back off
+    for duration in [100] + [200] * 9 + list(range(110, 200, 10)):
+        policy.record_completion(duration)
+    assert policy.backoff_after() == 110
+    assert policy.next_delay(elapsed=100) == 5
+    assert policy.next_delay(elapsed=120, overdue_polls=0) == 2
+
+
+def test_next_delay_backs_off_once_overdue():
+    policy = _policy()
+    delays = [policy.next_delay(elapsed=90, overdue_polls=n) for n in range(12)]
+    assert delays[:3] == [2, 3, 4.5]
+    assert delays == sorted(delays)
+    assert delays[-1] == 30
+
+
+def test_next_delay_jitter_stays_within_bounds():
+    policy = _policy(jitter=0.2)
+    for _ in range(100):
+        assert 4 <= policy.next_delay(elapsed=40) <= 6
+
+
+def test_throttled_delay_honours_retry_after():
+    policy = _policy()
+    assert policy.throttled_delay(40, {"Retry-After": "45"}) == 45
+
+
+def test_throttled_delay_without_retry_after_doubles_next_delay():
+    policy = _policy()
+    assert policy.throttled_delay(40, {}) == 10
+    assert policy.throttled_delay(90, {}) == 4
+
+
+def test_backoff_after_uses_expected_duration_until_enough_samples():
+    policy = _policy(expected_duration=100.0)
+    for _ in range(9):
+        policy.record_completion(50)
+    assert policy.backoff_after() == 100
+    policy.record_completion(50)
+    assert policy.backoff_after() == 50
+
+
+def test_completion_p95_needs_enough_samples():
+    policy = _policy()
+    for duration in range(1, 10):
+        policy.record_completion(duration)
+    assert policy.completion_p95() is None
+    for duration in range(10, 21):
+        policy.record_completion(duration)
+    assert policy.completion_p95() == 20
+
+
+def _finishes_after(polls: int):
+    count = 0
+
+    async def poll():
+        nonlocal count
+        count += 1
+        return "done" if count >= polls else None
+    return poll
+
+
+def test_wait_for_records_completion_times():
+    policy = _policy(expected_duration=0.02, min_interval=0.01, max_interval=0.01, early_interval=0.01)
+
+    async def run():
+        scheduler = PollScheduler()
+        assert await scheduler.wait_for(_finishes_after(2), policy) == "done"
+        # A resumed task was submitted before the wait began, so its duration is unknown
+        assert await scheduler.wait_for(_finishes_after(2), policy, resumed=True) == "done"
+
+    asyncio.run(run())
+    assert len(policy._recent) == 1
+    assert policy._recent[0] >= 0.01
+
+
+def test_wait_for_times_out():
+    policy = _policy(expected_duration=0.02, min_interval=0.01, max_interval=0.01, timeout=0.05)
+
+    async def run():
+        await PollScheduler().wait_for(_finishes_after(1000), policy)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(run())
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+
+import httpx
+import pytest
+
+from klingai_client import AsyncKlingAIClient
+from minimax_client import AsyncMinimaxClient
+from polling import PollingPolicy
+from providers import VideoProvider
+from retry import ClipRejectedError
+
+CLIP = b"\x00\x00\x00\x18ftypmp42" + b"clip" * 256
+CREDENTIALS = {"access_key_id": "key-id", "access_key_secret": "key-secret"}
+
+
+class _Body(httpx.AsyncByteStream):
+    """A response body streamed as it would be from the network, so it can be read raw."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+
+
+def _fast_polling() -> PollingPolicy:
+    return PollingPolicy("test", expected_duration=0.05, min_interval=0.01, max_interval=0.01, jitter=0.0, timeout=5)
+
+
+class FakeKling:
+    """Answers image2video submissions, task queries and the clip download; records every request."""
+
+    def __init__(self, polls_until_done: int = 2):
+        self.polls_until_done = polls_until_done
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.method == "POST" and request.url.path.endswith("/videos/image2video"):
+            return httpx.Response(200, json={"data": {"task_id": "task-1"}})
+        if request.url.path.endswith("/videos/image2video/task-1"):
+            polls = sum(1 for r in self.requests if r.url.path.endswith("/task-1"))
+            if polls < self.polls_until_done:
+                return httpx.Response(200, json={"data": {"task_status": "processing"}})
+            videos = [{"url": "https://cdn.test/clip.mp4"}]
+            return httpx.Response(200, json={"data": {"task_status": "succeed", "task_result": {"videos": videos}}})
+        if request.url.host == "cdn.test":
+            return httpx.Response(200, headers={"Content-Length": str(len(CLIP))}, stream=_Body(CLIP))
+        return httpx.Response(404)
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"\x89PNG fake image")
+    return str(path)
+
+
+def _kling(handler) -> AsyncKlingAIClient:
+    client = AsyncKlingAIClient(base_url="https://kling.test/v1")
+    client.polling_policy = _fast_polling()
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_http_client_is_created_once_and_closed():
+    async def run():
+        client = AsyncKlingAIClient()
+        pool = client.http
+        assert client.http is pool
+        await client.aclose()
+        assert pool.is_closed
+        assert client._http is None
+        # A new pool is created if the provider is used again
+        assert client.http is not pool
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_providers_must_implement_every_stage():
+    class SubmitOnly(VideoProvider):
+        async def submit(self, image_path, image_digest, prompt, credentials):
+            return "task-1"
+
+    with pytest.raises(TypeError, match="poll"):
+        SubmitOnly()
+    # The real clients implement all of them
+    AsyncKlingAIClient()
+    AsyncMinimaxClient(api_key="api-key", group_id="group")
+
+
+def test_kling_generate_video_submits_polls_and_downloads(image):
+    fake = FakeKling()
+    client = _kling(fake)
+    states = []
+
+    async def run():
+        try:
+            return await client.generate_video(image, "a prompt", CREDENTIALS, lambda state, details: states.append(state))
+        finally:
+            await client.aclose()
+
+    path = asyncio.run(run())
+    with open(path, "rb") as f:
+        assert f.read() == CLIP
+    os.remove(path)
+
+    submission = json.loads(fake.requests[0].content)
+    assert submission["prompt"] == "a prompt"
+    assert submission["model_name"] == "kling-v1"
+    assert fake.requests[0].headers["authorization"].startswith("Bearer ")
+    assert [state for state in states if state != "downloading"] == ["submitted", "processing", "succeed"]
+    assert states[-1] == "downloading"
+
+
+def test_kling_generate_video_resumes_task_without_submitting(image):
+    fake = FakeKling(polls_until_done=1)
+    client = _kling(fake)
+
+    async def run():
+        try:
+            return await client.generate_video(image, "a prompt", CREDENTIALS, task_id="task-1")
+        finally:
+            await client.aclose()
+
+    os.remove(asyncio.run(run()))
+    assert all(request.method == "GET" for request in fake.requests)
+
+
+def test_kling_failed_task_is_rejected(image):
+    def handler(request):
+        if request.method == "POST":
+            return httpx.Response(200, json={"data": {"task_id": "task-1"}})
+        return httpx.Response(200, json={"data": {"task_status": "failed", "task_status_msg": "moderation"}})
+
+    client = _kling(handler)
+
+    async def run():
+        try:
+            return await client.generate_video(image, "a prompt", CREDENTIALS)
+        finally:
+            await client.aclose()
+
+    with pytest.raises(ClipRejectedError, match="moderation"):
+        asyncio.run(run())
+
+
+def test_minimax_generate_video_uploads_then_submits(image):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path.endswith("/media/upload"):
+            return httpx.Response(200, json={"url": "https://minimax.test/uploaded.png"})
+        if request.url.path.endswith("/text_to_video"):
+            return httpx.Response(200, json={"task_id": "task-1"})
+        if request.url.path.endswith("/text_to_video/status/task-1"):
+            return httpx.Response(200, json={"status": "completed", "result": {"video_url": "https://cdn.test/clip.mp4"}})
+        return httpx.Response(200, headers={"Content-Length": str(len(CLIP))}, stream=_Body(CLIP))
+
+    client = AsyncMinimaxClient(base_url="https://minimax.test/v1", api_key="api-key", group_id="group")
+    client.polling_policy = _fast_polling()
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def run():
+        try:
+            return await client.generate_video(image, "a prompt", {})
+        finally:
+            await client.aclose()
+
+    path = asyncio.run(run())
+    os.remove(path)
+    assert [request.url.path for request in requests[:2]] == ["/v1/media/upload", "/v1/text_to_video"]
+    assert json.loads(requests[1].content)["image_url"] == "https://minimax.test/uploaded.png"
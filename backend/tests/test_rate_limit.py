@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limit import FairAdmissionQueue, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_throttles():
+    async def run():
+        bucket = TokenBucket(rate=50, burst=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        assert bucket.throttled == 0
+        await bucket.acquire()
+        return bucket, time.monotonic() - started
+
+    bucket, elapsed = asyncio.run(run())
+    assert bucket.throttled == 1
+    # The fourth token is refilled after 1/rate seconds
+    assert elapsed >= 0.015
+    assert bucket.total_wait == pytest.approx(0.02, abs=0.005)
+
+
+def test_token_bucket_refills_to_full():
+    bucket = TokenBucket(rate=10, burst=2)
+    now = time.monotonic()
+    assert bucket.full(now)
+    asyncio.run(bucket.acquire())
+    assert not bucket.full(time.monotonic())
+    assert bucket.full(time.monotonic() + 0.2)
+
+
+def test_token_bucket_serves_waiters_in_arrival_order():
+    async def run():
+        bucket = TokenBucket(rate=100, burst=1)
+        order = []
+
+        async def request(name):
+            await bucket.acquire()
+            order.append(name)
+
+        await asyncio.gather(*(request(name) for name in "abcd"))
+        return order
+
+    assert asyncio.run(run()) == list("abcd")
+
+
+def test_admission_queue_caps_concurrency():
+    async def run():
+        queue = FairAdmissionQueue(capacity=2)
+        await queue.acquire("job")
+        await queue.acquire("job")
+        waiter = asyncio.ensure_future(queue.acquire("job"))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        assert queue.active == 2 and queue.depth == 1
+        queue.release()
+        await waiter
+        return queue
+
+    queue = asyncio.run(run())
+    assert queue.active == 2 and queue.depth == 0
+    assert queue.admitted == 3
+
+
+def test_admission_queue_takes_jobs_in_turn():
+    async def run():
+        queue = FairAdmissionQueue(capacity=1)
+        await queue.acquire("holder")
+        order = []
+
+        async def clip(job_id, name):
+            await queue.acquire(job_id)
+            order.append(name)
+
+        # Job a queues three clips before job b queues one
+        tasks = [asyncio.ensure_future(clip("a", f"a{i}")) for i in range(3)]
+        tasks.append(asyncio.ensure_future(clip("b", "b0")))
+        await asyncio.sleep(0)
+        for _ in tasks:
+            queue.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["a0", "b0", "a1", "a2"]
+
+
+def test_admission_queue_forgets_cancelled_waiters():
+    async def run():
+        queue = FairAdmissionQueue(capacity=1)
+        await queue.acquire("a")
+        waiter = asyncio.ensure_future(queue.acquire("b"))
+        await asyncio.sleep(0)
+        assert queue.depth == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert queue.depth == 0
+        queue.release()
+        return queue
+
+    assert asyncio.run(run()).active == 0
+
+
+def test_admission_queue_hands_on_slot_granted_to_cancelled_waiter():
+    async def run():
+        queue = FairAdmissionQueue(capacity=1)
+        await queue.acquire("a")
+        cancelled = asyncio.ensure_future(queue.acquire("b"))
+        next_in_line = asyncio.ensure_future(queue.acquire("c"))
+        await asyncio.sleep(0)
+        # The slot goes to b, which is cancelled before it runs again
+        queue.release()
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        await asyncio.wait_for(next_in_line, 1)
+        return queue
+
+    queue = asyncio.run(run())
+    assert queue.active == 1 and queue.depth == 0
@@ -0,0 +1,218 @@
+import asyncio
+
+import httpx
+import pytest
+
+from downloads import IncompleteDownloadError
+from retry import FAILURE_REJECTED, FAILURE_TRANSIENT, ClipAttemptError, ClipRejectedError, RetryPolicy, _hedged, classify_failure, run_clip
+
+
+def _status_error(status_code: int, headers=None) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://provider.test/task")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status_code}", request=request, response=response)
+
+
+def _no_delay(max_retries: int = 2) -> RetryPolicy:
+    return RetryPolicy(max_retries=max_retries, base_delay=0, max_delay=0)
+
+
+@pytest.mark.parametrize("error", [
+    _status_error(500),
+    _status_error(503),
+    _status_error(429),
+    _status_error(408),
+    httpx.ConnectError("connection refused"),
+    httpx.ReadTimeout("read timed out"),
+    TimeoutError("poll timed out"),
+    IncompleteDownloadError("short read"),
+])
+def test_classify_failure_transient(error):
+    assert classify_failure(error) == FAILURE_TRANSIENT
+
+
+@pytest.mark.parametrize("error", [
+    ClipRejectedError("moderation"),
+    _status_error(400),
+    _status_error(401),
+    _status_error(404),
+    KeyError("task_id"),
+    ValueError("bad image"),
+])
+def test_classify_failure_rejected(error):
+    assert classify_failure(error) == FAILURE_REJECTED
+
+
+def test_retry_delay_honours_retry_after():
+    policy = RetryPolicy(base_delay=5, max_delay=60)
+    assert policy.retry_delay(1, _status_error(429, {"Retry-After": "7"})) == 7
+    assert policy.retry_delay(1, _status_error(429, {"Retry-After": "600"})) == 60
+
+
+def test_retry_delay_backs_off_exponentially():
+    policy = RetryPolicy(base_delay=5, max_delay=60)
+    assert 4 <= policy.retry_delay(1, Exception()) <= 6
+    assert 16 <= policy.retry_delay(3, Exception()) <= 24
+    assert 48 <= policy.retry_delay(10, Exception()) <= 72
+
+
+def test_run_clip_retries_transient_failures():
+    calls = []
+
+    async def attempt(task_id, started):
+        calls.append(task_id)
+        if len(calls) < 3:
+            raise httpx.ConnectError("connection reset")
+        return "clip.mp4"
+
+    retries = []
+    result = asyncio.run(run_clip(attempt, _no_delay(), on_retry=lambda retry, error: retries.append(retry)))
+    assert result == "clip.mp4"
+    assert calls == [None, None, None]
+    assert retries == [1, 2]
+
+
+def test_run_clip_does_not_retry_rejections():
+    calls = []
+
+    async def attempt(task_id, started):
+        calls.append(task_id)
+        raise ClipRejectedError("moderation")
+
+    with pytest.raises(ClipRejectedError):
+        asyncio.run(run_clip(attempt, _no_delay()))
+    assert len(calls) == 1
+
+
+def test_run_clip_gives_up_after_max_retries():
+    calls = []
+
+    async def attempt(task_id, started):
+        calls.append(task_id)
+        raise _status_error(502)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run_clip(attempt, _no_delay(max_retries=2)))
+    assert len(calls) == 3
+
+
+def test_run_clip_resumes_submitted_task():
+    calls = []
+
+    async def attempt(task_id, started):
+        calls.append(task_id)
+        if len(calls) == 1:
+            raise ClipAttemptError("task-1", httpx.ReadTimeout("poll failed"))
+        return f"{task_id}.mp4"
+
+    assert asyncio.run(run_clip(attempt, _no_delay(), task_id=None)) == "task-1.mp4"
+    assert calls == [None, "task-1"]
+
+
+def test_run_clip_resubmits_timed_out_task():
+    calls = []
+
+    async def attempt(task_id, started):
+        calls.append(task_id)
+        if len(calls) == 1:
+            raise ClipAttemptError("task-1", TimeoutError("task never finished"))
+        return "clip.mp4"
+
+    asyncio.run(run_clip(attempt, _no_delay(), task_id="task-1"))
+    assert calls == ["task-1", None]
+
+
+def test_run_clip_raises_the_attempt_error_unwrapped():
+    retries = []
+
+    async def attempt(task_id, started):
+        raise ClipAttemptError("task-1", ClipRejectedError("moderation"))
+
+    with pytest.raises(ClipRejectedError, match="moderation"):
+        asyncio.run(run_clip(attempt, _no_delay(), on_retry=lambda retry, error: retries.append(error)))
+
+    async def transient(task_id, started):
+        raise ClipAttemptError(task_id, httpx.ConnectError("connection reset"))
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(run_clip(transient, _no_delay(max_retries=1), on_retry=lambda retry, error: retries.append(error)))
+    # Retries see the underlying error too
+    assert [type(error) for error in retries] == [httpx.ConnectError]
+
+
+def test_hedged_without_hedging_runs_one_attempt():
+    calls = []
+
+    async def attempt(task_id, started):
+        calls.append(task_id)
+        return "clip.mp4"
+
+    assert asyncio.run(_hedged(attempt, "task-1", None, None)) == "clip.mp4"
+    assert calls == ["task-1"]
+
+
+def test_hedged_duplicate_wins_over_slow_attempt():
+    cancelled = []
+
+    async def attempt(task_id, started):
+        started.set()
+        if task_id == "slow":
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(task_id)
+                raise
+        return "hedge.mp4"
+
+    hedges = []
+    result = asyncio.run(_hedged(attempt, "slow", 0.05, lambda: hedges.append(1)))
+    assert result == "hedge.mp4"
+    assert hedges == [1]
+    assert cancelled == ["slow"]
+
+
+def test_hedged_not_sent_when_attempt_finishes_in_time():
+    calls = []
+
+    async def attempt(task_id, started):
+        calls.append(task_id)
+        started.set()
+        return "clip.mp4"
+
+    hedges = []
+    assert asyncio.run(_hedged(attempt, None, 1.0, lambda: hedges.append(1))) == "clip.mp4"
+    assert calls == [None]
+    assert hedges == []
+
+
+def test_hedged_clock_starts_once_attempt_holds_a_slot():
+    hedges = []
+
+    async def attempt(task_id, started):
+        # Queued for a slot longer than hedge_after, then quick once admitted
+        await asyncio.sleep(0.1)
+        started.set()
+        await asyncio.sleep(0.01)
+        return "clip.mp4"
+
+    assert asyncio.run(_hedged(attempt, None, 0.05, lambda: hedges.append(1))) == "clip.mp4"
+    assert hedges == []
+
+
+def test_hedged_fails_only_when_every_attempt_fails():
+    async def attempt(task_id, started):
+        started.set()
+        if task_id == "primary":
+            await asyncio.sleep(0.1)
+            raise httpx.ConnectError("primary failed")
+        return "hedge.mp4"
+
+    assert asyncio.run(_hedged(attempt, "primary", 0.01, None)) == "hedge.mp4"
+
+    async def failing(task_id, started):
+        started.set()
+        await asyncio.sleep(0.05)
+        raise httpx.ConnectError(f"{task_id} failed")
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(_hedged(failing, "primary", 0.01, None))
@@ -0,0 +1,119 @@
+import os
+import time
+
+import pytest
+
+from storage import ARTIFACT_TTLS, CLIPS, IMAGES, STREAMS, TEMP_FILE_TTL, VIDEOS, ArtifactStore
+
+HOUR = 3600
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(root=str(tmp_path), max_bytes=10_000, ttls={kind: HOUR for kind in ARTIFACT_TTLS})
+
+
+def _write(store: ArtifactStore, kind: str, name: str, size: int = 100, age: float = 0, used_age: float = None) -> str:
+    """Create an artifact last written age seconds ago and last used used_age seconds ago."""
+    path = store.path(kind, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    now = time.time()
+    used_age = age if used_age is None else used_age
+    os.utime(path, (now - used_age, now - age))
+    return path
+
+
+def test_sweep_removes_expired_artifacts(store):
+    expired = _write(store, CLIPS, "old.mp4", age=2 * HOUR)
+    fresh = _write(store, CLIPS, "new.mp4", age=60)
+    result = store.sweep()
+    assert not os.path.exists(expired)
+    assert os.path.exists(fresh)
+    assert result["removed"] == 1 and result["freed_bytes"] == 100
+    assert store.usage[CLIPS] == 100
+
+
+def test_sweep_goes_by_last_use(store):
+    path = _write(store, IMAGES, "used.png", age=2 * HOUR, used_age=2 * HOUR)
+    store.touch(path)
+    store.sweep()
+    assert os.path.exists(path)
+    # Touching keeps the mtime, which is part of a video's ETag
+    assert time.time() - os.stat(path).st_mtime > HOUR
+
+
+def test_sweep_keeps_retained_artifacts(store):
+    path = _write(store, VIDEOS, "running.mp4", age=2 * HOUR)
+    store.retain([path])
+    store.sweep()
+    assert os.path.exists(path)
+    # Released files count as used now, so they get a fresh TTL
+    store.release([path])
+    store.sweep()
+    assert os.path.exists(path)
+
+
+def test_sweep_keeps_protected_artifacts(store):
+    path = _write(store, VIDEOS, "other-worker.mp4", age=2 * HOUR)
+    store.protected = lambda: [path]
+    store.sweep()
+    assert os.path.exists(path)
+
+
+def test_sweep_evicts_least_recently_used_over_quota(store):
+    store.max_bytes = 250
+    oldest = _write(store, CLIPS, "a.mp4", age=300)
+    middle = _write(store, VIDEOS, "b.mp4", age=600, used_age=200)
+    newest = _write(store, IMAGES, "c.png", age=100)
+    result = store.sweep()
+    assert not os.path.exists(oldest)
+    assert os.path.exists(middle) and os.path.exists(newest)
+    assert result["total_bytes"] == 200
+
+
+def test_sweep_removes_abandoned_temp_files(store):
+    abandoned = store.temp_path(CLIPS)
+    in_progress = store.temp_path(CLIPS, ".mp4")
+    for path, age in ((abandoned, TEMP_FILE_TTL + 60), (in_progress, 10)):
+        with open(path, "wb") as f:
+            f.write(b"x")
+        os.utime(path, (time.time() - age, time.time() - age))
+    store.sweep()
+    assert not os.path.exists(abandoned)
+    assert os.path.exists(in_progress)
+
+
+def test_sweep_reports_removed_files(store):
+    removed = []
+    store.on_remove = lambda kind, path: removed.append((kind, path))
+    path = _write(store, VIDEOS, "gone.mp4", age=2 * HOUR)
+    store.sweep()
+    assert removed == [(VIDEOS, path)]
+
+
+def test_sweep_removes_empty_stream_directories(store):
+    job_directory = store.candidates(STREAMS, "job")[0]
+    os.makedirs(job_directory)
+    playlist = os.path.join(job_directory, "index.m3u8")
+    with open(playlist, "w") as f:
+        f.write("#EXTM3U\n")
+    old = time.time() - 2 * HOUR
+    os.utime(playlist, (old, old))
+    store.sweep()
+    assert not os.path.exists(playlist)
+    # Removing the playlist refreshed the directory's mtime; once that is old too it goes
+    os.utime(job_directory, (old, old))
+    store.sweep()
+    assert not os.path.exists(job_directory)
+
+
+def test_atomic_write_removes_temp_file_on_error(store):
+    path = store.path(CLIPS, "clip.mp4")
+    with pytest.raises(RuntimeError):
+        with store.atomic_write(path) as temp_path:
+            with open(temp_path, "wb") as f:
+                f.write(b"partial")
+            raise RuntimeError("encoder crashed")
+    assert not os.path.exists(path)
+    assert os.listdir(os.path.dirname(path)) == []
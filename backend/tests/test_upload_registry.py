@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+import pytest
+
+import upload_registry
+from upload_registry import UploadRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return UploadRegistry(str(tmp_path / "jobs.db"), ttl_seconds=60)
+
+
+def test_batches_keep_their_files_in_upload_order(registry):
+    registry.register_batch("batch-1", ["/images/b.png", "/images/a.png"])
+    registry.register_batch("batch-2", ["/images/c.png"])
+    assert registry.get_batch("batch-1") == ["/images/b.png", "/images/a.png"]
+    assert registry.get_batch("batch-2") == ["/images/c.png"]
+    assert registry.get_batch("unknown") is None
+
+
+def test_batch_ids_are_unique(registry):
+    registry.register_batch("batch-1", ["/images/a.png"])
+    with pytest.raises(sqlite3.IntegrityError):
+        registry.register_batch("batch-1", ["/images/b.png"])
+    assert registry.get_batch("batch-1") == ["/images/a.png"]
+
+
+def test_batches_expire(registry, monkeypatch):
+    registry.register_batch("old", ["/images/a.png"])
+    now = time.time()
+    monkeypatch.setattr(upload_registry.time, "time", lambda: now + 61)
+    assert registry.get_batch("old") is None
+    registry.register_batch("new", ["/images/b.png"])
+    assert registry.get_batch("new") == ["/images/b.png"]
+    # Registering swept the expired batch from the table
+    monkeypatch.undo()
+    assert registry.get_batch("old") is None
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+from starlette.testclient import TestClient
+
+import main
+from storage import IMAGES
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"image" * 100
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def _stored_images():
+    root = os.path.join(main.artifact_store.root, IMAGES)
+    return sorted(os.path.join(directory, name) for directory, _, names in os.walk(root) for name in names)
+
+
+def test_upload_registers_a_batch(client):
+    response = client.post("/upload-images", files=[
+        ("files", ("a.png", PNG, "image/png")),
+        ("files", ("b.png", PNG + b"b", "image/png")),
+    ])
+    assert response.status_code == 200
+    body = response.json()
+    assert main.upload_registry.get_batch(body["upload_id"]) == body["files"]
+    for path in body["files"]:
+        assert os.path.exists(path)
+
+
+def test_upload_rejects_a_large_body_before_parsing(client, monkeypatch):
+    parsed = []
+    monkeypatch.setattr(main, "save_upload", lambda *args: parsed.append(args))
+    response = client.post(
+        "/upload-images",
+        content=b"x" * (main.MAX_UPLOAD_BYTES + 1),
+        headers={"Content-Type": "multipart/form-data; boundary=b"},
+    )
+    assert response.status_code == 413
+    assert parsed == []
+
+
+def test_upload_rejects_a_large_chunked_body(client):
+    def body():
+        chunk = b"x" * (1024 * 1024)
+        for _ in range(main.MAX_UPLOAD_BYTES // len(chunk) + 2):
+            yield chunk
+
+    response = client.post("/upload-images", content=body(), headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert "maximum size" in response.json()["detail"]
+
+
+def test_upload_rejects_invalid_type_before_storing_anything(client):
+    before = _stored_images()
+    response = client.post("/upload-images", files=[
+        ("files", ("a.png", PNG + b"valid", "image/png")),
+        ("files", ("b.txt", b"text", "text/plain")),
+    ])
+    assert response.status_code == 400
+    assert _stored_images() == before
+
+
+def test_failed_batch_removes_only_the_files_it_added(client, monkeypatch):
+    shared = client.post("/upload-images", files=[("files", ("shared.png", PNG + b"shared", "image/png"))]).json()["files"][0]
+    before = _stored_images()
+    monkeypatch.setattr(main, "MAX_FILE_SIZE", 1024)
+    response = client.post("/upload-images", files=[
+        ("files", ("new.png", PNG + b"new", "image/png")),
+        ("files", ("shared.png", PNG + b"shared", "image/png")),
+        ("files", ("large.png", PNG * 10, "image/png")),
+    ])
+    assert response.status_code == 400
+    assert "exceeds maximum size" in response.json()["detail"]
+    # The image an earlier batch uploaded too is still there; the batch's new image is gone
+    assert _stored_images() == before
+    assert shared in before
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from moviepy.config import get_setting
+
+import merge_worker
+import video_merge
+from video_merge import IncrementalMerger, MergeExecutor, can_stream_copy, concat_stream_copy, merge_videos, probe_duration, probe_video
+
+
+def _clip(path, seconds: float = 1, size: str = "64x48", rate: int = 10, options=()) -> str:
+    """A small H.264 test pattern clip made with the bundled ffmpeg; options are extra encoder arguments."""
+    subprocess.run(
+        [
+            get_setting("FFMPEG_BINARY"), "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc=size={size}:rate={rate}", "-t", str(seconds),
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", *options, str(path),
+        ],
+        check=True,
+    )
+    return str(path)
+
+
+def _file(path, size: int) -> str:
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+@pytest.fixture
+def thread_pools(monkeypatch):
+    """Run merges on threads, so a test can hold a merge inside the executor."""
+    monkeypatch.setattr(video_merge, "_worker_pool", lambda max_workers: ThreadPoolExecutor(max_workers))
+
+
+def _blocking_merges(monkeypatch):
+    """Replace the merge with one that waits while any of its inputs is held; returns the held inputs, the merged outputs and release(input)."""
+    held, merged = set(), []
+    released = threading.Condition()
+
+    def run_merge(video_paths, output_path):
+        with released:
+            released.wait_for(lambda: not held.intersection(video_paths), timeout=5)
+        merged.append(output_path)
+
+    def release(path):
+        with released:
+            held.discard(path)
+            released.notify_all()
+
+    monkeypatch.setattr(merge_worker, "run_merge", run_merge)
+    return held, merged, release
+
+
+def test_probe_video_reads_the_stream_signature(tmp_path):
+    probe = probe_video(_clip(tmp_path / "clip.mp4", options=["-profile:v", "main", "-level", "3.1"]))
+    assert probe["video_codec"] == "h264"
+    assert probe["profile"] == "Main"
+    assert probe["level"] == "31"
+    assert probe["pix_fmt"].startswith("yuv420p")
+    assert probe["size"] == "64x48"
+    assert probe["fps"] == "10"
+    assert probe["audio_codec"] is None
+
+
+@pytest.mark.parametrize("options", [
+    {"size": "96x48"},
+    {"rate": 15},
+    {"options": ["-profile:v", "baseline"]},
+    {"options": ["-level", "4.0"]},
+])
+def test_clips_with_different_parameters_are_not_stream_copied(tmp_path, options):
+    clips = [_clip(tmp_path / "a.mp4"), _clip(tmp_path / "b.mp4", **options)]
+    assert can_stream_copy([clips[0], _clip(tmp_path / "c.mp4")])
+    assert not can_stream_copy(clips)
+
+
+def test_unreadable_clips_are_not_stream_copied(tmp_path):
+    broken = _file(tmp_path / "broken.mp4", 100)
+    assert not can_stream_copy([_clip(tmp_path / "a.mp4"), broken])
+
+
+def test_matching_clips_are_merged_without_re_encoding(tmp_path, monkeypatch):
+    monkeypatch.setattr(video_merge, "reencode_concat", lambda *args: pytest.fail("re-encoded matching clips"))
+    clips = [_clip(tmp_path / "a.mp4"), _clip(tmp_path / "b.mp4", seconds=2)]
+    output = str(tmp_path / "merged.mp4")
+    merge_videos(clips, output)
+    assert probe_duration(output) == pytest.approx(3, abs=0.2)
+    assert not any(os.path.exists(clip) for clip in clips)
+
+
+def test_mismatched_clips_are_re_encoded(tmp_path, monkeypatch):
+    reencoded = []
+    monkeypatch.setattr(video_merge, "reencode_concat", lambda paths, output: reencoded.append(paths))
+    clips = [_clip(tmp_path / "a.mp4"), _clip(tmp_path / "b.mp4", size="96x48")]
+    merge_videos(list(clips), str(tmp_path / "merged.mp4"))
+    assert reencoded == [clips]
+
+
+def test_failed_stream_copy_leaves_no_output(tmp_path):
+    output = tmp_path / "merged.mp4"
+    assert not concat_stream_copy([str(tmp_path / "missing.mp4"), _clip(tmp_path / "a.mp4")], str(output))
+    assert not output.exists()
+
+
+def test_merge_runs_in_a_worker_process(tmp_path):
+    clips = [_clip(tmp_path / "a.mp4"), _clip(tmp_path / "b.mp4")]
+    output = str(tmp_path / "merged.mp4")
+    executor = MergeExecutor(max_workers=1)
+    try:
+        asyncio.run(executor.merge(clips, output))
+    finally:
+        executor.shutdown()
+    assert probe_duration(output) == pytest.approx(2, abs=0.2)
+    # The merged clips are removed
+    assert not any(os.path.exists(clip) for clip in clips)
+
+
+def test_single_worker_runs_short_merges_beside_a_large_one(tmp_path, monkeypatch, thread_pools):
+    monkeypatch.setattr(video_merge, "MERGE_LARGE_BYTES", 100)
+    held, merged, release = _blocking_merges(monkeypatch)
+    large, second_large, short = _file(tmp_path / "large", 200), _file(tmp_path / "large2", 200), _file(tmp_path / "short", 10)
+    held.update([large, second_large])
+
+    async def run():
+        executor = MergeExecutor(max_workers=1)
+        first = asyncio.ensure_future(executor.merge([large], "large.mp4"))
+        second = asyncio.ensure_future(executor.merge([second_large], "large2.mp4"))
+        await asyncio.sleep(0.05)
+        # The only worker is still free for short merges
+        await asyncio.wait_for(executor.merge([short], "short.mp4"), 1)
+        release(second_large)
+        await asyncio.sleep(0.05)
+        # Large merges run one at a time
+        assert merged == ["short.mp4"]
+        release(large)
+        await asyncio.wait_for(asyncio.gather(first, second), 1)
+        executor.shutdown()
+
+    asyncio.run(run())
+    assert merged == ["short.mp4", "large.mp4", "large2.mp4"]
+
+
+def test_large_merges_leave_a_worker_for_short_ones(tmp_path, monkeypatch, thread_pools):
+    monkeypatch.setattr(video_merge, "MERGE_LARGE_BYTES", 100)
+    held, merged, release = _blocking_merges(monkeypatch)
+    large = [_file(tmp_path / f"large{i}", 200) for i in range(3)]
+    short = _file(tmp_path / "short", 10)
+    held.update(large)
+
+    async def run():
+        executor = MergeExecutor(max_workers=3)
+        pending = [asyncio.ensure_future(executor.merge([path], f"{i}.mp4")) for i, path in enumerate(large)]
+        await asyncio.sleep(0.05)
+        await asyncio.wait_for(executor.merge([short], "short.mp4"), 1)
+        for path in large:
+            release(path)
+        await asyncio.wait_for(asyncio.gather(*pending), 1)
+        executor.shutdown()
+
+    asyncio.run(run())
+    assert merged[0] == "short.mp4"
+    assert sorted(merged[1:]) == ["0.mp4", "1.mp4", "2.mp4"]
+
+
+def _playlist(merger: IncrementalMerger) -> str:
+    with open(merger.playlist_path) as f:
+        return f.read()
+
+
+def test_incremental_merger_appends_clips_in_prompt_order(tmp_path):
+    clips = [_clip(tmp_path / f"{i}.mp4", seconds=1) for i in range(3)]
+    merger = IncrementalMerger(str(tmp_path / "stream"), clip_count=3, clip_duration=1)
+
+    async def run():
+        # The second clip waits for the first
+        await merger.add_clip(1, clips[1])
+        assert "#EXTINF" not in _playlist(merger)
+        await merger.add_clip(0, clips[0])
+        playlist = _playlist(merger)
+        assert playlist.count("#EXTINF") == 2
+        assert "#EXT-X-ENDLIST" not in playlist
+        await merger.add_clip(2, clips[2])
+
+    asyncio.run(run())
+    playlist = _playlist(merger)
+    assert "#EXT-X-TARGETDURATION:1\n" in playlist
+    assert [line for line in playlist.splitlines() if line.endswith(".ts")] == ["segment_0.ts", "segment_1.ts", "segment_2.ts"]
+    assert playlist.endswith("#EXT-X-ENDLIST\n")
+    assert "#EXT-X-DISCONTINUITY" not in playlist
+    assert [line for line in playlist.splitlines() if line.startswith("#EXTINF")] == ["#EXTINF:1.000,"] * 3
+    assert all(os.path.getsize(os.path.join(merger.output_dir, f"segment_{i}.ts")) for i in range(3))
+
+
+def test_incremental_merger_skips_failed_clips(tmp_path):
+    clips = [_clip(tmp_path / "a.mp4"), _clip(tmp_path / "b.mp4", size="96x48")]
+    merger = IncrementalMerger(str(tmp_path / "stream"), clip_count=4, clip_duration=1)
+
+    async def run():
+        await merger.add_clip(0, clips[0])
+        await merger.add_clip(1, None)
+        await merger.add_clip(2, _file(tmp_path / "broken.mp4", 100))
+        await merger.add_clip(3, clips[1])
+
+    asyncio.run(run())
+    playlist = _playlist(merger)
+    assert playlist.count("#EXTINF") == 2
+    # The second segment changes the picture size
+    assert playlist.index("#EXT-X-DISCONTINUITY") > playlist.index("segment_0.ts")
+    assert playlist.endswith("#EXT-X-ENDLIST\n")
+
+
+def test_incremental_merger_finish_closes_the_playlist(tmp_path):
+    merger = IncrementalMerger(str(tmp_path / "stream"), clip_count=2, clip_duration=5.5)
+
+    async def run():
+        await merger.add_clip(0, _clip(tmp_path / "a.mp4"))
+        assert not _playlist(merger).endswith("#EXT-X-ENDLIST\n")
+        await merger.finish()
+
+    asyncio.run(run())
+    playlist = _playlist(merger)
+    assert "#EXT-X-TARGETDURATION:6\n" in playlist
+    assert playlist.endswith("#EXT-X-ENDLIST\n")
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+
+import pytest
+from starlette.requests import Request
+
+from video_serving import VideoFileInfo, VideoMetadataCache, parse_range, video_response
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=500-", (500, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    (" bytes=0-0 ", (0, 0)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=0-1,5-6", "items=0-1", "bytes=-", "bytes=a-b"])
+def test_parse_range_unsupported_sends_whole_file(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1500-2000", "bytes=10-5", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(CONTENT)
+    stat = os.stat(path)
+    return VideoFileInfo(str(path), stat.st_size, stat.st_mtime)
+
+
+def _request(method: str = "GET", **headers: str) -> Request:
+    raw_headers = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": method, "path": "/video/test", "query_string": b"", "headers": raw_headers})
+
+
+def _send(response):
+    """Run a response and return (status, headers, body)."""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response({"type": "http", "method": "GET", "headers": []}, receive, send))
+    start = messages[0]
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], {name.decode(): value.decode() for name, value in start["headers"]}, body
+
+
+def test_video_response_full_file(video):
+    status, headers, body = _send(video_response(_request(), video))
+    assert status == 200
+    assert body == CONTENT
+    assert headers["etag"] == video.etag
+    assert headers["accept-ranges"] == "bytes"
+
+
+def test_video_response_range(video):
+    status, headers, body = _send(video_response(_request(range="bytes=10-19"), video))
+    assert status == 206
+    assert body == CONTENT[10:20]
+    assert headers["content-range"] == f"bytes 10-19/{len(CONTENT)}"
+    assert headers["content-length"] == "10"
+
+
+def test_video_response_unsatisfiable_range(video):
+    response = video_response(_request(range="bytes=5000-"), video)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_if_range_matching_etag_sends_range(video):
+    response = video_response(_request(range="bytes=0-9", if_range=video.etag), video)
+    assert response.status_code == 206
+
+
+def test_if_range_matching_date_sends_range(video):
+    response = video_response(_request(range="bytes=0-9", if_range=video.last_modified), video)
+    assert response.status_code == 206
+
+
+def test_if_range_stale_validator_sends_whole_file(video):
+    status, headers, body = _send(video_response(_request(range="bytes=0-9", if_range='"stale-etag"'), video))
+    assert status == 200
+    assert body == CONTENT
+    assert "content-range" not in headers
+
+
+def test_if_none_match_not_modified(video):
+    assert video_response(_request(if_none_match=video.etag), video).status_code == 304
+    assert video_response(_request(if_none_match='W/"other", *'), video).status_code == 304
+    assert video_response(_request(if_none_match='"other"'), video).status_code == 200
+
+
+def test_head_sends_no_body(video):
+    status, headers, body = _send(video_response(_request("HEAD"), video))
+    assert status == 200
+    assert body == b""
+    assert headers["content-length"] == str(len(CONTENT))
+
+
+def test_file_removed_before_response_gets_404(video):
+    response = video_response(_request(), video)
+    os.remove(video.path)
+    status, _, body = _send(response)
+    assert status == 404
+    assert json.loads(body) == {"detail": "Video not found"}
+
+
+def test_metadata_cache_revalidates(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"first")
+    cache = VideoMetadataCache(revalidate_after=0)
+    first = cache.lookup("video", str(path))
+    assert first.size == 5
+    path.write_bytes(b"replaced content")
+    os.utime(path, (first.mtime + 10, first.mtime + 10))
+    second = cache.lookup("video", str(path))
+    assert second.size == len(b"replaced content")
+    assert second.etag != first.etag
+    os.remove(path)
+    assert cache.lookup("video", str(path)) is None
+
+
+def test_metadata_cache_skips_stat_until_revalidation(tmp_path, monkeypatch):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"video")
+    cache = VideoMetadataCache(revalidate_after=60)
+    first = cache.lookup("video", str(path))
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, "stat", lambda p, *args, **kwargs: stats.append(p) or real_stat(p, *args, **kwargs))
+    assert cache.lookup("video", str(path)) is first
+    assert stats == []
+    # Once the entry is due, a stat confirms it is unchanged
+    first.checked -= 61
+    assert cache.lookup("video", str(path)) is first
+    assert stats == [str(path)]
+    assert cache.lookup("video", str(path)) is first
+    assert stats == [str(path)]
+    # The sweeper removing the file drops the entry right away
+    cache.invalidate("video")
+    os.remove(path)
+    assert cache.lookup("video", str(path)) is None
@@ -0,0 +1,49 @@
+import json
+import time
+from typing import List, Optional
+
+from sqlite_db import connect, prepare_database
+from storage import ARTIFACT_TTLS, IMAGES
+
+
+class UploadRegistry:
+    """
+    SQLite index of upload batches. Each /upload-images call registers its saved files
+    under a batch id, which /generate-video resolves with a single primary-key lookup.
+    Batches are dropped after ttl_seconds, by default as long as their images are kept unused.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float = ARTIFACT_TTLS[IMAGES]):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        prepare_database(db_path)
+        with connect(db_path) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS upload_batches (
+                    upload_id TEXT PRIMARY KEY,
+                    file_paths TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS upload_batches_created_at ON upload_batches (created_at)")
+
+    def register_batch(self, upload_id: str, file_paths: List[str]) -> None:
+        """Record the files saved by one upload request, in upload order, and drop expired batches."""
+        now = time.time()
+        with connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO upload_batches (upload_id, file_paths, created_at) VALUES (?, ?, ?)",
+                (upload_id, json.dumps(file_paths), now),
+            )
+            conn.execute("DELETE FROM upload_batches WHERE created_at <= ?", (now - self.ttl_seconds,))
+
+    def get_batch(self, upload_id: str) -> Optional[List[str]]:
+        """Return the file paths of an upload batch, or None if the id is unknown or expired."""
+        with connect(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT file_paths FROM upload_batches WHERE upload_id = ? AND created_at > ?",
+                (upload_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import re
+import struct
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from moviepy.config import get_setting
+from moviepy.editor import VideoFileClip, concatenate_videoclips
+
+import merge_worker
+
+logger = logging.getLogger(__name__)
+
+# "auto" stream-copies clips whose codec parameters match and re-encodes otherwise;
+# "reencode" always decodes and re-encodes through MoviePy
+MERGE_MODE = os.getenv("MERGE_MODE", "auto")
+
+# Encoder threads per re-encode, and merge worker processes per API worker; by default the
+# API workers (WEB_CONCURRENCY) split the CPUs between them, each merge using MERGE_ENCODER_THREADS
+MERGE_ENCODER_THREADS = int(os.getenv("MERGE_ENCODER_THREADS", "2"))
+_WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+MERGE_WORKERS = int(os.getenv(
+    "MERGE_WORKERS", str(max(1, (os.cpu_count() or 1) // (_WEB_CONCURRENCY * max(1, MERGE_ENCODER_THREADS))))
+))
+MERGE_PRESET = os.getenv("MERGE_PRESET", "medium")
+MERGE_BITRATE = os.getenv("MERGE_BITRATE") or None
+# Remux clips into an HLS playlist as they arrive so playback can start before the last clip
+PROGRESSIVE_STREAMING = os.getenv("PROGRESSIVE_STREAMING", "true").lower() == "true"
+HLS_PLAYLIST_NAME = "stream.m3u8"
+# Merges whose inputs add up to at least this many bytes are treated as large
+MERGE_LARGE_BYTES = int(os.getenv("MERGE_LARGE_BYTES", str(200 * 1024 * 1024)))
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split an ffmpeg stream description on commas that are not inside parentheses."""
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+    parts.append(current.strip())
+    return parts
+
+
+def _ffmpeg_summary(path: str) -> str:
+    """The stream summary ffmpeg prints to stderr for an input file."""
+    result = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-hide_banner", "-i", path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    return result.stderr
+
+
+def probe_duration(path: str) -> float:
+    """Duration of a video file in seconds."""
+    match = re.search(r"Duration: (\d+):(\d+):([\d.]+)", _ffmpeg_summary(path))
+    if not match:
+        raise ValueError(f"Could not read the duration of {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+# Offset of the level byte in each decoder configuration record, counted from its box type
+_LEVEL_OFFSETS = {b"avcC": 7, b"hvcC": 16}
+
+
+def probe_level(path: str) -> Optional[str]:
+    """
+    Level of an MP4's H.264 or H.265 video track, read from the avcC/hvcC decoder
+    configuration in its moov box (ffmpeg's stream summary does not print it).
+    None for other containers and codecs, or if the file cannot be parsed.
+    """
+    try:
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return None
+                size, box = struct.unpack(">I4s", header)
+                header_size = 8
+                if size == 1:
+                    size, header_size = struct.unpack(">Q", f.read(8))[0], 16
+                if box == b"moov":
+                    # A size of 0 means the box runs to the end of the file
+                    moov = f.read(size - header_size) if size else f.read()
+                    break
+                if size < header_size:
+                    return None
+                f.seek(size - header_size, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+    for box, offset in _LEVEL_OFFSETS.items():
+        position = moov.find(box)
+        if position >= 0 and position + offset < len(moov):
+            return str(moov[position + offset])
+    return None
+
+
+def probe_video(path: str) -> Dict[str, Optional[str]]:
+    """
+    Read the stream parameters of a video file from ffmpeg's stream summary.
+    Returns the video codec, profile, level, pixel format (with its colour range, space and
+    field order), size, frame rate and time base plus the audio codec, sample rate and
+    channel layout (None when there is no audio, or when ffmpeg does not report a value).
+    """
+    summary = _ffmpeg_summary(path)
+    info: Dict[str, Optional[str]] = {
+        "video_codec": None, "profile": None, "level": None, "pix_fmt": None, "size": None, "fps": None, "time_base": None,
+        "audio_codec": None, "sample_rate": None, "channels": None,
+    }
+    for line in summary.splitlines():
+        video = re.search(r"Stream #\d+:\d+.*?: Video: (.*)", line)
+        if video and info["video_codec"] is None:
+            parts = _split_top_level(video.group(1))
+            info["video_codec"] = parts[0].split()[0]
+            # "h264 (High) (avc1 / 0x31637661)": the profile, then the container's codec tag
+            profiles = [name for name in re.findall(r"\(([^()]*)\)", parts[0]) if "/ 0x" not in name]
+            info["profile"] = profiles[0] if profiles else None
+            if len(parts) > 1:
+                info["pix_fmt"] = parts[1]
+            size = re.search(r"\b(\d{2,5}x\d{2,5})\b", video.group(1))
+            fps = re.search(r"([\d.]+) fps", video.group(1))
+            time_base = re.search(r"([\d.]+k?) tbn", video.group(1))
+            info["size"] = size.group(1) if size else None
+            info["fps"] = fps.group(1) if fps else None
+            info["time_base"] = time_base.group(1) if time_base else None
+        audio = re.search(r"Stream #\d+:\d+.*?: Audio: (.*)", line)
+        if audio and info["audio_codec"] is None:
+            parts = _split_top_level(audio.group(1))
+            info["audio_codec"] = parts[0].split()[0]
+            if len(parts) > 1:
+                info["sample_rate"] = parts[1].split()[0]
+            if len(parts) > 2:
+                info["channels"] = parts[2]
+    if info["video_codec"] is None:
+        raise ValueError(f"No video stream found in {path}")
+    info["level"] = probe_level(path)
+    return info
+
+
+def can_stream_copy(video_paths: List[str]) -> bool:
+    """
+    True when every clip shares the same codec parameters and can be concatenated without
+    re-encoding. Clips whose profile, level or pixel format cannot be read are re-encoded,
+    since a mismatch there would go unnoticed.
+    """
+    try:
+        probes = [probe_video(path) for path in video_paths]
+    except (OSError, ValueError) as e:
+        logger.warning("Could not probe clips for stream copy: %s", e)
+        return False
+    if any(probe[field] is None for probe in probes for field in ("profile", "level", "pix_fmt")):
+        logger.info("Clip profile, level or pixel format unknown, re-encoding")
+        return False
+    return len({tuple(sorted(probe.items())) for probe in probes}) == 1
+
+
+def concat_stream_copy(video_paths: List[str], output_path: str) -> bool:
+    """
+    Concatenate clips at the packet level with ffmpeg's concat demuxer (-c copy).
+    Returns False if ffmpeg fails, leaving no partial output behind.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as list_file:
+        for path in video_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+        list_path = list_file.name
+    try:
+        result = subprocess.run(
+            [
+                get_setting("FFMPEG_BINARY"), "-hide_banner", "-loglevel", "error", "-y",
+                "-f", "concat", "-safe", "0", "-i", list_path,
+                "-c", "copy", "-movflags", "+faststart", output_path,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    finally:
+        os.remove(list_path)
+    if result.returncode != 0:
+        logger.warning("Stream-copy concat failed, falling back to re-encode: %s", result.stderr.strip())
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return False
+    return True
+
+
+def reencode_concat(video_paths: List[str], output_path: str) -> None:
+    """Decode every clip with MoviePy and re-encode the concatenation."""
+    clips = [VideoFileClip(path) for path in video_paths]
+    final_clip = concatenate_videoclips(clips)
+    final_clip.write_videofile(
+        output_path,
+        threads=MERGE_ENCODER_THREADS,
+        preset=MERGE_PRESET,
+        bitrate=MERGE_BITRATE,
+    )
+
+    # Clean up
+    for clip in clips:
+        clip.close()
+    final_clip.close()
+
+
+def merge_videos(video_paths: List[str], output_path: str):
+    """Merge multiple videos into one"""
+    if MERGE_MODE != "reencode" and can_stream_copy(video_paths) and concat_stream_copy(video_paths, output_path):
+        logger.info("Merged %d clips by stream copy", len(video_paths))
+    else:
+        reencode_concat(video_paths, output_path)
+
+    # Remove the clips; any left behind are swept by the artifact store
+    for path in video_paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning("Could not remove clip %s: %s", path, e)
+
+
+def _worker_pool(max_workers: int) -> ProcessPoolExecutor:
+    # spawn keeps the worker processes independent of the server's threads; they run the
+    # side-effect-free merge_worker module, not the server's
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=merge_worker.initialize,
+    )
+
+
+class MergeExecutor:
+    """
+    Runs merges in a bounded pool of worker processes, away from the API process.
+    Large merges may use at most max_workers - 1 workers, so one long re-encode
+    never blocks short merges queued behind it. With a single worker, large merges
+    run one at a time in a process of their own instead, leaving the worker to short merges.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max(1, max_workers or MERGE_WORKERS)
+        self._pool = _worker_pool(self.max_workers)
+        self._large_pool = _worker_pool(1) if self.max_workers == 1 else self._pool
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._large_slots: Optional[asyncio.Semaphore] = None
+
+    def _ensure_semaphores(self) -> None:
+        # Created on first use so they belong to the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+            self._large_slots = asyncio.Semaphore(max(1, self.max_workers - 1))
+
+    async def merge(self, video_paths: List[str], output_path: str) -> None:
+        """Merge video_paths into output_path on a worker process."""
+        self._ensure_semaphores()
+        loop = asyncio.get_running_loop()
+        input_bytes = sum(os.path.getsize(path) for path in video_paths if os.path.exists(path))
+        if input_bytes < MERGE_LARGE_BYTES:
+            async with self._slots:
+                await loop.run_in_executor(self._pool, merge_worker.run_merge, video_paths, output_path)
+        elif self._large_pool is self._pool:
+            async with self._large_slots, self._slots:
+                await loop.run_in_executor(self._pool, merge_worker.run_merge, video_paths, output_path)
+        else:
+            async with self._large_slots:
+                await loop.run_in_executor(self._large_pool, merge_worker.run_merge, video_paths, output_path)
+
+    def shutdown(self) -> None:
+        """Drop queued merges and wait for running ones, so the worker processes exit cleanly."""
+        for pool in {self._pool, self._large_pool}:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+class IncrementalMerger:
+    """
+    Assembles a job's clips into a growing HLS playlist, in prompt order, as they finish.
+    Each clip is remuxed (no re-encode) into one MPEG-TS segment whose timestamps continue
+    from the previous segment, so a player can start on the first clip while later clips
+    are still being generated. Clips that arrive early wait until the clips before them are in.
+    The playlist's target duration is fixed from the clip length the provider was asked for,
+    since HLS players must not see it change while the playlist grows.
+    """
+
+    def __init__(self, output_dir: str, clip_count: int, clip_duration: float):
+        self.output_dir = output_dir
+        self.clip_count = clip_count
+        self.playlist_path = os.path.join(output_dir, HLS_PLAYLIST_NAME)
+        self._pending: Dict[int, Optional[str]] = {}
+        self._next_index = 0
+        self._offset = 0.0
+        self._entries: List[str] = []
+        self.target_duration = max(1, math.ceil(clip_duration))
+        self._previous_signature = None
+        self._lock = asyncio.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    async def add_clip(self, index: int, path: Optional[str]) -> None:
+        """Record a finished clip (path None if it failed) and append every clip that is now in order."""
+        async with self._lock:
+            self._pending[index] = path
+            while self._next_index in self._pending:
+                clip_path = self._pending.pop(self._next_index)
+                if clip_path:
+                    try:
+                        await asyncio.to_thread(self._append_segment, clip_path)
+                    except (OSError, ValueError) as e:
+                        # The final MP4 is still produced; only the early preview loses this clip
+                        logger.warning("Could not add clip %d to the stream: %s", self._next_index + 1, e)
+                self._next_index += 1
+            await asyncio.to_thread(self._write_playlist, self._next_index >= self.clip_count)
+
+    async def finish(self) -> None:
+        """Close the playlist once every clip has been handled."""
+        async with self._lock:
+            await asyncio.to_thread(self._write_playlist, True)
+
+    def _append_segment(self, clip_path: str) -> None:
+        segment_name = f"segment_{len(self._entries)}.ts"
+        duration = probe_duration(clip_path)
+        result = subprocess.run(
+            [
+                get_setting("FFMPEG_BINARY"), "-hide_banner", "-loglevel", "error", "-y",
+                "-i", clip_path, "-map", "0", "-c", "copy",
+                "-output_ts_offset", f"{self._offset:.3f}",
+                "-f", "mpegts", os.path.join(self.output_dir, segment_name),
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise ValueError(result.stderr.strip())
+
+        entry = ""
+        signature = probe_video(clip_path)
+        if self._previous_signature is not None and signature != self._previous_signature:
+            # Tell the player the stream parameters change at this segment
+            entry += "#EXT-X-DISCONTINUITY\n"
+        self._previous_signature = signature
+        entry += f"#EXTINF:{duration:.3f},\n{segment_name}\n"
+        self._entries.append(entry)
+        self._offset += duration
+        if round(duration) > self.target_duration:
+            logger.warning("Clip of %.3fs is longer than the stream's target duration of %ds", duration, self.target_duration)
+
+    def _write_playlist(self, complete: bool) -> None:
+        lines = [
+            "#EXTM3U\n",
+            "#EXT-X-VERSION:3\n",
+            "#EXT-X-PLAYLIST-TYPE:EVENT\n",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}\n",
+            "#EXT-X-MEDIA-SEQUENCE:0\n",
+            *self._entries,
+        ]
+        if complete:
+            lines.append("#EXT-X-ENDLIST\n")
+        # Write then rename so players never read a half-written playlist
+        temp_path = f"{self.playlist_path}.tmp"
+        with open(temp_path, "w") as f:
+            f.writelines(lines)
+        os.replace(temp_path, self.playlist_path)
@@ -0,0 +1,185 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.types import Receive, Scope, Send
+
+# Bytes read per step when streaming a video
+SERVE_CHUNK_SIZE = 256 * 1024
+# Seconds a video's cached metadata is trusted before it is checked against a fresh stat
+VIDEO_METADATA_REVALIDATE_SECONDS = float(os.getenv("VIDEO_METADATA_REVALIDATE_SECONDS", "5"))
+# Finished videos never change, so clients may cache them
+VIDEO_CACHE_CONTROL = "public, max-age=86400"
+
+
+class VideoFileInfo:
+    """Stat result of a finished video, cached so repeated requests skip the filesystem."""
+
+    def __init__(self, path: str, size: int, mtime: float):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.etag = f'"{int(mtime * 1000):x}-{size:x}"'
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.checked = time.monotonic()
+
+
+class VideoMetadataCache:
+    """
+    LRU map of video id -> VideoFileInfo for videos known to be ready.
+    Misses are not cached, because a missing video may still be merging. Hits are served
+    without touching the filesystem for revalidate_after seconds, then checked against a
+    fresh stat, since another worker's sweeper may have removed or replaced the file; this
+    worker's sweeper invalidates entries as it deletes their files.
+    """
+
+    def __init__(self, max_entries: int = 1024, revalidate_after: float = VIDEO_METADATA_REVALIDATE_SECONDS):
+        self.max_entries = max_entries
+        self.revalidate_after = revalidate_after
+        self._entries: "OrderedDict[str, VideoFileInfo]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, video_id: str, path: str) -> Optional[VideoFileInfo]:
+        with self._lock:
+            info = self._entries.get(video_id)
+            if info is not None and info.path == path and time.monotonic() - info.checked < self.revalidate_after:
+                self._entries.move_to_end(video_id)
+                return info
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(video_id)
+            return None
+        with self._lock:
+            info = self._entries.get(video_id)
+            if info is not None and (info.path, info.size, info.mtime) == (path, stat.st_size, stat.st_mtime):
+                info.checked = time.monotonic()
+                self._entries.move_to_end(video_id)
+                return info
+        info = VideoFileInfo(path, stat.st_size, stat.st_mtime)
+        with self._lock:
+            self._entries[video_id] = info
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return info
+
+    def invalidate(self, video_id: str) -> None:
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=" header into an inclusive (start, end).
+    Returns None for headers we do not handle (multiple ranges, other units), in which case the
+    whole file is sent. Raises ValueError when the range cannot be satisfied.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match:
+        return None
+    start_text, end_text = match.groups()
+    if not start_text and not end_text:
+        return None
+    if not start_text:
+        # Suffix range: the last N bytes
+        length = int(end_text)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(start_text)
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def _not_modified(request: Request, info: VideoFileInfo) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or info.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(info.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class FileRangeResponse(Response):
+    """Streams bytes [start, end] of a file in fixed-size chunks."""
+
+    def __init__(self, info: VideoFileInfo, start: int, end: int, status_code: int, headers: dict, media_type: str, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.info = info
+        self.start = start
+        self.end = end
+        self.send_body = send_body
+        self.headers["content-length"] = str(end - start + 1 if info.size else 0)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.send_body or self.info.size == 0:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        # Opened before the headers go out, so a file removed since the lookup still gets a clean 404
+        try:
+            f = await anyio.open_file(self.info.path, "rb")
+        except FileNotFoundError:
+            await JSONResponse({"detail": "Video not found"}, status_code=404)(scope, receive, send)
+            return
+
+        async with f:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await f.seek(self.start)
+            remaining = self.end - self.start + 1
+            while remaining > 0:
+                chunk = await f.read(min(SERVE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # The file shrank underneath us; end the response rather than hang
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def video_response(request: Request, info: VideoFileInfo, media_type: str = "video/mp4") -> Response:
+    """Build the response for a finished video, honouring conditional and Range requests."""
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": info.etag,
+        "last-modified": info.last_modified,
+        "cache-control": VIDEO_CACHE_CONTROL,
+    }
+    if _not_modified(request, info):
+        return Response(status_code=304, headers=headers)
+
+    send_body = request.method != "HEAD"
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() not in (info.etag, info.last_modified):
+        # The client's partial copy is stale: send the whole file instead
+        range_header = None
+
+    if range_header and info.size:
+        try:
+            byte_range = parse_range(range_header, info.size)
+        except ValueError:
+            headers["content-range"] = f"bytes */{info.size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{info.size}"
+            return FileRangeResponse(info, start, end, 206, headers, media_type, send_body)
+
+    return FileRangeResponse(info, 0, max(0, info.size - 1), 200, headers, media_type, send_body)
@@ -178,13 +178,14 @@ function App() {
         formData.append('files', image.file);
       });
       
-      await axios.post('/upload-images', formData);
+      const uploadResponse = await axios.post('/upload-images', formData);
       
       setStatusMessage(`Generating videos with ${apiProviders.find(p => p.id === selectedProvider)?.name}...`);
       
       // Generate video with API credentials
       const response = await axios.post('/generate-video', {
         prompts,
+        uploadId: uploadResponse.data.upload_id,
         provider: selectedProvider,
         apiKey: selectedProvider === 'kling' ? accessKeyId : apiKey,
         accessKeySecret: selectedProvider === 'kling' ? accessKeySecret : undefined,
@@ -195,14 +196,18 @@ function App() {
       
       setStatusMessage('Processing video...');
       
-      // Poll for video completion
+      // Poll the job until the merged video is ready or the job fails (used when events are unavailable)
       const checkVideoStatus = async () => {
         try {
-          const videoUrl = `/video/${videoId}`;
-          const response = await axios.head(videoUrl);
+          const response = await axios.get(`/jobs/${videoId}`);
+          const job = response.data;
           
-          if (response.status === 200) {
-            setGeneratedVideo(videoUrl);
+          if (job.status === 'completed') {
+            setGeneratedVideo(job.video_url);
+            setIsGenerating(false);
+            setStatusMessage('');
+          } else if (job.status === 'failed') {
+            setError(job.error || 'An error occurred while generating the video.');
             setIsGenerating(false);
             setStatusMessage('');
           } else {
@@ -219,7 +224,52 @@ function App() {
         }
       };
       
-      checkVideoStatus();
+      // Follow the job's progress events; fall back to polling if the stream is unavailable
+      if (typeof EventSource === 'undefined') {
+        checkVideoStatus();
+        return;
+      }
+      const clipCount = prompts.length;
+      const clipStates = {};
+      const events = new EventSource(`/jobs/${videoId}/events`);
+      
+      events.addEventListener('clip', (message) => {
+        const event = JSON.parse(message.data);
+        clipStates[event.index] = event.state;
+        const done = Object.values(clipStates).filter(state => state === 'ready').length;
+        const detail = event.state === 'downloading' && event.total
+          ? `downloading ${Math.round((event.bytes / event.total) * 100)}%`
+          : event.state;
+        setStatusMessage(`Clip ${event.index + 1}/${clipCount}: ${detail} (${done}/${clipCount} ready)`);
+      });
+      
+      events.addEventListener('status', (message) => {
+        const event = JSON.parse(message.data);
+        if (event.status === 'merging') {
+          setStatusMessage('Merging clips...');
+        }
+      });
+      
+      events.addEventListener('ready', (message) => {
+        const event = JSON.parse(message.data);
+        events.close();
+        setGeneratedVideo(event.video_url);
+        setIsGenerating(false);
+        setStatusMessage('');
+      });
+      
+      events.addEventListener('failed', (message) => {
+        const event = JSON.parse(message.data);
+        events.close();
+        setError(event.error || 'An error occurred while generating the video.');
+        setIsGenerating(false);
+        setStatusMessage('');
+      });
+      
+      events.onerror = () => {
+        events.close();
+        checkVideoStatus();
+      };
     } catch (error) {
       console.error('Error:', error);
       setError(error.response?.data?.detail || 'An error occurred while generating the video.');